@@ -0,0 +1,569 @@
+from array import array
+from globals import *
+from module import EventData, EventProcessor
+from rng import Sampler, BlockSampler
+
+"""     可插拔的结果统计
+每局结束后，名次被编码为一个整数（名次索引），再交给各个统计器。
+
+名次索引：按初始数据中的角色顺序，第i个角色的排名为r_i（可能并列），索引为 Σ (r_i - 1)·n^i，
+n为角色数。索引和名次一一对应，可用RankingIndex.decode还原。
+
+按名次索引统计的统计器（IndexAggregator）在add时只对索引计数，查询或合并时才展开，
+因此同时开启多个统计器的开销也很小。所有统计器都可以通过merge合并多个线程或机器的结果，通过toDict/fromDict传输
+"""
+
+
+class RankingIndex:
+    """
+    名次索引的编码和解码
+    """
+
+    def encode(self, data: EventData) -> int:
+        """
+        将结束的本局数据编码为名次索引
+
+        Args:
+            data (EventData): 结束的本局数据
+
+        Returns:
+            int: 名次索引
+        """
+        weights = self.__weights
+        index = 0
+        for role, ranking_num in data.rankingOfRoles().items():
+            index += (ranking_num - 1) * weights[role.name()]
+        return index
+    def encodeRanks(self, ranks: tuple[int, ...] | list[int]) -> int:
+        """
+        将按角色顺序排列的排名编码为名次索引
+
+        Args:
+            ranks (tuple[int, ...] | list[int]): 排名
+
+        Returns:
+            int: 名次索引
+        """
+        n = len(self.__names)
+        index = 0
+        for i in range(n - 1, -1, -1):
+            index = index * n + ranks[i] - 1
+        return index
+    def decode(self, index: int) -> tuple[int, ...]:
+        """
+        将名次索引还原为按角色顺序排列的排名
+
+        Args:
+            index (int): 名次索引
+
+        Returns:
+            tuple[int, ...]: 排名元组
+        """
+        ranks = self.__decoded.get(index)
+        if ranks is None:
+            n = len(self.__names)
+            value = index
+            digits: list[int] = []
+            for i in range(n):
+                value, digit = divmod(value, n)
+                digits.append(digit + 1)
+            ranks = self.__decoded[index] = tuple(digits)
+        return ranks
+    def names(self) -> list[str]:
+        """
+        返回角色名顺序
+
+        Returns:
+            list[str]: 角色名列表
+        """
+        return self.__names
+
+    @classmethod
+    def of(cls, processor: EventProcessor) -> "RankingIndex":
+        """
+        按事件处理器当前的角色配置创建
+
+        Args:
+            processor (EventProcessor): 事件处理器
+
+        Returns:
+            RankingIndex: 名次索引
+        """
+        return cls([role.name() for role in processor.initData2().roles()])
+
+    def __init__(self, names: list[str]) -> None:
+        """
+        名次索引，一般通过RankingIndex.of创建
+
+        Args:
+            names (list[str]): 角色名顺序，角色名不能重复
+        """
+        if len(set(names)) != len(names):
+            raise ValueError("角色名重复，无法编码名次")
+        self.__names = list(names)
+        n = len(names)
+        self.__weights: dict[str, int] = {name: n ** i for i, name in enumerate(names)}
+        self.__decoded: dict[int, tuple[int, ...]] = {}
+
+
+class Aggregator:
+    """
+    统计器接口
+
+    子类需要实现add、merge、empty、toDict，以及类方法fromDict
+    """
+
+    def add(self, index: int, data: EventData):
+        """
+        计入一局
+
+        Args:
+            index (int): 本局的名次索引
+            data (EventData): 结束的本局数据
+        """
+        raise NotImplementedError
+    def merge(self, other: "Aggregator") -> "Aggregator":
+        """
+        将同类型的另一个统计合并到自身
+
+        Args:
+            other (Aggregator): 另一个统计
+
+        Returns:
+            Aggregator: 自身
+        """
+        raise NotImplementedError
+    def empty(self) -> "Aggregator":
+        """
+        返回参数相同的空统计，一般用于每个线程各自统计后合并
+
+        Returns:
+            Aggregator: 空统计
+        """
+        raise NotImplementedError
+    def races(self) -> int:
+        """
+        返回统计的局数
+        """
+        raise NotImplementedError
+
+    def toDict(self) -> dict:
+        """
+        转为可JSON序列化的字典
+
+        Returns:
+            dict: 字典
+        """
+        raise NotImplementedError
+    @classmethod
+    def fromDict(cls, value: dict) -> "Aggregator":
+        """
+        从toDict的结果恢复
+
+        Args:
+            value (dict): 字典
+
+        Returns:
+            Aggregator: 统计
+        """
+        raise NotImplementedError
+
+    def __init__(self, names: list[str]) -> None:
+        self._names = list(names)
+        self._ranking = RankingIndex(self._names)
+
+
+class IndexAggregator(Aggregator):
+    """
+    只依赖名次的统计器
+
+    add时只对名次索引计数，需要结果时再调用_fold把每种名次展开到具体统计中
+    """
+
+    def add(self, index: int, data: EventData | None = None):
+        pending = self._pending
+        pending[index] = pending.get(index, 0) + 1
+    def merge(self, other: "Aggregator") -> "Aggregator":
+        if not isinstance(other, type(self)) or other._names != self._names:
+            raise ValueError("统计器类型或角色列表不同，无法合并")
+        self._flush()
+        other._flush()
+        self._mergeFolded(other)
+        return self
+    def races(self) -> int:
+        self._flush()
+        return self._races
+
+    def _flush(self):
+        """
+        将计数展开到具体统计中
+        """
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+        for index, count in pending.items():
+            self._races += count
+            self._fold(self._ranking.decode(index), index, count)
+    def _fold(self, ranks: tuple[int, ...], index: int, count: int):
+        """
+        将count局名次为ranks的结果计入统计
+
+        Args:
+            ranks (tuple[int, ...]): 按角色顺序排列的排名
+            index (int): 名次索引
+            count (int): 局数
+        """
+        raise NotImplementedError
+    def _mergeFolded(self, other: "IndexAggregator"):
+        """
+        合并两个已经展开的统计
+        """
+        raise NotImplementedError
+
+    def empty(self) -> "Aggregator":
+        return type(self)(self._names)
+
+    def __init__(self, names: list[str]) -> None:
+        super().__init__(names)
+        self._pending: dict[int, int] = {}
+        self._races = 0
+
+
+class OrderHistogram(IndexAggregator):
+    """
+    完整名次分布
+    """
+
+    def counts(self) -> dict[tuple[int, ...], int]:
+        """
+        返回每种完整名次出现的次数
+
+        Returns:
+            dict[tuple[int, ...], int]: 按角色顺序排列的排名: 次数
+        """
+        self._flush()
+        decode = self._ranking.decode
+        return {decode(index): count for index, count in self.__histogram.items()}
+    def probability(self, ranks: dict[str, int]) -> float:
+        """
+        返回某一完整名次的概率
+
+        Args:
+            ranks (dict[str, int]): 角色名: 排名，需要包含所有角色
+
+        Returns:
+            float: 概率
+        """
+        self._flush()
+        if not self._races:
+            return 0.0
+        index = sum((ranks[name] - 1) * len(self._names) ** i for i, name in enumerate(self._names))
+        return self.__histogram.get(index, 0) / self._races
+    def rankCounts(self) -> dict[str, dict[int, int]]:
+        """
+        转为与runs相同格式的结果
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        final_return: dict[str, dict[int, int]] = {name: {} for name in self._names}
+        for ranks, count in self.counts().items():
+            for name, ranking_num in zip(self._names, ranks):
+                final_return[name][ranking_num] = final_return[name].get(ranking_num, 0) + count
+        return final_return
+
+    def _fold(self, ranks: tuple[int, ...], index: int, count: int):
+        self.__histogram[index] = self.__histogram.get(index, 0) + count
+    def _mergeFolded(self, other: "OrderHistogram"):
+        self._races += other._races
+        for index, count in other.__histogram.items():
+            self.__histogram[index] = self.__histogram.get(index, 0) + count
+
+    def toDict(self) -> dict:
+        self._flush()
+        return {"names": self._names, "races": self._races, "histogram": [[index, count] for index, count in self.__histogram.items()]}
+    @classmethod
+    def fromDict(cls, value: dict) -> "OrderHistogram":
+        aggregator = cls(value["names"])
+        aggregator._races = value["races"]
+        aggregator.__histogram = {index: count for index, count in value["histogram"]}
+        return aggregator
+
+    def __init__(self, names: list[str]) -> None:
+        super().__init__(names)
+        self.__histogram: dict[int, int] = {}
+
+
+class BeatMatrix(IndexAggregator):
+    """
+    两两胜负矩阵：角色i排名严格高于角色j的局数
+    """
+
+    def beats(self, name_a: str, name_b: str) -> int:
+        """
+        返回name_a排名严格高于name_b的局数
+
+        Args:
+            name_a (str): 角色名
+            name_b (str): 角色名
+
+        Returns:
+            int: 局数
+        """
+        self._flush()
+        n = len(self._names)
+        return self.__matrix[self._names.index(name_a) * n + self._names.index(name_b)]
+    def beatProbability(self, name_a: str, name_b: str) -> float:
+        """
+        返回name_a排名严格高于name_b的概率
+
+        Args:
+            name_a (str): 角色名
+            name_b (str): 角色名
+
+        Returns:
+            float: 概率
+        """
+        races = self.races()
+        return self.beats(name_a, name_b) / races if races else 0.0
+    def matrix(self) -> list[list[int]]:
+        """
+        返回整个矩阵，行列按角色顺序
+
+        Returns:
+            list[list[int]]: 矩阵
+        """
+        self._flush()
+        n = len(self._names)
+        return [list(self.__matrix[i * n:(i + 1) * n]) for i in range(n)]
+
+    def _fold(self, ranks: tuple[int, ...], index: int, count: int):
+        n = len(ranks)
+        matrix = self.__matrix
+        for i in range(n):
+            for j in range(n):
+                if ranks[i] < ranks[j]:
+                    matrix[i * n + j] += count
+    def _mergeFolded(self, other: "BeatMatrix"):
+        self._races += other._races
+        for i, value in enumerate(other.__matrix):
+            self.__matrix[i] += value
+
+    def toDict(self) -> dict:
+        self._flush()
+        return {"names": self._names, "races": self._races, "matrix": self.__matrix.tolist()}
+    @classmethod
+    def fromDict(cls, value: dict) -> "BeatMatrix":
+        aggregator = cls(value["names"])
+        aggregator._races = value["races"]
+        aggregator.__matrix = array("q", value["matrix"])
+        return aggregator
+
+    def __init__(self, names: list[str]) -> None:
+        super().__init__(names)
+        self.__matrix = array("q", bytes(8 * len(names) ** 2))
+
+
+class TieGroups(IndexAggregator):
+    """
+    并列统计：同一次进入终点（被setRoleInEndpoint一起设置）的角色获得相同排名，称为一组
+
+    统计每种组大小出现的次数、每个角色与他人并列的局数、每两个角色并列的局数
+    """
+
+    def sizeHistogram(self) -> dict[int, int]:
+        """
+        返回每种组大小出现的次数（包括大小为1的组）
+
+        Returns:
+            dict[int, int]: 组大小: 次数
+        """
+        self._flush()
+        return {size: count for size, count in enumerate(self.__sizes) if count}
+    def tiedRaces(self, name: str) -> int:
+        """
+        返回角色与至少一个其他角色并列的局数
+
+        Args:
+            name (str): 角色名
+
+        Returns:
+            int: 局数
+        """
+        self._flush()
+        return self.__tied[self._names.index(name)]
+    def together(self, name_a: str, name_b: str) -> int:
+        """
+        返回两个角色并列的局数
+
+        Args:
+            name_a (str): 角色名
+            name_b (str): 角色名
+
+        Returns:
+            int: 局数
+        """
+        self._flush()
+        n = len(self._names)
+        return self.__pairs[self._names.index(name_a) * n + self._names.index(name_b)]
+
+    def _fold(self, ranks: tuple[int, ...], index: int, count: int):
+        n = len(ranks)
+        groups: dict[int, list[int]] = {}
+        for i, ranking_num in enumerate(ranks):
+            groups.setdefault(ranking_num, []).append(i)
+        for members in groups.values():
+            self.__sizes[len(members)] += count
+            if len(members) < 2:
+                continue
+            for i in members:
+                self.__tied[i] += count
+                for j in members:
+                    if i != j:
+                        self.__pairs[i * n + j] += count
+    def _mergeFolded(self, other: "TieGroups"):
+        self._races += other._races
+        for mine, theirs in ((self.__sizes, other.__sizes), (self.__tied, other.__tied), (self.__pairs, other.__pairs)):
+            for i, value in enumerate(theirs):
+                mine[i] += value
+
+    def toDict(self) -> dict:
+        self._flush()
+        return {
+            "names": self._names, "races": self._races,
+            "sizes": self.__sizes.tolist(), "tied": self.__tied.tolist(), "pairs": self.__pairs.tolist(),
+        }
+    @classmethod
+    def fromDict(cls, value: dict) -> "TieGroups":
+        aggregator = cls(value["names"])
+        aggregator._races = value["races"]
+        aggregator.__sizes = array("q", value["sizes"])
+        aggregator.__tied = array("q", value["tied"])
+        aggregator.__pairs = array("q", value["pairs"])
+        return aggregator
+
+    def __init__(self, names: list[str]) -> None:
+        super().__init__(names)
+        n = len(names)
+        self.__sizes = array("q", bytes(8 * (n + 1)))
+        self.__tied = array("q", bytes(8 * n))
+        self.__pairs = array("q", bytes(8 * n * n))
+
+
+class RoundsHistogram(Aggregator):
+    """
+    每局回合数的分布
+    """
+
+    def add(self, index: int, data: EventData):
+        rounds = data.round()
+        self.__histogram[rounds] = self.__histogram.get(rounds, 0) + 1
+        self.__races += 1
+    def merge(self, other: "Aggregator") -> "Aggregator":
+        if not isinstance(other, RoundsHistogram):
+            raise ValueError("统计器类型不同，无法合并")
+        self.__races += other.__races
+        for rounds, count in other.__histogram.items():
+            self.__histogram[rounds] = self.__histogram.get(rounds, 0) + count
+        return self
+    def empty(self) -> "Aggregator":
+        return RoundsHistogram(self._names)
+    def races(self) -> int:
+        return self.__races
+
+    def histogram(self) -> dict[int, int]:
+        """
+        返回回合数: 局数
+
+        Returns:
+            dict[int, int]: 回合数分布
+        """
+        return dict(sorted(self.__histogram.items()))
+    def mean(self) -> float:
+        """
+        返回平均回合数
+
+        Returns:
+            float: 平均回合数
+        """
+        if not self.__races:
+            return 0.0
+        return sum(rounds * count for rounds, count in self.__histogram.items()) / self.__races
+
+    def toDict(self) -> dict:
+        return {"names": self._names, "races": self.__races, "histogram": [[rounds, count] for rounds, count in self.__histogram.items()]}
+    @classmethod
+    def fromDict(cls, value: dict) -> "RoundsHistogram":
+        aggregator = cls(value["names"])
+        aggregator.__races = value["races"]
+        aggregator.__histogram = {rounds: count for rounds, count in value["histogram"]}
+        return aggregator
+
+    def __init__(self, names: list[str]) -> None:
+        super().__init__(names)
+        self.__histogram: dict[int, int] = {}
+        self.__races = 0
+
+
+def aggregateRuns(processor: EventProcessor,
+                  aggregators: list[Aggregator],
+                  times: int,
+                  sampler: Sampler | None = None) -> list[Aggregator]:
+    """
+    多次模拟运行，每局的结果交给所有统计器
+
+    例：
+        names = RankingIndex.of(ep).names()
+        orders, beats, rounds = aggregateRuns(ep, [OrderHistogram(names), BeatMatrix(names), RoundsHistogram(names)], 10000)
+        beats.beatProbability("菲比", "赞妮")
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        aggregators (list[Aggregator]): 统计器，角色顺序需与处理器一致
+        times (int): 运行次数
+        sampler (Sampler | None, optional): 采样器，不填则使用处理器的采样器. Defaults to None.
+
+    Returns:
+        list[Aggregator]: 传入的统计器
+    """
+    if sampler is None:
+        sampler = processor.sampler()
+    encode = RankingIndex.of(processor).encode
+    adds = [aggregator.add for aggregator in aggregators]
+    for i in range(times):
+        data = processor.runRace(processor.newRaceData(sampler))
+        index = encode(data)
+        for add in adds:
+            add(index, data)
+    return aggregators
+
+
+def aggregateSeedRange(processor: EventProcessor,
+                       aggregators: list[Aggregator],
+                       start: int,
+                       stop: int) -> list[Aggregator]:
+    """
+    按种子区间多次模拟运行，第i局使用种子i，与EventProcessor.runsSeedRange相同
+
+    各区间的统计可以在不同线程或机器上分别得到，再用merge合并
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        aggregators (list[Aggregator]): 统计器
+        start (int): 起始种子（包含）
+        stop (int): 结束种子（不包含）
+
+    Returns:
+        list[Aggregator]: 传入的统计器
+    """
+    sampler = BlockSampler(size = 256)
+    encode = RankingIndex.of(processor).encode
+    adds = [aggregator.add for aggregator in aggregators]
+    for seed in range(start, stop):
+        sampler.seed(seed)
+        data = processor.runRace(processor.newRaceData(sampler))
+        index = encode(data)
+        for add in adds:
+            add(index, data)
+    return aggregators
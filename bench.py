@@ -0,0 +1,143 @@
+import tracemalloc, gc
+from globals import *
+from module import EventProcessor, EventData, Role, Skill, EventTrigger
+from rng import BlockSampler
+
+"""     基准测试
+python bench.py 运行全部基准测试并输出结果
+"""
+
+
+def allocationBenchmark(processor: EventProcessor, races: int = 1000, forks: int = 1000, seed: int = 0) -> dict[str, float]:
+    """
+    使用tracemalloc统计每局的内存分配
+
+    in_flight_bytes / in_flight_blocks: 同时持有forks份刚开始的本局数据时，每份占用的字节数和内存块数
+    race_blocks: 模拟一局净新增的内存块数（对局结束后仍被结果数据持有的部分）
+    race_peak_bytes: 模拟一局过程中的峰值额外内存
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        races (int, optional): 统计峰值的局数. Defaults to 1000.
+        forks (int, optional): 同时持有的本局数据份数. Defaults to 1000.
+        seed (int, optional): 种子. Defaults to 0.
+
+    Returns:
+        dict[str, float]: 统计结果
+    """
+    sampler = BlockSampler(seed)
+    processor.runRace(processor.newRaceData(sampler))       # 预热缓存
+    gc.collect()
+    tracemalloc.start()
+    try:
+        # 同时持有多份对局数据
+        before = tracemalloc.take_snapshot()
+        base_bytes = tracemalloc.get_traced_memory()[0]
+        holder: list[EventData] = [processor.gameStart(processor.newRaceData(sampler)) for _ in range(forks)]
+        after = tracemalloc.take_snapshot()
+        in_flight_bytes = (tracemalloc.get_traced_memory()[0] - base_bytes) / forks
+        in_flight_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename")) / forks
+        del holder, before, after
+        gc.collect()
+
+        # 每局的分配
+        before = tracemalloc.take_snapshot()
+        finished: list[EventData] = []
+        peak = 0
+        for i in range(races):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            finished.append(processor.runRace(processor.newRaceData(sampler)))
+            peak += tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot()
+        race_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename")) / races
+        del finished, before, after
+    finally:
+        tracemalloc.stop()
+    return {
+        "in_flight_bytes": in_flight_bytes,
+        "in_flight_blocks": in_flight_blocks,
+        "race_blocks": race_blocks,
+        "race_peak_bytes": peak / races,
+    }
+
+
+def fieldProcessor(size: int, length: int = 60) -> EventProcessor:
+    """
+    用于压力测试的大量角色：依次轮换菲比、布兰特、洛可可式的技能和赞妮式的移动分布
+    """
+    ep = EventProcessor(length)
+    for i in range(size):
+        role = ep.addRole(Role(f"角色{i}"))
+        match i % 4:
+            case 0:
+                role.appSkill(Skill(EventTrigger.move_before, 0.5, 1, None, f"角色{i}的技能"))
+            case 1:
+                role.appSkill(Skill(EventTrigger.move_before,
+                                    lambda data: data.moveOrder()[0] is data.nowRole2(), 2, None, f"角色{i}的技能"))
+            case 2:
+                role.appSkill(Skill(EventTrigger.move_before,
+                                    lambda data: data.moveOrder()[-1] is data.nowRole2(), 2, None, f"角色{i}的技能"))
+            case 3:
+                role.setMoveDistribution([1, 3])
+    return ep
+
+
+class _CountingSampler(BlockSampler):
+    """
+    记录抽取移动格数的次数，每次移动抽取一次，即实际的移动次数
+    """
+
+    def moveNum(self, role: Role) -> int:
+        self.moves += 1
+        return super().moveNum(role)
+
+    def __init__(self, seed: int | None = None) -> None:
+        super().__init__(seed)
+        self.moves = 0
+
+
+def scalingBenchmark(sizes: tuple[int, ...] = (4, 10, 30, 60, 100), moves: int = 200000, seed: int = 0) -> dict[int, dict[str, float]]:
+    """
+    不同角色数量下每回合和每次移动的用时，每次移动的用时不随角色数量增长时每回合的用时为线性
+
+    Args:
+        sizes (tuple[int, ...], optional): 角色数量. Defaults to (4, 10, 30, 60, 100).
+        moves (int, optional): 每种数量大约模拟的移动次数. Defaults to 200000.
+        seed (int, optional): 种子. Defaults to 0.
+
+    Returns:
+        dict[int, dict[str, float]]: 角色数量对应 round_us（每回合微秒）和 move_us（每次移动微秒）
+    """
+    final_return: dict[int, dict[str, float]] = {}
+    for size in sizes:
+        processor = fieldProcessor(size)
+        sampler = _CountingSampler(seed)
+        rounds = 0
+        startTime = time.perf_counter()
+        while sampler.moves < moves:
+            data = processor.runRace(processor.newRaceData(sampler))
+            rounds += data.round()
+        elapsed = time.perf_counter() - startTime
+        moved = sampler.moves
+        final_return[size] = {"round_us": elapsed / rounds * 1e6, "move_us": elapsed / moved * 1e6}
+    return final_return
+
+
+def exampleProcessor(length: int = 23) -> EventProcessor:
+    ep = EventProcessor(length)
+    ep.addPhoebe()
+    ep.addZaNi()
+    ep.addBrant()
+    ep.addRoccia()
+    return ep
+
+
+if __name__ == "__main__":
+    result = allocationBenchmark(exampleProcessor())
+    print("内存分配（每局）：")
+    for key, value in result.items():
+        print(f"  {key}: {value:.1f}")
+    print("角色数量与每回合用时：")
+    for size, value in scalingBenchmark().items():
+        print(f"  {size}: 每回合{value['round_us']:.1f}微秒，每次移动{value['move_us']:.2f}微秒")
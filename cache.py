@@ -0,0 +1,380 @@
+import json, hashlib, os, tempfile
+from types import CodeType, ModuleType
+from globals import *
+from module import EventProcessor, Role, Skill
+
+"""     结果缓存
+将runsSeedRange的结果按场景指纹保存在本地目录中，相同的问题再次出现时直接返回。
+
+场景指纹由以下内容计算：
+    角色和技能的声明（名字、移动分布、技能时机/条件/效果，函数取其字节码、闭包中的值和引用的全局变量的当前值）；
+    赛道（长度和特殊格子）；
+    引擎版本（模拟相关源码的哈希）和随机数配置（每局按种子重设的成块采样器）；
+    是否使用残局表及残局表的摘要（深度和已求解的状态）；
+    调用者给出的extra。
+函数读取的其他外部状态（如全局对象的属性、文件）无法从声明中得到，它们改变时需要换一个extra，否则会取到旧结果。
+
+每局的种子是固定的，因此缓存按种子区间分段保存：
+请求[seed, seed + times)时，已缓存的段直接合并，只模拟没有覆盖的部分，再把新的段写回。
+从100万局追加到500万局时只需模拟新增的400万局，结果与一次模拟500万局完全相同。
+
+写回时在文件锁内重新读取并合并段，多个进程同时写同一指纹不会丢失对方的段。
+缓存目录超过大小上限时，按最近使用时间删除最旧的文件（刚写入的文件除外）。
+"""
+
+
+CACHE_FORMAT = 1
+ENGINE_FILES = ("module.py", "rng.py", "track.py", "endgame.py")
+
+
+def _engineVersion() -> str:
+    """
+    模拟相关源码的哈希
+    """
+    digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ENGINE_FILES:
+        with open(os.path.join(here, name), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def _globalNames(code: CodeType) -> list[str]:
+    """
+    代码（包括其中嵌套的函数）中用到的名字，其中在函数全局变量里的就是引用的全局变量
+    """
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names.extend(_globalNames(const))
+    return names
+
+
+def _describeValue(value: Any, seen: frozenset[int] = frozenset()) -> Any:
+    """
+    将技能的条件、效果或闭包中的值转为可以比较的描述
+
+    函数还记录其引用的全局变量的当前值，seen为正在描述的函数，避免递归引用时无限展开
+    """
+    match value:
+        case None | bool() | int() | float() | str():
+            return value
+        case tuple() | list():
+            return [_describeValue(item, seen) for item in value]
+        case dict():
+            return {str(key): _describeValue(item, seen) for key, item in value.items()}
+        case set() | frozenset():
+            return sorted((_describeValue(item, seen) for item in value), key = repr)
+        case CodeType():
+            return {
+                "code": value.co_code.hex(),
+                "names": list(value.co_names),
+                "consts": [_describeValue(const, seen) for const in value.co_consts],
+            }
+        case ModuleType():
+            return {"module": value.__name__}
+        case _ if callable(value) and hasattr(value, "__code__"):
+            if id(value) in seen:
+                return "self"
+            seen = seen | {id(value)}
+            closure: list[Any] = []
+            for cell in getattr(value, "__closure__", None) or ():
+                try:
+                    contents = cell.cell_contents
+                except ValueError:
+                    contents = None
+                closure.append(_describeValue(contents, seen))
+            namespace = getattr(value, "__globals__", {})
+            referenced = {
+                name: _describeValue(namespace[name], seen)
+                for name in dict.fromkeys(_globalNames(value.__code__)) if name in namespace
+            }
+            return {"function": _describeValue(value.__code__, seen), "closure": closure, "globals": referenced}
+        case Role():
+            return {"role": value.name()}
+        case Skill():
+            return {"skill": value.name()}
+        case _:
+            return {"type": type(value).__qualname__}
+
+
+def describeProcessor(processor: EventProcessor) -> dict:
+    """
+    将事件处理器的角色配置和赛道转为可JSON序列化的声明
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+
+    Returns:
+        dict: 声明
+    """
+    data = processor.initData2()
+    track = data.track()
+    roles = []
+    for role in data.roles():
+        roles.append({
+            "name": role.name(),
+            "move": _describeValue(role.moveDistribution()) if role.moveDistribution() is not None
+                    else _describeValue(role._getMoveNum),
+            "skills": [
+                {
+                    "name": skill.name(),
+                    "trigger": skill.trigger().name,
+                    "condition": _describeValue(skill.condition()),
+                    "effect": _describeValue(skill.effect()),
+                    "target": None if skill.target() is None else skill.target().name(),   # type: ignore
+                }
+                for skill in role.skills()
+            ],
+        })
+    return {
+        "roles": roles,
+        "track": {
+            "length": track.length(),
+            "effects": [[cell, type(effect).__qualname__, effect.name()] for cell, effect in track.effects().items()],
+        },
+    }
+
+
+def fingerprint(processor: EventProcessor, extra: str = "", endgame: bool = False) -> str:
+    """
+    计算场景指纹
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        extra (str, optional): 额外的键，技能依赖声明中看不到的外部状态时，用它区分不同的状态. Defaults to "".
+        endgame (bool, optional): 模拟时是否使用处理器设置的残局表，见EventProcessor.setEndgameTable. Defaults to False.
+
+    Returns:
+        str: 指纹
+    """
+    table = processor.endgameTable() if endgame else None
+    scenario = {
+        "scenario": describeProcessor(processor),
+        "engine": _engineVersion(),
+        "rng": {"sampler": "BlockSampler", "size": 256, "seeding": "per-race"},
+        "endgame": None if table is None else {"depth": table.depth(), "digest": table.digest()},
+        "extra": extra,
+    }
+    return hashlib.sha256(json.dumps(scenario, sort_keys = True, ensure_ascii = False).encode("utf-8")).hexdigest()
+
+
+class _FileLock:
+    """
+    跨进程的文件锁，保护缓存文件的读取-合并-写回
+    """
+
+    def __enter__(self) -> "_FileLock":
+        os.makedirs(os.path.dirname(self.__path), exist_ok = True)
+        self.__file = open(self.__path, "a+b")
+        if os.name == "nt":
+            import msvcrt
+
+            while(True):
+                try:
+                    msvcrt.locking(self.__file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:         # LK_LOCK重试约10秒后失败，继续等待
+                    continue
+        else:
+            import fcntl
+
+            fcntl.flock(self.__file.fileno(), fcntl.LOCK_EX)
+        return self
+    def __exit__(self, *args):
+        if os.name == "nt":
+            import msvcrt
+
+            self.__file.seek(0)
+            msvcrt.locking(self.__file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+        self.__file.close()
+
+    def __init__(self, path: str) -> None:
+        self.__path = path
+
+
+class ResultCache:
+    """
+    本地结果缓存
+
+    例：
+        cache = ResultCache()
+        result = cache.runs(ep, 1000000)        # 第一次模拟
+        result = cache.runs(ep, 5000000)        # 只模拟新增的400万局
+    """
+
+# 读写
+    def __path(self, key: str) -> str:
+        return os.path.join(self.__directory, key + ".json")
+    def __load(self, key: str) -> list[tuple[int, int, dict[str, dict[int, int]]]]:
+        """
+        读取指纹对应的所有段，没有缓存时返回空列表
+        """
+        path = self.__path(key)
+        try:
+            with open(path, "r", encoding = "utf-8") as file:
+                value = json.load(file)
+        except (OSError, ValueError):
+            return []
+        if value.get("format") != CACHE_FORMAT:
+            return []
+        os.utime(path)                      # 记录最近使用时间
+        return [
+            (start, stop, {name: {int(ranking_num): count for ranking_num, count in counts.items()}
+                           for name, counts in result.items()})
+            for start, stop, result in value["segments"]
+        ]
+    def __save(self, key: str, segments: list[tuple[int, int, dict[str, dict[int, int]]]]):
+        """
+        写入指纹对应的所有段，先写临时文件再替换，避免写到一半的文件被读取
+        """
+        os.makedirs(self.__directory, exist_ok = True)
+        value = {"format": CACHE_FORMAT, "segments": [[start, stop, result] for start, stop, result in segments]}
+        handle, temp_path = tempfile.mkstemp(dir = self.__directory, suffix = ".tmp")
+        try:
+            with os.fdopen(handle, "w", encoding = "utf-8") as file:
+                json.dump(value, file, ensure_ascii = False)
+            os.replace(temp_path, self.__path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict(key + ".json")
+
+# 查询
+    def get(self, processor: EventProcessor, times: int, seed: int = 0, extra: str = "",
+            endgame: bool = False) -> dict[str, dict[int, int]] | None:
+        """
+        只从缓存中取结果，不模拟
+
+        Args:
+            processor (EventProcessor): 已添加角色的事件处理器
+            times (int): 运行次数
+            seed (int, optional): 起始种子. Defaults to 0.
+            extra (str, optional): 额外的键，见fingerprint. Defaults to "".
+            endgame (bool, optional): 是否使用残局表，见fingerprint. Defaults to False.
+
+        Returns:
+            dict[str, dict[int, int]] | None: 运行结果，没有完全覆盖时为None
+        """
+        stop = seed + times
+        covered = seed
+        results: list[dict[str, dict[int, int]]] = []
+        for start, end, result in sorted(self.__load(fingerprint(processor, extra, endgame)), key = lambda segment: (segment[0], -segment[1])):
+            if start == covered and end <= stop:
+                results.append(result)
+                covered = end
+        if covered != stop:
+            return None
+        return EventProcessor.mergeResults(results)
+    def runs(self, processor: EventProcessor, times: int, seed: int = 0, extra: str = "",
+             endgame: bool = False) -> dict[str, dict[int, int]]:
+        """
+        返回与processor.runsSeedRange(seed, seed + times, endgame = endgame)相同的结果，已缓存的部分不再模拟
+
+        Args:
+            processor (EventProcessor): 已添加角色的事件处理器
+            times (int): 运行次数
+            seed (int, optional): 起始种子. Defaults to 0.
+            extra (str, optional): 额外的键，技能依赖声明中看不到的外部状态时使用，见fingerprint. Defaults to "".
+            endgame (bool, optional): 是否使用处理器设置的残局表，使用时残局表的内容计入指纹. Defaults to False.
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        key = fingerprint(processor, extra, endgame)
+        segments = self.__load(key)
+        stop = seed + times
+
+        # 选出区间内互不重叠的已缓存段，空隙部分模拟
+        covered = seed
+        results: list[dict[str, dict[int, int]]] = []
+        new_segments: list[tuple[int, int, dict[str, dict[int, int]]]] = []
+        for start, end, result in sorted(segments, key = lambda segment: (segment[0], -segment[1])):
+            if start < covered or end > stop:
+                continue
+            if start > covered:
+                new_segments.append((covered, start, processor.runsSeedRange(covered, start, endgame = endgame)))
+                results.append(new_segments[-1][2])
+            results.append(result)
+            covered = end
+        if covered < stop:
+            new_segments.append((covered, stop, processor.runsSeedRange(covered, stop, endgame = endgame)))
+            results.append(new_segments[-1][2])
+        self.__hits += times - sum(end - start for start, end, _ in new_segments)
+        self.__misses += sum(end - start for start, end, _ in new_segments)
+
+        if new_segments:
+            # 在锁内重新读取，保留其他进程在模拟期间写入的段
+            with _FileLock(os.path.join(self.__directory, "cache.lock")):
+                merged = self.__load(key)
+                known = {(start, end) for start, end, _ in merged}
+                self.__save(key, merged + [segment for segment in new_segments if (segment[0], segment[1]) not in known])
+        return EventProcessor.mergeResults(results)
+
+# 管理
+    def size(self) -> int:
+        """
+        返回缓存目录的总字节数
+
+        Returns:
+            int: 字节数
+        """
+        if not os.path.isdir(self.__directory):
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(self.__directory) if entry.name.endswith(".json"))
+    def evict(self, keep: str | None = None):
+        """
+        缓存超过大小上限时，按最近使用时间删除最旧的文件
+
+        Args:
+            keep (str | None, optional): 不删除的文件名，如刚写入的文件. Defaults to None.
+        """
+        if not os.path.isdir(self.__directory):
+            return
+        total = self.size()
+        entries = sorted(
+            (entry for entry in os.scandir(self.__directory) if entry.name.endswith(".json") and entry.name != keep),
+            key = lambda entry: entry.stat().st_mtime,
+        )
+        for entry in entries:
+            if total <= self.__maxBytes:
+                break
+            total -= entry.stat().st_size
+            logger.info(f"删除缓存{entry.name}")
+            os.remove(entry.path)
+    def clear(self):
+        """
+        删除所有缓存
+        """
+        if not os.path.isdir(self.__directory):
+            return
+        for entry in os.scandir(self.__directory):
+            if entry.name.endswith(".json"):
+                os.remove(entry.path)
+    def stats(self) -> tuple[int, int]:
+        """
+        返回本对象命中和模拟的局数
+
+        Returns:
+            tuple[int, int]: (命中局数, 模拟局数)
+        """
+        return self.__hits, self.__misses
+
+    def __init__(self, directory: str | None = None, max_bytes: int = 64 << 20) -> None:
+        """
+        本地结果缓存
+
+        Args:
+            directory (str | None, optional): 缓存目录，不填则为当前用户的 ~/.cache/dango-race. Defaults to None.
+            max_bytes (int, optional): 缓存目录的大小上限（字节）. Defaults to 64MB.
+        """
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".cache", "dango-race")
+        self.__directory = directory
+        self.__maxBytes = max_bytes
+        self.__hits = 0
+        self.__misses = 0
@@ -0,0 +1,278 @@
+import json, os, importlib
+from globals import *
+from module import Skill, Role, EventTrigger, EventData, EventProcessor
+from track import Track
+
+"""     角色目录
+按角色名登记角色，组建阵容时才加载用到的角色，不需要为每个角色在EventProcessor中写一个add函数。
+
+角色的来源：
+    内置角色：EventProcessor的addPhoebe等函数；
+    代码：register(角色名, 函数) 或 register(角色名, "模块:函数")，字符串形式在第一次使用时才导入模块；
+    声明文件：addDirectory(目录)，目录中每个"角色名.json"为一个角色，第一次使用时才读取；
+    入口点：其他包在 dango_race.roles 组中声明的入口点，入口点名为角色名，值为"模块:函数"，
+           只有在目录中找不到角色名时才扫描入口点，找到后才导入对应模块。
+
+函数的形式为 (EventProcessor) -> Role | None，向处理器添加一名角色。
+每个角色加载后得到的函数会被缓存，之后再组建阵容不需要再次导入或解析。
+
+声明文件格式：
+    {
+        "name": "赞妮",                            可选，默认为文件名
+        "move": [1, 3] 或 {"values": [1, 2, 3], "weights": [1, 1, 2]},     可选，默认为1 ~ 3均匀
+        "skills": [{
+            "name": "赞妮的技能",
+            "describe": "",                        可选
+            "trigger": "move_before",              EventTrigger的名字，默认为move_before
+            "condition": 条件,
+            "effect": 效果
+        }]
+    }
+    条件：true/false，概率（0 ~ 1的小数），CONDITIONS中的名字，或它们组成的列表（全部满足，依次判定）
+    效果：整数为额外移动格数，{"next_round": 格数, "rounds": 回合数} 为若干回合后额外移动
+"""
+
+
+ENTRY_POINT_GROUP = "dango_race.roles"
+
+RoleFactory = Callable[[EventProcessor], "Role | None"]
+
+# 声明文件中可用的条件，判定的都是当前处理的角色
+CONDITIONS: dict[str, Callable[[EventData], bool]] = {
+    "first": lambda data: data.moveOrder()[0] is data.nowRole2(),       # 第一个移动
+    "last": lambda data: data.moveOrder()[-1] is data.nowRole2(),       # 最后一个移动
+    "stacked": lambda data: data.nowRole2().isStack(),                  # 处于堆叠中
+}
+
+
+def _compileCondition(condition: Any, skill_name: str) -> float | bool | Callable[[EventData], bool]:
+    """
+    将声明的条件转为Skill的条件
+    """
+    match condition:
+        case bool():
+            return condition
+        case int() | float():
+            return float(condition)
+        case str():
+            if condition not in CONDITIONS:
+                raise ValueError(f"未知的条件：{condition}")
+            return CONDITIONS[condition]
+        case list():
+            parts = [_compileCondition(part, skill_name) for part in condition]
+            def all_of(data: EventData) -> bool:
+                for part in parts:
+                    if isinstance(part, bool):
+                        ok = part
+                    elif isinstance(part, float):
+                        ok = data.chance(part, skill_name)
+                    else:
+                        ok = part(data)
+                    if not ok:
+                        return False
+                return True
+            return all_of
+        case _:
+            raise ValueError(f"无法识别的条件：{condition}")
+
+
+def _compileEffect(effect: Any) -> int | Callable[[EventData], None] | None:
+    """
+    将声明的效果转为Skill的效果
+    """
+    match effect:
+        case None:
+            return None
+        case int():
+            return effect
+        case {"next_round": int() as num, **rest}:
+            rounds = rest.get("rounds", 1)
+            def next_round(data: EventData):
+                data.nowRole2().addTempSkillOfRound2(num, rounds)
+            return next_round
+        case _:
+            raise ValueError(f"无法识别的效果：{effect}")
+
+
+def compileDeclaration(declaration: dict, default_name: str = "") -> tuple[str, RoleFactory]:
+    """
+    将角色声明编译为添加角色的函数，声明的解析只进行一次
+
+    Args:
+        declaration (dict): 角色声明，格式见模块说明
+        default_name (str, optional): 声明中没有名字时使用的角色名. Defaults to "".
+
+    Returns:
+        tuple[str, RoleFactory]: (角色名, 函数)
+    """
+    name = declaration.get("name", default_name)
+    if not name:
+        raise ValueError("角色声明缺少名字")
+    move = declaration.get("move")
+    match move:
+        case None:
+            values, weights = None, None
+        case list():
+            values, weights = list(move), None
+        case {"values": list() as values, **rest}:
+            weights = rest.get("weights")
+        case _:
+            raise ValueError(f"无法识别的移动格数：{move}")
+    skills: list[tuple[EventTrigger, Any, Any, str, str]] = []
+    for skill in declaration.get("skills", []):
+        skill_name = skill.get("name", f"{name}的技能")
+        skills.append((
+            EventTrigger[skill.get("trigger", "move_before")],
+            _compileCondition(skill.get("condition", True), skill_name),
+            _compileEffect(skill.get("effect")),
+            skill_name,
+            skill.get("describe", ""),
+        ))
+
+    def factory(processor: EventProcessor) -> Role:
+        role = processor.addRole(Role(name))
+        if values is not None:
+            role.setMoveDistribution(values, weights)
+        for trigger, condition, effect, skill_name, describe in skills:
+            role.appSkill(Skill(trigger, condition, effect, None, skill_name, describe))
+        return role
+    return name, factory
+
+
+class RoleCatalog:
+    """
+    角色目录
+
+    例：
+        catalog = defaultCatalog()
+        catalog.addDirectory("roles")
+        ep = catalog.build(["菲比", "赞妮", "新角色"], 23)
+    """
+
+    def register(self, name: str, factory: RoleFactory | str):
+        """
+        登记一名角色
+
+        Args:
+            name (str): 角色名
+            factory (RoleFactory | str): 添加角色的函数，或"模块:函数"形式的字符串（第一次使用时才导入）
+        """
+        self.__sources[name] = factory
+        self.__loaded.pop(name, None)
+    def addDirectory(self, directory: str):
+        """
+        登记目录中所有的角色声明文件（*.json，文件名为角色名），第一次使用时才读取
+
+        Args:
+            directory (str): 目录
+        """
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                self.register(entry.name[:-len(".json")], "file:" + entry.path)
+    def names(self) -> list[str]:
+        """
+        返回已登记的角色名，包括入口点中的角色（会扫描入口点，但不导入）
+        """
+        return list(dict.fromkeys([*self.__sources, *self.__entryPoints()]))
+    def load(self, name: str) -> RoleFactory:
+        """
+        加载角色，返回添加角色的函数，结果会被缓存
+
+        Args:
+            name (str): 角色名
+
+        Returns:
+            RoleFactory: 函数
+        """
+        factory = self.__loaded.get(name)
+        if factory is not None:
+            return factory
+        source = self.__sources.get(name)
+        if source is None:
+            entry_point = self.__entryPoints().get(name)
+            if entry_point is None:
+                raise KeyError(f"角色目录中没有{name}")
+            source = entry_point.load()
+        elif isinstance(source, str):
+            if source.startswith("file:"):
+                with open(source[len("file:"):], encoding = "utf-8") as file:
+                    source = compileDeclaration(json.load(file), name)[1]
+            else:
+                module_name, _, attribute = source.partition(":")
+                source = importlib.import_module(module_name)
+                for part in attribute.split("."):
+                    source = getattr(source, part)
+        logger.debug(f"加载角色{name}")
+        factory = self.__loaded[name] = source      # type: ignore
+        return factory
+    def add(self, processor: EventProcessor, name: str) -> Role:
+        """
+        向事件处理器添加一名角色
+
+        Args:
+            processor (EventProcessor): 事件处理器
+            name (str): 角色名
+
+        Returns:
+            Role: 添加的角色
+        """
+        role = self.load(name)(processor)
+        if role is None:        # 内置的add函数不返回角色
+            role = processor.initData2().roles()[-1]
+        if role.name() != name:
+            raise ValueError(f"角色{name}的函数添加的角色名为{role.name()}")
+        return role
+    def build(self, lineup: list[str], length: int | Track) -> EventProcessor:
+        """
+        按阵容创建事件处理器，只加载阵容中的角色
+
+        Args:
+            lineup (list[str]): 角色名列表
+            length (int | Track): 赛道长度或赛道
+
+        Returns:
+            EventProcessor: 事件处理器
+        """
+        processor = EventProcessor(length)
+        for name in lineup:
+            self.add(processor, name)
+        return processor
+
+    def __entryPoints(self) -> dict[str, Any]:
+        """
+        扫描入口点（只扫描一次），不导入模块
+        """
+        if self.__entryPointCache is None:
+            from importlib.metadata import entry_points
+
+            self.__entryPointCache = {entry_point.name: entry_point for entry_point in entry_points(group = ENTRY_POINT_GROUP)}
+        return self.__entryPointCache
+
+    def __init__(self, builtin: bool = True) -> None:
+        """
+        角色目录
+
+        Args:
+            builtin (bool, optional): 是否登记内置角色. Defaults to True.
+        """
+        self.__sources: dict[str, RoleFactory | str] = {}
+        self.__loaded: dict[str, RoleFactory] = {}
+        self.__entryPointCache: dict[str, Any] | None = None
+        if builtin:
+            self.register("菲比", EventProcessor.addPhoebe)
+            self.register("赞妮", EventProcessor.addZaNi)
+            self.register("布兰特", EventProcessor.addBrant)
+            self.register("洛可可", EventProcessor.addRoccia)
+
+
+_default: RoleCatalog | None = None
+
+
+def defaultCatalog() -> RoleCatalog:
+    """
+    返回全局的角色目录（第一次调用时创建，包含内置角色）
+    """
+    global _default
+    if _default is None:
+        _default = RoleCatalog()
+    return _default
@@ -0,0 +1,424 @@
+from typing import TYPE_CHECKING
+from globals import *
+from module import Skill, Role, EventData, EventTrigger
+from rng import Sampler, BlockSampler, AliasTable, PermutationTable
+
+if TYPE_CHECKING:
+    from module import EventProcessor
+    from stats import SkillStats
+
+"""     阵容编译
+根据已配置的EventProcessor的角色和技能，生成一个专用于该阵容的Python模拟函数：
+    不再经过MoveResult的match、EventTrigger的枚举判断、逐个技能的isTrigger/isTarget/meetCondition；
+    移动格数、移动顺序、概率条件直接查表；
+    已知形态的技能（条件为bool/float，效果为int）直接内联，堆叠移动也内联；
+    赛道的特殊格子直接按格数查表，调用其效果；
+    只有不透明的函数（条件或效果为函数）才回调，回调前后同步本局数据。
+
+角色的技能列表在对局中被改变时（如添加了临时技能），该角色退回通用的tryUseSkills处理，因此结果与run完全一致。
+编译后修改角色或技能不会反映到已编译的函数中，需要重新编译。
+编译后的函数不输出日志。
+"""
+
+
+class _Writer:
+    """
+    带缩进的源码拼接
+    """
+
+    def line(self, text: str = ""):
+        self.lines.append("    " * self.indent + text)
+    def block(self, text: str) -> "_Writer":
+        self.line(text)
+        return self
+    def __enter__(self):
+        self.indent += 1
+        return self
+    def __exit__(self, *args):
+        self.indent -= 1
+    def source(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+        self.indent = 0
+
+
+class CompiledRace:
+    """
+    编译后的阵容模拟函数
+    """
+
+    def run(self, sampler: Sampler | None = None) -> EventData:
+        """
+        模拟一局
+
+        Args:
+            sampler (Sampler | None, optional): 采样器，不填则使用处理器的采样器. Defaults to None.
+
+        Returns:
+            EventData: 结束的本局数据，与EventProcessor.run相同
+        """
+        if sampler is None:
+            sampler = self.__processor.sampler()
+        data = self.__processor.newRaceData(sampler)
+        if isinstance(sampler, BlockSampler) and type(sampler).moveNum is BlockSampler.moveNum \
+                and type(sampler).moveOrder is BlockSampler.moveOrder and type(sampler).chance is BlockSampler.chance:
+            return self.__fast(data, sampler)
+        return self.__generic(data, sampler)
+    def runs(self, times: int, sampler: Sampler | None = None, skill_stats: "SkillStats | None" = None) -> dict[str, dict[int, int]]:
+        """
+        多次模拟运行，返回与EventProcessor.runs相同格式的结果
+
+        Args:
+            times (int): 运行次数
+            sampler (Sampler | None, optional): 采样器，不填则使用处理器的采样器. Defaults to None.
+            skill_stats (SkillStats | None, optional): 技能发动统计. Defaults to None.
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        if sampler is None:
+            sampler = self.__processor.sampler()
+        final_return: dict[str, dict[int, int]] = {}
+        for i in range(times):
+            data = self.run(sampler)
+            self.__processor.countResult(final_return, data)
+            if skill_stats is not None:
+                skill_stats.add(data)
+        return final_return
+    def runsSeedRange(self, start: int, stop: int, sampler: Sampler | None = None) -> dict[str, dict[int, int]]:
+        """
+        与EventProcessor.runsSeedRange相同，第i局使用种子i
+
+        Args:
+            start (int): 起始种子（包含）
+            stop (int): 结束种子（不包含）
+            sampler (Sampler | None, optional): 采样器，不填则新建一个成块采样器. Defaults to None.
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        if sampler is None:
+            sampler = BlockSampler(size = 256)
+        final_return: dict[str, dict[int, int]] = {}
+        for seed in range(start, stop):
+            sampler.seed(seed)
+            self.__processor.countResult(final_return, self.run(sampler))
+        return final_return
+
+    def validate(self, times: int = 2000, seed: int = 0) -> bool:
+        """
+        与EventProcessor.run对比验证
+
+        相同种子下逐局对比排名，必须完全一致；再用不同种子各自模拟，对各角色的排名分布做卡方检验
+
+        Args:
+            times (int, optional): 每项检验的局数. Defaults to 2000.
+            seed (int, optional): 种子. Defaults to 0.
+
+        Returns:
+            bool: 是否通过（逐局完全一致且卡方检验p值不小于0.001）
+        """
+        from stats import chiSquareTest
+
+        processor = self.__processor
+        reference_sampler = BlockSampler(size = 256)
+        compiled_sampler = BlockSampler(size = 256)
+        for race_seed in range(seed, seed + times):
+            reference_sampler.seed(race_seed)
+            compiled_sampler.seed(race_seed)
+            reference = processor.runRace(processor.newRaceData(reference_sampler)).resultToNameDict()
+            compiled = self.run(compiled_sampler).resultToNameDict()
+            if reference != compiled:
+                logger.error(f"种子{race_seed}的结果不一致：{reference} != {compiled}")
+                return False
+
+        reference_result = processor.runsWith(times, BlockSampler(seed))
+        compiled_result = self.runs(times, BlockSampler(seed + 1))
+        for name in reference_result:
+            p_value = chiSquareTest(reference_result[name], compiled_result.get(name, {}))[2]
+            if p_value < 0.001:
+                logger.error(f"{name}的排名分布不一致，p值为{p_value}")
+                return False
+        return True
+
+    def source(self) -> str:
+        """
+        返回生成的源码，用于查看和调试
+
+        Returns:
+            str: 源码
+        """
+        return self.__source
+
+    def __init__(self, processor: "EventProcessor") -> None:
+        """
+        编译阵容，一般通过EventProcessor.compile调用
+
+        Args:
+            processor (EventProcessor): 已添加角色的事件处理器
+        """
+        self.__processor = processor
+        fast_source, fast_namespace = _generate(processor, True)
+        generic_source, generic_namespace = _generate(processor, False)
+        self.__source = fast_source + "\n\n" + generic_source
+        exec(compile(fast_source, "<compiled race: fast>", "exec"), fast_namespace)
+        exec(compile(generic_source, "<compiled race: generic>", "exec"), generic_namespace)
+        self.__fast: Callable[[EventData, Sampler], EventData] = fast_namespace["race"]
+        self.__generic: Callable[[EventData, Sampler], EventData] = generic_namespace["race"]
+
+
+def _isInline(skill: Skill, roles: list[Role]) -> bool:
+    """
+    技能能否参与内联：目标必须是阵容中的角色，条件和效果必须是能识别的类型
+    """
+    condition = skill.condition()
+    effect = skill.effect()
+    return (
+        any(skill.target() is role for role in roles)
+        and (isinstance(condition, (bool, float)) or callable(condition))
+        and (isinstance(effect, int) or callable(effect))
+    )
+
+
+def _generate(processor: "EventProcessor", fast: bool) -> tuple[str, dict[str, Any]]:
+    """
+    生成模拟函数的源码和命名空间
+
+    Args:
+        processor (EventProcessor): 事件处理器
+        fast (bool): 是否为成块采样器生成直接查表的版本，否则调用采样器的函数
+
+    Returns:
+        tuple[str, dict[str, Any]]: (源码, 命名空间)
+    """
+    roles = processor.initData2().roles()
+    track = processor.initData2().track()
+    size = len(roles)
+    namespace: dict[str, Any] = {
+        "ROUND_START": EventTrigger.round_start,
+        "MOVE_BEFORE": EventTrigger.move_before,
+        "MOVE_END": EventTrigger.move_end,
+        "CELLS": track.cells(),
+        "GAME_START": EventTrigger.game_start,
+        "GAME_END": EventTrigger.game_end,
+        "PERMS": {n: [PermutationTable.of(n).permutation(i) for i in range(PermutationTable.of(n).count())]
+                  for n in range(1, min(size, PermutationTable.MAX_SIZE) + 1)},
+        "MAXP": PermutationTable.MAX_SIZE,
+    }
+    inline = [all(_isInline(skill, roles) for skill in role.skills()) for role in roles]
+    target_of = {id(role): i for i, role in enumerate(roles)}
+
+    w = _Writer()
+
+    def staticCheck(i: int) -> str:
+        """
+        角色i的技能列表仍是初始技能的判断
+        """
+        skills = roles[i].skills()
+        if not inline[i]:
+            return "False"
+        parts = [f"len(r{i}._skills) == {len(skills)}"]
+        parts += [f"r{i}._skills[{j}] is s{i}_{j}" for j in range(len(skills))]
+        return " and ".join(parts)
+
+    def resync(in_move: bool):
+        """
+        回调不透明函数后重新读取本局数据
+        """
+        if in_move:
+            w.line("move_num = data._EventData__moveNum")
+        w.line("order = data._EventData__moveOrder")
+        w.line("roles = data._roles")
+        w.line("moved = data._EventData__movedRoles")
+        w.line("moved_set = data._EventData__movedSet")
+
+    def condition(i: int, j: int, skill: Skill, in_move: bool) -> str | None:
+        """
+        返回技能条件的表达式，恒不满足时返回None
+        """
+        value = skill.condition()
+        match value:
+            case _ if isinstance(value, bool):
+                return "True" if value else None
+            case _ if isinstance(value, float):
+                if fast:
+                    return f"draw() < {value!r}"
+                namespace[f"NAME{i}_{j}"] = skill.name()
+                return f"sampler.chance({value!r}, NAME{i}_{j})"
+            case _:
+                namespace[f"C{i}_{j}"] = value
+                if in_move:
+                    w.line("data._EventData__moveNum = move_num")
+                return f"C{i}_{j}(data)"
+
+    def effect(i: int, j: int, skill: Skill, in_move: bool):
+        value = skill.effect()
+        if isinstance(value, int):
+            if in_move:
+                w.line(f"move_num += {int(value)}")
+            else:
+                w.line(f"data._EventData__moveNum += {int(value)}")
+            w.line(f"s{i}_{j}._Skill__effect_times += 1")
+        else:
+            if in_move:
+                w.line("data._EventData__moveNum = move_num")
+            w.line(f"s{i}_{j}.skillEffect(data)")
+            resync(in_move)
+
+    def skillBlock(i: int, trigger: EventTrigger, target: int | None):
+        """
+        生成角色i在trigger时机的技能处理，target为None时不判断目标（回合开始）
+        """
+        in_move = trigger is EventTrigger.move_before
+        chosen = [
+            (j, skill) for j, skill in enumerate(roles[i].skills())
+            if skill.trigger().value & trigger.value
+            and (target is None or target_of.get(id(skill.target())) == target)
+        ]
+        generic = f"r{i}.tryUseSkills2(ROUND_START, data)" if target is None else f"r{i}.tryUseSkills(MOVE_BEFORE, data)"
+        with w.block(f"if r{i} not in ranking:"):
+            if not inline[i]:
+                if in_move:
+                    w.line("data._EventData__moveNum = move_num")
+                w.line(generic)
+                resync(in_move)
+                return
+            if not chosen:
+                with w.block(f"if not ({staticCheck(i)}):"):
+                    if in_move:
+                        w.line("data._EventData__moveNum = move_num")
+                    w.line(generic)
+                    resync(in_move)
+                return
+            with w.block(f"if {staticCheck(i)}:"):
+                for j, skill in chosen:
+                    expression = condition(i, j, skill, in_move)
+                    if expression is None:
+                        w.line("pass")
+                        continue
+                    with w.block(f"if {expression}:"):
+                        effect(i, j, skill, in_move)
+            with w.block("else:"):
+                if in_move:
+                    w.line("data._EventData__moveNum = move_num")
+                w.line(generic)
+                resync(in_move)
+
+    def moveNum(i: int):
+        distribution = roles[i].moveDistribution()
+        if not fast:
+            w.line("move_num = sampler.moveNum(R)")
+        elif distribution is None:
+            w.line("move_num = R._getMoveNum()")
+        elif distribution[1] is None:
+            w.line(f"move_num = {distribution[0]!r}[int(draw() * {len(distribution[0])})]")
+        else:
+            namespace[f"ALIAS{i}"] = AliasTable(*distribution)
+            w.line(f"move_num = ALIAS{i}.sample(draw())")
+
+    # 函数头
+    with w.block("def race(data, sampler):"):
+        if fast:
+            w.line("draw = sampler._block.random")
+        w.line("length = data.length()")
+        w.line("roles = data._roles")
+        w.line("moved = data._EventData__movedRoles")
+        w.line("moved_set = data._EventData__movedSet")
+        w.line("ranking = data._EventData__rankingOfRoles")
+        if size == 0:
+            w.line("return data")
+        else:
+            w.line(", ".join(f"r{i}" for i in range(size)) + ", = roles")
+            for i, role in enumerate(roles):
+                if inline[i]:
+                    for j in range(len(role.skills())):
+                        w.line(f"s{i}_{j} = r{i}._skills[{j}]")
+            w.line("index = {" + ", ".join(f"r{i}: {i}" for i in range(size)) + "}")
+            w.line("move_num = data._EventData__moveNum")
+            w.line("data._EventData__now = GAME_START")
+            with w.block("while True:"):
+                # 回合开始
+                w.line("data._EventData__now = ROUND_START")
+                w.line("moved.clear()")
+                w.line("moved_set.clear()")
+                w.line("data._EventData__round += 1")
+                if fast:
+                    w.line("n = len(roles)")
+                    with w.block("if n <= MAXP:"):
+                        w.line("perms = PERMS[n]")
+                        w.line("order = [roles[k] for k in perms[int(draw() * len(perms))]]")
+                    with w.block("else:"):
+                        w.line("order = sampler.moveOrder(roles)")
+                else:
+                    w.line("order = sampler.moveOrder(roles)")
+                w.line("data._EventData__moveOrder = order")
+                for i in range(size):
+                    skillBlock(i, EventTrigger.round_start, None)
+
+                with w.block("while True:"):
+                    # 准备移动
+                    w.line("data._EventData__now = MOVE_BEFORE")
+                    w.line("i = len(moved)")
+                    w.line("R = None")
+                    with w.block("while i < len(order):"):
+                        with w.block("if order[i]._Role__cell < length:"):
+                            w.line("R = order[i]")
+                            w.line("break")
+                        w.line("i += 1")
+                    with w.block("if R is None:"):
+                        w.line("break")
+                    w.line("data._EventData__nowRole = R")
+                    w.line("mover = index[R]")
+                    for t in range(size):
+                        with w.block(f"{'if' if t == 0 else 'elif'} mover == {t}:"):
+                            moveNum(t)
+                            for i in range(size):
+                                skillBlock(i, EventTrigger.move_before, t)
+                    w.line("data._EventData__moveNum = move_num")
+
+                    # 移动
+                    w.line("cell = R._Role__cell + move_num")
+                    w.line("R._Role__cell = cell")
+                    w.line("X = None")
+                    with w.block("for role in roles:"):
+                        with w.block("if role is not R and role._Role__cell == cell:"):
+                            w.line("X = role")
+                            w.line("break")
+                    w.line("B = R._bottom")
+                    with w.block("if B is not None:"):
+                        w.line("B._head = None")
+                    w.line("R._bottom = X")
+                    with w.block("if X is not None:"):
+                        w.line("X._head = R")
+                    w.line("H = R._head")
+                    with w.block("while H is not None:"):
+                        w.line("H._Role__cell += move_num")
+                        w.line("H = H._head")
+
+                    # 移动结束
+                    if track.hasEffects():
+                        w.line("E = CELLS[cell] if cell < length else None")
+                        with w.block("if E is not None:"):
+                            w.line("data._EventData__now = MOVE_END")
+                            w.line("data._EventData__moveNum = move_num")
+                            w.line("E.land(data, R)")
+                            w.line("cell = R._Role__cell")
+                    w.line("moved.append(R)")
+                    w.line("moved_set.add(R)")
+                    with w.block("if cell >= length:"):
+                        w.line("rank = len(ranking) + 1")
+                        w.line("H = R")
+                        with w.block("while H is not None:"):
+                            w.line("roles.remove(H)")
+                            w.line("ranking[H] = rank")
+                            w.line("H = H._head")
+                        w.line("data._EventData__nowRole = None")
+                        with w.block("if not roles:"):
+                            w.line("data._EventData__now = GAME_END")
+                            w.line("return data")
+                    with w.block("if len(order) == len(moved):"):
+                        w.line("break")
+
+    return w.source(), namespace
@@ -0,0 +1,232 @@
+from array import array
+from globals import *
+from module import Skill, EventData, EventProcessor
+from rng import BlockSampler
+from aggregators import RankingIndex
+from cache import describeProcessor
+
+"""     修改技能后的增量重新模拟
+修改一个技能后，没有用到这个技能的对局结果不会改变，只需要重新模拟用到它的对局。
+
+DeltaCampaign按种子区间模拟（第i局使用种子i，种子决定了本局的全部随机抽取，相当于记录了抽取），并对每局记录：
+    名次索引；
+    每个技能的判定次数（检查生效条件的次数）和发动次数。
+
+修改后，比较新旧事件处理器的声明（cache.describeProcessor）得到改动的技能：
+    只改了效果：只有发动过该技能的对局可能改变；
+    改了生效条件：只有判定过该技能的对局可能改变；
+    其他改动（时机、目标、角色、移动分布、赛道、增删技能）：所有对局都可能改变。
+没有判定过的技能不会消耗随机数，也不会影响本局，因此其余对局的结果与用新处理器完整模拟相同。
+受影响的对局用原来的种子重新模拟，名次统计按差量更新，结果与用新处理器完整模拟runsSeedRange完全相同。
+
+条件或效果的函数读取了外部可变状态时，声明比较无法发现改动，此时应在update中手动指定changed
+"""
+
+
+SkillKey = tuple[str, str]
+
+
+class _CountedCondition:
+    """
+    统计判定次数的生效条件，判定方式与Skill.meetCondition相同
+    """
+
+    def __call__(self, data: EventData) -> bool:
+        self.counts[self.slot] += 1
+        condition = self.condition
+        match condition:
+            case _ if isinstance(condition, bool):
+                return condition
+            case _ if isinstance(condition, float):
+                return data.chance(condition, self.name)
+            case _:
+                return condition(data)
+
+    def __init__(self, condition: Any, name: str, counts: list[int], slot: int) -> None:
+        self.condition = condition
+        self.name = name
+        self.counts = counts
+        self.slot = slot
+
+
+class DeltaCampaign:
+    """
+    可以在修改技能后增量更新的一组模拟
+
+    例：把布兰特的技能从额外移动2格改为3格
+        campaign = DeltaCampaign(ep, 0, 100000)
+        campaign.run()
+        ep2 = EventProcessor(23) ...        # 按新的技能重新建立
+        campaign.update(ep2)                # 只重新模拟布兰特的技能发动过的对局
+        campaign.result()
+    """
+
+    def __keysOf(self, processor: EventProcessor) -> list[SkillKey]:
+        return [(role.name(), skill.name()) for role in processor.initData2().roles() for skill in role.skills()]
+    def __simulate(self, seed: int, sampler: BlockSampler) -> int:
+        """
+        用当前的处理器模拟一局，记录判定和发动次数，返回名次索引
+        """
+        processor = self.__processor
+        slots = self.__slots
+        evaluated = [0] * len(slots)
+        sampler.seed(seed)
+        data = processor.newRaceData(sampler)
+        skills: list[tuple[int, Skill]] = []
+        for role in data.roles():
+            for skill in role.skills():
+                slot = slots.get((role.name(), skill.name()))
+                if slot is not None:
+                    skill.setCondition(_CountedCondition(skill.condition(), skill.name(), evaluated, slot))   # type: ignore
+                    skills.append((slot, skill))
+        processor.runRace(data)
+        offset = (seed - self.__start) * len(slots)
+        for slot, skill in skills:
+            self.__evaluated[offset + slot] = evaluated[slot]
+            self.__fired[offset + slot] = skill.effectTimes()
+        return self.__ranking.encode(data)
+    def __runAll(self):
+        slots = self.__slots
+        size = self.__stop - self.__start
+        self.__evaluated = array("I", bytes(4 * size * len(slots)))
+        self.__fired = array("I", bytes(4 * size * len(slots)))
+        self.__indices = array("q", bytes(8 * size))
+        self.__counts = {}
+        sampler = BlockSampler(size = 256)
+        for seed in range(self.__start, self.__stop):
+            index = self.__simulate(seed, sampler)
+            self.__indices[seed - self.__start] = index
+            self.__counts[index] = self.__counts.get(index, 0) + 1
+
+    def run(self) -> dict[str, dict[int, int]]:
+        """
+        完整模拟整个种子区间
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果，与runsSeedRange相同
+        """
+        self.__runAll()
+        return self.result()
+    def changedSkills(self, processor: EventProcessor) -> dict[SkillKey, str] | None:
+        """
+        比较新旧处理器的声明，返回改动的技能
+
+        Args:
+            processor (EventProcessor): 新的事件处理器
+
+        Returns:
+            dict[SkillKey, str] | None: (角色名, 技能名)对应"effect"或"condition"（两者都改时为"condition"），
+                有技能以外的改动时为None，表示需要完整重新模拟
+        """
+        old = describeProcessor(self.__processor)
+        new = describeProcessor(processor)
+        if old["track"] != new["track"] or len(old["roles"]) != len(new["roles"]):
+            return None
+        final_return: dict[SkillKey, str] = {}
+        for old_role, new_role in zip(old["roles"], new["roles"]):
+            if old_role["name"] != new_role["name"] or old_role["move"] != new_role["move"] \
+                    or len(old_role["skills"]) != len(new_role["skills"]):
+                return None
+            for old_skill, new_skill in zip(old_role["skills"], new_role["skills"]):
+                if old_skill["name"] != new_skill["name"] or old_skill["trigger"] != new_skill["trigger"] \
+                        or old_skill["target"] != new_skill["target"]:
+                    return None
+                key = (old_role["name"], old_skill["name"])
+                if old_skill["condition"] != new_skill["condition"]:
+                    final_return[key] = "condition"
+                elif old_skill["effect"] != new_skill["effect"]:
+                    final_return[key] = "effect"
+        return final_return
+    def affected(self, changed: dict[SkillKey, str]) -> list[int]:
+        """
+        返回可能受改动影响的对局的种子
+
+        Args:
+            changed (dict[SkillKey, str]): 改动的技能，见changedSkills
+
+        Returns:
+            list[int]: 种子列表
+        """
+        width = len(self.__slots)
+        checks: list[tuple[array, int]] = []
+        for key, kind in changed.items():
+            slot = self.__slots.get(key)
+            if slot is None:
+                raise KeyError(f"没有技能{key}")
+            checks.append((self.__evaluated if kind == "condition" else self.__fired, slot))
+        return [
+            seed for seed in range(self.__start, self.__stop)
+            if any(counts[(seed - self.__start) * width + slot] for counts, slot in checks)
+        ]
+    def update(self, processor: EventProcessor, changed: dict[SkillKey, str] | None = None) -> int:
+        """
+        换成修改后的事件处理器，只重新模拟受影响的对局
+
+        Args:
+            processor (EventProcessor): 修改后的事件处理器
+            changed (dict[SkillKey, str] | None, optional): 改动的技能，不填则由changedSkills比较得到. Defaults to None.
+
+        Returns:
+            int: 重新模拟的局数
+        """
+        if changed is None:
+            changed = self.changedSkills(processor)
+        self.__processor = processor
+        if changed is None or self.__keysOf(processor) != self.__keys:
+            logger.info("有技能以外的改动，完整重新模拟")
+            self.__ranking = RankingIndex.of(processor)
+            self.__keys = self.__keysOf(processor)
+            self.__slots = {key: i for i, key in enumerate(self.__keys)}
+            self.__runAll()
+            return self.__stop - self.__start
+        seeds = self.affected(changed)
+        counts = self.__counts
+        indices = self.__indices
+        sampler = BlockSampler(size = 256)
+        for seed in seeds:
+            old = indices[seed - self.__start]
+            new = self.__simulate(seed, sampler)
+            if new != old:
+                counts[old] -= 1
+                if counts[old] == 0:
+                    del counts[old]
+                counts[new] = counts.get(new, 0) + 1
+                indices[seed - self.__start] = new
+        logger.info(f"重新模拟{len(seeds)}局，共{self.__stop - self.__start}局")
+        return len(seeds)
+    def result(self) -> dict[str, dict[int, int]]:
+        """
+        返回当前的名次统计
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果，与runsSeedRange格式相同
+        """
+        names = self.__ranking.names()
+        final_return: dict[str, dict[int, int]] = {}
+        for index, count in self.__counts.items():
+            for name, ranking_num in zip(names, self.__ranking.decode(index)):
+                final_return.setdefault(name, {})
+                final_return[name][ranking_num] = final_return[name].get(ranking_num, 0) + count
+        return final_return
+    def processor(self) -> EventProcessor:
+        return self.__processor
+
+    def __init__(self, processor: EventProcessor, start: int, stop: int) -> None:
+        """
+        可增量更新的一组模拟，创建后调用run完整模拟一次
+
+        Args:
+            processor (EventProcessor): 已添加角色的事件处理器
+            start (int): 起始种子（包含）
+            stop (int): 结束种子（不包含）
+        """
+        self.__processor = processor
+        self.__start = start
+        self.__stop = stop
+        self.__ranking = RankingIndex.of(processor)
+        self.__keys = self.__keysOf(processor)
+        self.__slots: dict[SkillKey, int] = {key: i for i, key in enumerate(self.__keys)}
+        self.__evaluated = array("I")
+        self.__fired = array("I")
+        self.__indices = array("q")
+        self.__counts: dict[int, int] = {}
@@ -0,0 +1,356 @@
+import json, socket, threading, subprocess, os
+from globals import *
+from module import EventProcessor
+from stats import SkillStats
+
+"""     分布式模拟
+协调者（Coordinator）把模拟切成若干块，每块为 (阵容, 赛道长度, 种子区间)，
+工作者（Worker）通过TCP连接协调者，领取一块，用EventProcessor.runsSeedRange模拟后返回排名次数。
+
+协议为每行一个JSON：
+    工作者 -> 协调者  {"type": "hello"}
+    协调者 -> 工作者  {"type": "chunk", "id": 块号, "lineup": [...], "length": 长度, "start": 起始种子, "stop": 结束种子, "skill_stats": 是否统计技能}
+    工作者 -> 协调者  {"type": "result", "id": 块号, "result": {角色名: {排名: 次数}}, "skill_stats": SkillStats.toDict()或null}
+    协调者 -> 工作者  {"type": "stop"}
+
+工作者断开或超时后，其未完成的块会重新分配。每局的种子是固定的，因此重新分配和合并顺序都不影响最终结果
+"""
+
+
+def buildProcessor(lineup: list[str], length: int) -> EventProcessor:
+    """
+    按阵容描述创建事件处理器
+
+    Args:
+        lineup (list[str]): 添加角色的函数名（如"addPhoebe"）或角色目录中的角色名（如"菲比"）列表
+        length (int): 赛道长度
+
+    Returns:
+        EventProcessor: 事件处理器
+    """
+    from catalog import defaultCatalog
+
+    ep = EventProcessor(length)
+    for name in lineup:
+        if name.startswith("add") and callable(getattr(ep, name, None)):
+            getattr(ep, name)()
+            continue
+        try:
+            defaultCatalog().add(ep, name)
+        except KeyError:
+            raise ValueError(f"未知的角色添加函数或角色名：{name}")
+    return ep
+
+
+def _send(file, message: dict):
+    file.write(json.dumps(message, ensure_ascii = False).encode("utf-8") + b"\n")
+    file.flush()
+def _receive(file) -> dict | None:
+    line = file.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class Coordinator:
+    """
+    分布式模拟的协调者
+    """
+
+    def address(self) -> tuple[str, int]:
+        """
+        获取监听的地址
+
+        Returns:
+            tuple[str, int]: (主机, 端口)
+        """
+        return self.__server.getsockname()[:2]
+
+# 块的分配
+    def __takeChunk(self) -> int | None:
+        """
+        取出一个待分配的块，全部完成时返回None，暂无可分配的块时等待
+        """
+        with self.__condition:
+            while True:
+                if len(self.__results) == len(self.__chunks):
+                    return None
+                if self.__pending:
+                    return self.__pending.pop(0)
+                self.__condition.wait()
+    def __returnChunk(self, chunk_id: int):
+        """
+        工作者丢失时，将其未完成的块放回待分配队列
+        """
+        with self.__condition:
+            if chunk_id not in self.__results and chunk_id not in self.__pending:
+                logger.error(f"块{chunk_id}的工作者丢失，重新分配")
+                self.__pending.insert(0, chunk_id)
+                self.__reissued += 1
+            self.__condition.notify_all()
+    def __finishChunk(self, chunk_id: int, result: dict[str, dict[int, int]], skill_stats: SkillStats | None):
+        with self.__condition:
+            if chunk_id not in self.__results:
+                self.__results[chunk_id] = result
+                self.__skillStats[chunk_id] = skill_stats
+            self.__condition.notify_all()
+
+# 连接处理
+    def __connect(self, delta: int):
+        """
+        记录连接的工作者数量，没有工作者时开始计算空闲时间
+        """
+        with self.__condition:
+            self.__connected += delta
+            self.__idleSince = time.monotonic() if self.__connected == 0 else None
+            self.__condition.notify_all()
+    def __handle(self, conn: socket.socket):
+        chunk_id = None
+        self.__connect(1)
+        try:
+            conn.settimeout(self.__timeout)
+            file = conn.makefile("rwb")
+            if _receive(file) is None:
+                return
+            while True:
+                chunk_id = self.__takeChunk()
+                if chunk_id is None:
+                    _send(file, {"type": "stop"})
+                    return
+                start, stop = self.__chunks[chunk_id]
+                _send(file, {
+                    "type": "chunk", "id": chunk_id,
+                    "lineup": self.__lineup, "length": self.__length,
+                    "start": start, "stop": stop,
+                    "skill_stats": self.__collectSkillStats,
+                    })
+                message = _receive(file)
+                if message is None:
+                    raise ConnectionError("工作者断开连接")
+                if message.get("type") != "result" or message.get("id") != chunk_id:
+                    raise ConnectionError("工作者返回结果错误")
+                result = {
+                    name: {int(ranking_num): count for ranking_num, count in counts.items()}
+                    for name, counts in message["result"].items()
+                }
+                skill_stats = message.get("skill_stats")
+                self.__finishChunk(chunk_id, result, None if skill_stats is None else SkillStats.fromDict(skill_stats))
+                chunk_id = None
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"工作者连接异常：{e}")
+        finally:
+            if chunk_id is not None:
+                self.__returnChunk(chunk_id)
+            conn.close()
+            self.__connect(-1)
+    def __accept(self):
+        while True:
+            try:
+                conn, _ = self.__server.accept()
+            except OSError:
+                return
+            threading.Thread(target = self.__handle, args = (conn,), daemon = True).start()
+
+    def serve(self, timeout: float | None = None, idle_timeout: float | None = 60) -> dict[str, dict[int, int]]:
+        """
+        开始分配任务，阻塞直到所有块完成
+
+        Args:
+            timeout (float | None, optional): 总超时秒数，None为不限. Defaults to None.
+            idle_timeout (float | None, optional): 还有未完成的块、但连续这么多秒没有任何工作者连接时放弃（如工作者全部退出或从未连接），
+                None为不限. Defaults to 60.
+
+        Raises:
+            TimeoutError: 超时或没有工作者时
+
+        Returns:
+            dict[str, dict[int, int]]: 与runs相同格式的结果，按块号顺序合并
+        """
+        start = time.monotonic()
+        with self.__condition:
+            self.__idleSince = start if self.__connected == 0 else None
+        threading.Thread(target = self.__accept, daemon = True).start()
+        try:
+            with self.__condition:
+                while len(self.__results) < len(self.__chunks):
+                    now = time.monotonic()
+                    waits: list[float] = []
+                    if timeout is not None:
+                        if now - start >= timeout:
+                            raise TimeoutError(f"{timeout}秒内没有完成，已完成{len(self.__results)}/{len(self.__chunks)}块")
+                        waits.append(start + timeout - now)
+                    if idle_timeout is not None and self.__idleSince is not None:
+                        if now - self.__idleSince >= idle_timeout:
+                            raise TimeoutError(f"{idle_timeout}秒内没有工作者连接，已完成{len(self.__results)}/{len(self.__chunks)}块")
+                        waits.append(self.__idleSince + idle_timeout - now)
+                    self.__condition.wait(min(waits) if waits else None)
+        finally:
+            self.__server.close()
+        return EventProcessor.mergeResults([self.__results[i] for i in range(len(self.__chunks))])
+    def skillStats(self) -> SkillStats | None:
+        """
+        返回按块号顺序合并的技能发动统计，需要在serve结束后调用
+
+        Returns:
+            SkillStats | None: 技能统计，创建协调者时没有开启则为None
+        """
+        if not self.__collectSkillStats:
+            return None
+        merged = SkillStats.of(buildProcessor(self.__lineup, self.__length))
+        for i in range(len(self.__chunks)):
+            stats = self.__skillStats.get(i)
+            if stats is not None:
+                merged.merge(stats)
+        return merged
+    def reissuedCount(self) -> int:
+        """
+        返回被重新分配的块数
+
+        Returns:
+            int: 块数
+        """
+        return self.__reissued
+
+    def __init__(self,
+                 lineup: list[str],
+                 length: int,
+                 times: int,
+                 chunk_size: int = 10000,
+                 seed: int = 0,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 timeout: float | None = 600,
+                 skill_stats: bool = False) -> None:
+        """
+        协调者
+
+        Args:
+            lineup (list[str]): 添加角色的函数名列表
+            length (int): 赛道长度
+            times (int): 运行次数
+            chunk_size (int, optional): 每块的局数. Defaults to 10000.
+            seed (int, optional): 起始种子，模拟的种子区间为[seed, seed + times). Defaults to 0.
+            host (str, optional): 监听的主机. Defaults to "127.0.0.1".
+            port (int, optional): 监听的端口，0为自动分配. Defaults to 0.
+            timeout (float | None, optional): 单块的超时秒数，超时视为工作者丢失. Defaults to 600.
+            skill_stats (bool, optional): 是否让工作者同时统计技能发动，结果由skillStats获取. Defaults to False.
+        """
+        buildProcessor(lineup, length)      # 提前检查阵容
+        self.__lineup = list(lineup)
+        self.__length = length
+        self.__timeout = timeout
+        self.__chunks: list[tuple[int, int]] = [
+            (start, min(start + chunk_size, seed + times))
+            for start in range(seed, seed + times, chunk_size)
+        ]
+        self.__pending: list[int] = list(range(len(self.__chunks)))
+        self.__results: dict[int, dict[str, dict[int, int]]] = {}
+        self.__collectSkillStats = skill_stats
+        self.__skillStats: dict[int, SkillStats | None] = {}
+        self.__reissued = 0
+        self.__connected = 0
+        self.__idleSince: float | None = None
+        self.__condition = threading.Condition()
+        self.__server = socket.create_server((host, port))
+
+
+class Worker:
+    """
+    分布式模拟的工作者
+    """
+
+    def __processor(self, lineup: list[str], length: int) -> EventProcessor:
+        key = (tuple(lineup), length)
+        ep = self.__processors.get(key)
+        if ep is None:
+            ep = self.__processors[key] = buildProcessor(lineup, length)
+        return ep
+
+    def serve(self) -> int:
+        """
+        连接协调者并不断领取任务，直到收到停止消息或连接断开
+
+        Returns:
+            int: 完成的块数
+        """
+        done = 0
+        with socket.create_connection((self.__host, self.__port)) as conn:
+            file = conn.makefile("rwb")
+            _send(file, {"type": "hello"})
+            while True:
+                message = _receive(file)
+                if message is None or message.get("type") != "chunk":
+                    return done
+                ep = self.__processor(message["lineup"], message["length"])
+                skill_stats = SkillStats.of(ep) if message.get("skill_stats") else None
+                result = ep.runsSeedRange(message["start"], message["stop"], skill_stats = skill_stats)
+                _send(file, {
+                    "type": "result", "id": message["id"], "result": result,
+                    "skill_stats": None if skill_stats is None else skill_stats.toDict(),
+                    })
+                done += 1
+
+    def __init__(self, host: str, port: int) -> None:
+        """
+        工作者
+
+        Args:
+            host (str): 协调者主机
+            port (int): 协调者端口
+        """
+        self.__host = host
+        self.__port = port
+        self.__processors: dict[tuple[tuple[str, ...], int], EventProcessor] = {}
+
+
+def runLocal(lineup: list[str], length: int, times: int, workers: int = 2,
+             chunk_size: int = 10000, seed: int = 0) -> dict[str, dict[int, int]]:
+    """
+    在本机启动一个协调者和workers个工作者进程进行模拟，一般用于测试
+
+    Args:
+        lineup (list[str]): 添加角色的函数名列表
+        length (int): 赛道长度
+        times (int): 运行次数
+        workers (int, optional): 工作者进程数. Defaults to 2.
+        chunk_size (int, optional): 每块的局数. Defaults to 10000.
+        seed (int, optional): 起始种子. Defaults to 0.
+
+    Returns:
+        dict[str, dict[int, int]]: 运行结果
+    """
+    coordinator = Coordinator(lineup, length, times, chunk_size, seed)
+    host, port = coordinator.address()
+    here = os.path.dirname(os.path.abspath(__file__))
+    processes = [
+        subprocess.Popen([sys.executable, os.path.join(here, "distributed.py"), "worker", host, str(port)], cwd = here)
+        for _ in range(workers)
+    ]
+    try:
+        return coordinator.serve()
+    finally:
+        for process in processes:
+            try:
+                process.wait(timeout = 10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    # python distributed.py worker 主机 端口
+    # python distributed.py coordinator 赛道长度 运行次数 端口 [--host 主机] addPhoebe addZaNi ...
+    # 协调者默认只监听本机，需要其他机器的工作者连接时用--host指定，如--host 0.0.0.0
+    logging.basicConfig(level = logging.ERROR)
+    match sys.argv[1:]:
+        case ["worker", host, port]:
+            Worker(host, int(port)).serve()
+        case ["coordinator", length, times, port, "--host", host, *lineup]:
+            coordinator = Coordinator(lineup, int(length), int(times), host = host, port = int(port))
+            print(f"协调者监听于{coordinator.address()}")
+            print(coordinator.serve())
+        case ["coordinator", length, times, port, *lineup]:
+            coordinator = Coordinator(lineup, int(length), int(times), port = int(port))
+            print(f"协调者监听于{coordinator.address()}")
+            print(coordinator.serve())
+        case _:
+            print("用法：\n  python distributed.py worker 主机 端口\n  python distributed.py coordinator 赛道长度 运行次数 端口 [--host 主机] 角色添加函数...")
@@ -0,0 +1,387 @@
+import json, threading, hashlib
+from bisect import bisect_right
+from itertools import accumulate
+from globals import *
+from module import Role, EventData, EventProcessor, MoveResult, _RoundCounter
+from rng import Sampler, BlockSampler, PermutationTable
+from cache import fingerprint
+
+"""     残局表
+对局后期的大部分回合都在处理所有剩余角色离终点只有几格的局面。
+残局表为一个阵容保存这些局面（残局状态）之后名次的精确分布，模拟进入残局后直接按分布抽取名次，不再逐回合模拟。
+
+残局状态取在回合开始前（上一回合所有角色移动结束后），由以下内容组成：
+    剩余角色（按剩余角色列表的顺序）离终点的格数、头顶的角色（堆叠）；
+    每个角色的技能（名字和描述）和剩余回合计数器的剩余回合数（下回合状态等临时技能）。
+已进入终点的角色不影响之后的对局，只影响之后排名的起始值，因此不计入状态，分布中保存的是相对名次。
+所有剩余角色离终点都不超过depth格时，状态在残局表覆盖的范围内。
+残局表只对建表时事件处理器的赛道有效，本局数据换了赛道（如赛季中每站的赛道）时不查表。
+
+求解：用分支采样器枚举一回合内的全部随机抽取（移动顺序、移动格数、概率条件），
+每种抽取的概率为各次抽取概率之积；一回合结束后对局结束的直接计入，否则递归求解新的残局状态（带记忆）。
+除浮点误差外分布是精确的，因此查表代替逐回合模拟后结果的分布不变。
+模拟时只查表：表中没有的残局状态照常逐回合模拟，不会在模拟中求解，求解只在build（和distribution）中进行。
+只有调用runs等方法时填写endgame=True才会查表，见EventProcessor.setEndgameTable。
+
+限制：
+    只能枚举采样器能看到的随机，setMoveFunc设置的函数和技能内部自行调用random的部分无法枚举；
+    技能的条件或效果读取了回合数、技能发动次数等不在状态中的内容时，查表结果不准确；
+    查表后不再逐回合模拟，之后的技能发动次数不会被SkillStats统计。
+"""
+
+
+def _playRound(processor: EventProcessor, data: EventData) -> bool:
+    """
+    模拟一回合，返回对局是否结束
+    """
+    processor.turnStart(data)
+    while(True):
+        match processor.move(data)[1]:
+            case MoveResult.not_all_moved:
+                continue
+            case MoveResult.all_moved:
+                return False
+            case MoveResult.game_end:
+                return True
+
+
+class _BranchSampler(Sampler):
+    """
+    分支采样器：按给定的分支路径抽取，路径用完后取第一个分支并记录分支数，用advance依次遍历所有路径
+    """
+
+    def __choose(self, probabilities: list[float]) -> int:
+        position = self.__position
+        if position == len(self.__path):
+            self.__path.append(0)
+            self.__sizes.append(len(probabilities))
+        index = self.__path[position]
+        self.__position += 1
+        self.__probability *= probabilities[index]
+        return index
+
+    def random(self) -> float:
+        raise TypeError("残局表无法枚举连续的随机数")
+    def moveNum(self, role: Role) -> int:
+        distribution = role.moveDistribution()
+        probabilities = role.moveProbabilities()
+        if distribution is None or probabilities is None:
+            raise TypeError(f"{role.name()}的移动格数由函数决定，无法枚举，请使用setMoveDistribution")
+        options = [(num, p) for num, p in zip(distribution[0], probabilities) if p > 0]
+        return options[self.__choose([p for _, p in options])][0]
+    def moveOrder(self, roles: list[Role]) -> list[Role]:
+        table = PermutationTable.of(len(roles))
+        if table is None:
+            raise ValueError(f"角色过多（{len(roles)}名），无法枚举移动顺序")
+        count = table.count()
+        index = self.__choose([1 / count] * count)
+        return [roles[i] for i in table.permutation(index)]
+    def chance(self, probability: float, key: str = "") -> bool:
+        if probability <= 0:
+            return False
+        if probability >= 1:
+            return True
+        return self.__choose([probability, 1 - probability]) == 0
+
+    def restart(self):
+        """
+        按当前路径重新开始一次抽取
+        """
+        self.__position = 0
+        self.__probability = 1.0
+    def advance(self) -> bool:
+        """
+        前进到下一条路径，全部遍历完时返回False
+        """
+        path = self.__path
+        sizes = self.__sizes
+        del path[self.__position:], sizes[self.__position:]     # 本次没有用到的分支
+        while path and path[-1] + 1 == sizes[-1]:
+            path.pop()
+            sizes.pop()
+        if not path:
+            return False
+        path[-1] += 1
+        return True
+    def probability(self) -> float:
+        """
+        本次抽取路径的概率
+        """
+        return self.__probability
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__path: list[int] = []
+        self.__sizes: list[int] = []
+        self.__position = 0
+        self.__probability = 1.0
+
+
+StateKey = tuple[tuple[str, int, str | None, tuple[tuple[str, str, int | None], ...]], ...]
+
+
+class EndgameTable:
+    """
+    残局表
+
+    例：
+        table = EndgameTable(ep, 3)
+        table.build(1000)                   # 求解常见的残局状态，模拟时只查表
+        table.save("endgame.json")
+        ep.setEndgameTable(EndgameTable.load(ep, "endgame.json"))
+        ep.runs(100000, endgame = True)     # 进入表中的残局状态后查表，其余照常模拟
+    """
+
+    def stateKey(self, data: EventData, covered: bool = True) -> StateKey | None:
+        """
+        计算停在回合开始前的本局数据的残局状态
+
+        Args:
+            data (EventData): 本局数据
+            covered (bool, optional): 是否只返回覆盖范围内的状态. Defaults to True.
+
+        Returns:
+            StateKey | None: 残局状态，不在覆盖范围内或赛道不是建表时的赛道时为None
+        """
+        length = data.length()
+        roles = data.roles()
+        if covered:
+            if data.track() is not self.__track:
+                return None
+            boundary = length - self.__depth
+            for role in roles:
+                if role.cell() < boundary:
+                    return None
+        key = []
+        for role in roles:
+            distance = length - role.cell()
+            head = role.headRole()
+            skills = tuple(
+                (skill.name(), skill.describe(), effect.count if isinstance(effect := skill.effect(), _RoundCounter) else None)
+                for skill in role.skills()
+            )
+            key.append((role.name(), distance, None if head is None else head.name(), skills))
+        return tuple(key)
+    def distribution(self, data: EventData) -> dict[tuple[int, ...], float] | None:
+        """
+        返回本局数据之后剩余角色名次的精确分布，没有求解过的状态会先求解
+
+        Args:
+            data (EventData): 停在回合开始前的本局数据
+
+        Returns:
+            dict[tuple[int, ...], float] | None: 剩余角色（按剩余角色列表的顺序）的名次: 概率，不在覆盖范围内或赛道不是建表时的赛道时为None
+        """
+        key = self.stateKey(data)
+        if key is None:
+            return None
+        outcomes, cumulative = self.__entry(data, key)
+        finished = len(data.rankingOfRoles())
+        previous = 0.0
+        final_return: dict[tuple[int, ...], float] = {}
+        for ranks, total in zip(outcomes, cumulative):
+            final_return[tuple(finished + rank for rank in ranks)] = total - previous
+            previous = total
+        return final_return
+    def resolve(self, data: EventData, solve: bool = False) -> bool:
+        """
+        本局数据的残局状态在表中时，按精确分布抽取剩余角色的名次并结束对局
+
+        抽取使用本局的采样器，消耗一个随机数
+
+        Args:
+            data (EventData): 停在回合开始前的本局数据
+            solve (bool, optional): 覆盖范围内的状态不在表中时是否先求解，为False时只查表. Defaults to False.
+
+        Returns:
+            bool: 是否已查表结束，为False时本局数据不变
+        """
+        key = self.stateKey(data)
+        if key is None:
+            return False
+        if solve:
+            outcomes, cumulative = self.__entry(data, key)
+        else:
+            entry = self.__table.get(key)
+            if entry is None:
+                return False
+            outcomes, cumulative = entry
+        index = bisect_right(cumulative, data.sampler().random() * cumulative[-1])
+        ranks = outcomes[min(index, len(outcomes) - 1)]
+        ranking = data.rankingOfRoles()
+        finished = len(ranking)
+        for role, rank in zip(data.roles(), ranks):
+            ranking[role] = finished + rank
+        data.setRoles([])
+        self.__hits += 1
+        return True
+    def build(self, races: int = 1000, seed: int = 0) -> int:
+        """
+        模拟若干局，求解其中进入的残局状态
+
+        Args:
+            races (int, optional): 模拟局数. Defaults to 1000.
+            seed (int, optional): 起始种子，第i局使用种子seed + i. Defaults to 0.
+
+        Returns:
+            int: 表中的状态数
+        """
+        processor = self.__processor
+        sampler = BlockSampler(size = 256)
+        for i in range(races):
+            sampler.seed(seed + i)
+            data = processor.gameStart(processor.newRaceData(sampler))
+            while not self.resolve(data, True) and not _playRound(processor, data):
+                pass
+        return len(self.__table)
+
+# 统计
+    def states(self) -> int:
+        """
+        返回已求解的状态数
+        """
+        return len(self.__table)
+    def hits(self) -> int:
+        """
+        返回查表结束的局数
+        """
+        return self.__hits
+    def depth(self) -> int:
+        return self.__depth
+    def digest(self) -> str:
+        """
+        返回残局表内容的摘要，深度或已求解的状态不同时摘要不同，用于结果缓存的指纹
+        """
+        with self.__lock:
+            keys = sorted(json.dumps(key, ensure_ascii = False) for key in self.__table)
+        return hashlib.sha256(json.dumps([self.__depth, keys]).encode()).hexdigest()
+
+# 保存
+    def save(self, path: str):
+        """
+        将残局表保存为JSON文件，文件中记录阵容的场景指纹
+
+        Args:
+            path (str): 文件路径
+        """
+        with self.__lock:
+            entries = [[key, outcomes, cumulative] for key, (outcomes, cumulative) in self.__table.items()]
+        with open(path, "w", encoding = "utf-8") as file:
+            json.dump({
+                "fingerprint": fingerprint(self.__processor),
+                "depth": self.__depth,
+                "entries": entries,
+            }, file, ensure_ascii = False)
+    @classmethod
+    def load(cls, processor: EventProcessor, path: str) -> "EndgameTable":
+        """
+        读取保存的残局表
+
+        Args:
+            processor (EventProcessor): 事件处理器，阵容必须与保存时相同
+            path (str): 文件路径
+
+        Returns:
+            EndgameTable: 残局表
+        """
+        with open(path, encoding = "utf-8") as file:
+            saved = json.load(file)
+        if saved["fingerprint"] != fingerprint(processor):
+            raise ValueError("残局表的阵容、赛道或引擎版本与事件处理器不同")
+        table = cls(processor, saved["depth"])
+        for key, outcomes, cumulative in saved["entries"]:
+            table.__table[tuple(
+                (name, distance, head, tuple((skill, describe, count) for skill, describe, count in skills))
+                for name, distance, head, skills in key
+            )] = ([tuple(ranks) for ranks in outcomes], cumulative)
+        return table
+
+# 求解
+    def __entry(self, data: EventData, key: StateKey) -> tuple[list[tuple[int, ...]], list[float]]:
+        entry = self.__table.get(key)
+        if entry is None:
+            with self.__lock:
+                entry = self.__solve(data, key)
+        return entry
+    def __solve(self, data: EventData, key: Any, mid: bool = False) -> tuple[list[tuple[int, ...]], list[float]]:
+        """
+        求解一个节点，返回(相对名次列表, 累计概率)
+
+        回合开始前的节点枚举回合开始（移动顺序和回合开始的技能），回合中的节点枚举下一名角色的移动，
+        回合中的节点同样带记忆，同一回合内不同抽取到达的相同局面只求解一次
+        """
+        table = self.__rounds if mid else self.__table
+        entry = table.get(key)
+        if entry is not None:
+            return entry
+        if key in self.__solving:
+            raise ValueError("残局状态出现循环（如赛道效果使角色后退），无法求解")
+        self.__solving.add(key)
+        processor = self.__processor
+        names = [name for name, *_ in (key[0] if mid else key)]
+        base = data.copy()
+        base.setSampler(None)
+        base = base.deepcopy()
+        finished = len(base.rankingOfRoles())
+
+        sampler = _BranchSampler()
+        outcome: dict[tuple[int, ...], float] = {}
+        while(True):
+            sampler.restart()
+            race = base.deepcopy()
+            race.setSampler(sampler)
+            if mid:
+                move_result = processor.move(race)[1]
+            else:
+                processor.turnStart(race)
+                move_result = MoveResult.not_all_moved
+            probability = sampler.probability()
+            done = {role.name(): ranking_num - finished for role, ranking_num in race.rankingOfRoles().items()}
+            if move_result is MoveResult.game_end:
+                ranks = tuple(done[name] for name in names)
+                outcome[ranks] = outcome.get(ranks, 0.0) + probability
+            else:
+                next_mid = move_result is MoveResult.not_all_moved
+                next_key = self.__nodeKey(race, next_mid)
+                shift = len(race.rankingOfRoles()) - finished
+                next_outcomes, next_cumulative = self.__solve(race, next_key, next_mid)
+                next_names = [name for name, *_ in (next_key[0] if next_mid else next_key)]
+                previous = 0.0
+                for next_ranks, total in zip(next_outcomes, next_cumulative):
+                    done.update((name, shift + rank) for name, rank in zip(next_names, next_ranks))
+                    ranks = tuple(done[name] for name in names)
+                    outcome[ranks] = outcome.get(ranks, 0.0) + probability * (total - previous)
+                    previous = total
+            if not sampler.advance():
+                break
+
+        outcomes = sorted(outcome)
+        entry = (outcomes, list(accumulate(outcome[ranks] for ranks in outcomes)))
+        table[key] = entry
+        self.__solving.discard(key)
+        return entry
+    def __nodeKey(self, data: EventData, mid: bool) -> Any:
+        """
+        节点的键，回合中的节点还包括移动顺序和已移动的角色
+        """
+        key = self.stateKey(data, False)
+        if not mid:
+            return key
+        return (key, tuple(role.name() for role in data.moveOrder()), tuple(role.name() for role in data.movedRoles()))
+
+    def __init__(self, processor: EventProcessor, depth: int = 3) -> None:
+        """
+        残局表
+
+        Args:
+            processor (EventProcessor): 已添加角色的事件处理器
+            depth (int, optional): 覆盖范围，所有剩余角色离终点都不超过depth格. Defaults to 3.
+        """
+        self.__processor = processor
+        self.__track = processor.initData2().track()       # 建表时的赛道，赛道在对局中只读，各局共享同一对象
+        self.__depth = depth
+        self.__table: dict[StateKey, tuple[list[tuple[int, ...]], list[float]]] = {}
+        self.__rounds: dict[Any, tuple[list[tuple[int, ...]], list[float]]] = {}     # 回合中的节点，不保存
+        self.__solving: set[Any] = set()
+        self.__lock = threading.RLock()
+        self.__hits = 0
@@ -0,0 +1,326 @@
+from globals import *
+from module import EventProcessor, EventData
+from rng import Sampler, BlockSampler
+from stats import gTest, pooledChiSquareTest
+
+"""     引擎等价性检验
+任何更快的引擎（批量、编译、并行、精确计算……）都必须和EventProcessor.run给出相同的分布。
+
+对同一组阵容和赛道长度分别用参考引擎和候选引擎模拟：
+    对完整名次分布（每个角色的排名组成的元组）做卡方检验和G检验；
+    对每个角色的排名分布做卡方检验；
+    两个引擎都支持逐局模拟时，用相同种子逐局对比，检查结果是否完全一致；
+    同时记录两个引擎的速度。
+"""
+
+
+def finishingOrder(data: EventData, names: list[str]) -> tuple[int, ...]:
+    """
+    将一局结果转为完整名次：按names顺序排列的各角色排名
+
+    Args:
+        data (EventData): 结束的本局数据
+        names (list[str]): 角色名顺序
+
+    Returns:
+        tuple[int, ...]: 名次元组
+    """
+    result = data.resultToNameDict()
+    return tuple(result[name] for name in names)
+
+
+def ordersToRankCounts(orders: dict[tuple[int, ...], int], names: list[str]) -> dict[str, dict[int, int]]:
+    """
+    将完整名次的次数转为每个角色的排名次数，即runs的结果格式
+
+    Args:
+        orders (dict[tuple[int, ...], int]): 完整名次: 次数
+        names (list[str]): 名次元组对应的角色名顺序
+
+    Returns:
+        dict[str, dict[int, int]]: 运行结果
+    """
+    final_return: dict[str, dict[int, int]] = {name: {} for name in names}
+    for key, count in orders.items():
+        for name, ranking_num in zip(names, key):
+            final_return[name][ranking_num] = final_return[name].get(ranking_num, 0) + count
+    return final_return
+
+
+class Engine:
+    """
+    引擎接口
+
+    逐局引擎重写race即可，批量引擎（如多线程、分布式）重写orders或rankCounts
+    """
+
+    def name(self) -> str:
+        return type(self).__name__
+    def race(self, sampler: Sampler) -> EventData | None:
+        """
+        用给定采样器模拟一局，不支持逐局模拟的引擎返回None
+
+        Args:
+            sampler (Sampler): 采样器
+
+        Returns:
+            EventData | None: 结束的本局数据
+        """
+        return None
+    def supportsRace(self) -> bool:
+        """
+        是否支持逐局模拟，即是否重写了race，不进行模拟
+        """
+        return type(self).race is not Engine.race
+    def orders(self, times: int, seed: int) -> dict[tuple[int, ...], int] | None:
+        """
+        模拟times局，返回完整名次的次数，不支持时返回None
+
+        Args:
+            times (int): 局数
+            seed (int): 种子
+
+        Returns:
+            dict[tuple[int, ...], int] | None: 完整名次: 次数
+        """
+        if not self.supportsRace():
+            return None
+        sampler = BlockSampler(seed)
+        names = self.names()
+        final_return: dict[tuple[int, ...], int] = {}
+        for i in range(times):
+            key = finishingOrder(self.race(sampler), names)     # type: ignore
+            final_return[key] = final_return.get(key, 0) + 1
+        return final_return
+    def rankCounts(self, times: int, seed: int) -> dict[str, dict[int, int]]:
+        """
+        模拟times局，返回与runs相同格式的结果
+
+        Args:
+            times (int): 局数
+            seed (int): 种子
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        orders = self.orders(times, seed)
+        if orders is None:
+            raise NotImplementedError("引擎至少需要实现race、orders、rankCounts之一")
+        return ordersToRankCounts(orders, self.names())
+
+    def names(self) -> list[str]:
+        return [role.name() for role in self.processor.initData2().roles()]
+
+    def __init__(self, processor: EventProcessor) -> None:
+        self.processor = processor
+
+
+class ReferenceEngine(Engine):
+    """
+    参考引擎，即EventProcessor.run的流程
+    """
+
+    def race(self, sampler: Sampler) -> EventData:
+        return self.processor.runRace(self.processor.newRaceData(sampler))
+
+
+class CompiledEngine(Engine):
+    """
+    阵容编译后的引擎，见EventProcessor.compile
+    """
+
+    def race(self, sampler: Sampler) -> EventData:
+        return self.__compiled.run(sampler)
+
+    def __init__(self, processor: EventProcessor) -> None:
+        super().__init__(processor)
+        self.__compiled = processor.compile()
+
+
+class ThreadEngine(Engine):
+    """
+    线程池引擎，见EventProcessor.threadRuns，只能检验每个角色的排名分布
+    """
+
+    def rankCounts(self, times: int, seed: int) -> dict[str, dict[int, int]]:
+        return self.processor.threadRuns(times, self.__workers, seed)
+
+    def __init__(self, processor: EventProcessor, workers: int = 4) -> None:
+        super().__init__(processor)
+        self.__workers = workers
+
+
+class EquivalenceReport:
+    """
+    一个场景的检验结果
+    """
+
+    def passed(self) -> bool:
+        """
+        是否通过：所有p值不小于显著性水平，且逐局对比（如果进行了）没有不一致
+        """
+        return (
+            all(p_value >= self.alpha for p_value in self.pValues().values())
+            and not self.mismatches
+        )
+    def pValues(self) -> dict[str, float]:
+        """
+        返回所有检验的p值
+
+        Returns:
+            dict[str, float]: 检验名: p值
+        """
+        values: dict[str, float] = {}
+        if self.orderChiSquare is not None:
+            values["名次卡方"] = self.orderChiSquare[2]
+        if self.orderG is not None:
+            values["名次G检验"] = self.orderG[2]
+        for name, result in self.rankChiSquare.items():
+            values[f"{name}排名卡方"] = result[2]
+        return values
+
+    def __str__(self) -> str:
+        lines = [
+            f"场景：{self.scenario}  {'通过' if self.passed() else '不通过'}",
+            f"  速度：参考{self.referenceSpeed:.0f}局/秒，候选{self.candidateSpeed:.0f}局/秒，"
+            f"加速比{self.candidateSpeed / self.referenceSpeed if self.referenceSpeed else 0:.2f}",
+        ]
+        for name, p_value in self.pValues().items():
+            lines.append(f"  {name}：p = {p_value:.4f}")
+        if self.exactChecked:
+            lines.append(f"  逐局对比：{self.exactChecked}局中{self.mismatches}局不一致")
+        return "\n".join(lines)
+
+    def __init__(self, scenario: str, alpha: float) -> None:
+        self.scenario = scenario
+        self.alpha = alpha
+        self.referenceSpeed = 0.0
+        self.candidateSpeed = 0.0
+        self.orderChiSquare: tuple[float, int, float] | None = None
+        self.orderG: tuple[float, int, float] | None = None
+        self.rankChiSquare: dict[str, tuple[float, int, float]] = {}
+        self.exactChecked = 0
+        self.mismatches = 0
+
+
+class EquivalenceHarness:
+    """
+    引擎等价性检验
+
+    例：
+        harness = EquivalenceHarness(ReferenceEngine, CompiledEngine)
+        for report in harness.check(scenarios(["addPhoebe", "addZaNi", "addBrant", "addRoccia"], [10, 23, 40])):
+            print(report)
+    """
+
+    def checkOne(self, processor: EventProcessor, scenario: str = "") -> EquivalenceReport:
+        """
+        检验一个场景
+
+        Args:
+            processor (EventProcessor): 已添加角色的事件处理器
+            scenario (str, optional): 场景名，用于输出. Defaults to "".
+
+        Returns:
+            EquivalenceReport: 检验结果
+        """
+        reference = self.__reference(processor)
+        candidate = self.__candidate(processor)
+        report = EquivalenceReport(scenario, self.__alpha)
+        times = self.__times
+        seed = self.__seed
+
+        # 分布检验，两个引擎使用不同的种子，样本相互独立
+        startTime = time.perf_counter()
+        reference_orders = reference.orders(times, seed)
+        reference_counts = reference.rankCounts(times, seed) if reference_orders is None else None
+        report.referenceSpeed = times / (time.perf_counter() - startTime)
+
+        startTime = time.perf_counter()
+        candidate_orders = candidate.orders(times, seed + 1)
+        candidate_counts = candidate.rankCounts(times, seed + 1) if candidate_orders is None else None
+        report.candidateSpeed = times / (time.perf_counter() - startTime)
+
+        if reference_orders is not None and candidate_orders is not None:
+            report.orderChiSquare = pooledChiSquareTest(reference_orders, candidate_orders)
+            report.orderG = gTest(reference_orders, candidate_orders)
+        if reference_counts is None:
+            reference_counts = ordersToRankCounts(reference_orders, reference.names())   # type: ignore
+        if candidate_counts is None:
+            candidate_counts = ordersToRankCounts(candidate_orders, candidate.names())   # type: ignore
+        for name in reference_counts:
+            report.rankChiSquare[name] = pooledChiSquareTest(reference_counts[name], candidate_counts.get(name, {}))
+
+        # 逐局对比
+        if self.__exact and reference.supportsRace() and candidate.supportsRace():
+            reference_sampler = BlockSampler(size = 256)
+            candidate_sampler = BlockSampler(size = 256)
+            names = reference.names()
+            for race_seed in range(seed, seed + self.__exact):
+                reference_sampler.seed(race_seed)
+                candidate_sampler.seed(race_seed)
+                reference_data = reference.race(reference_sampler)
+                candidate_data = candidate.race(candidate_sampler)
+                if reference_data is None or candidate_data is None:
+                    break
+                report.exactChecked += 1
+                if finishingOrder(reference_data, names) != finishingOrder(candidate_data, names):
+                    report.mismatches += 1
+        return report
+    def check(self, processors: list[tuple[str, EventProcessor]]) -> list[EquivalenceReport]:
+        """
+        检验多个场景
+
+        Args:
+            processors (list[tuple[str, EventProcessor]]): (场景名, 事件处理器)列表，可由scenarios生成
+
+        Returns:
+            list[EquivalenceReport]: 检验结果
+        """
+        return [self.checkOne(processor, scenario) for scenario, processor in processors]
+
+    def __init__(self,
+                 reference: Callable[[EventProcessor], Engine],
+                 candidate: Callable[[EventProcessor], Engine],
+                 times: int = 20000,
+                 seed: int = 0,
+                 alpha: float = 0.001,
+                 exact: int = 1000) -> None:
+        """
+        引擎等价性检验
+
+        Args:
+            reference (Callable[[EventProcessor], Engine]): 参考引擎的构造函数，一般为ReferenceEngine
+            candidate (Callable[[EventProcessor], Engine]): 候选引擎的构造函数
+            times (int, optional): 每个引擎每个场景的模拟局数. Defaults to 20000.
+            seed (int, optional): 种子. Defaults to 0.
+            alpha (float, optional): 显著性水平. Defaults to 0.001.
+            exact (int, optional): 逐局对比的局数，0为不对比，只有两个引擎都支持逐局模拟时进行. Defaults to 1000.
+        """
+        self.__reference = reference
+        self.__candidate = candidate
+        self.__times = times
+        self.__seed = seed
+        self.__alpha = alpha
+        self.__exact = exact
+
+
+def scenarios(lineup: list[str], lengths: list[int]) -> list[tuple[str, EventProcessor]]:
+    """
+    由阵容和赛道长度生成检验场景
+
+    Args:
+        lineup (list[str]): 添加角色的函数名列表
+        lengths (list[int]): 赛道长度列表
+
+    Returns:
+        list[tuple[str, EventProcessor]]: (场景名, 事件处理器)列表
+    """
+    from distributed import buildProcessor
+    return [(f"{'+'.join(lineup)} 长度{length}", buildProcessor(lineup, length)) for length in lengths]
+
+
+if __name__ == "__main__":
+    harness = EquivalenceHarness(ReferenceEngine, CompiledEngine, times = 5000, exact = 500)
+    for report in harness.check(scenarios(["addPhoebe", "addZaNi", "addBrant", "addRoccia"], [10, 23])):
+        print(report)
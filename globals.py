@@ -8,15 +8,8 @@ INFO: 正常游戏能见到的数据，如前进多少格
 ERROR: 错误级日志
 """
 
-logging.basicConfig(
-    # filename = "test.log",
-    # level = logging.DEBUG
-    # level = logging.INFO
-    level = logging.ERROR
-    )
+# 日志的输出方式和等级由程序入口（如main.py）设置，这里只获取logger，不修改全局设置
 logger = logging.getLogger(__name__)
 
 # 注释T
-T = TypeVar('T')
-
-sys.setrecursionlimit(100)
\ No newline at end of file
+T = TypeVar('T')
\ No newline at end of file
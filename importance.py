@@ -0,0 +1,293 @@
+from math import factorial, sqrt
+from globals import *
+from module import Role, EventData, EventProcessor
+from rng import Sampler
+
+
+class ImportanceSampler(Sampler):
+    """
+    重要性采样器
+
+    将移动格数、移动顺序、概率条件的抽样偏向感兴趣的事件，
+    同时在对局中累乘似然比权重（原分布概率 / 偏置分布概率），使加权后的估计仍然无偏
+
+    只能偏置采样器能看到的随机：
+    声明了移动分布的角色（setMoveDistribution）、移动顺序、通过data.chance判断的概率。
+    setMoveFunc设置的函数和技能内部自行调用random的部分按原分布抽取，权重为1
+    """
+
+# 偏置设置
+    def setMoveBias(self, name: str, weights: dict[int, float]) -> "ImportanceSampler":
+        """
+        设置角色移动格数的偏置分布
+
+        Args:
+            name (str): 角色名
+            weights (dict[int, float]): 格数: 权重，按角色移动分布中的格数归一化（分布中没有的格数被忽略）。
+                原分布中概率大于0的格数权重必须大于0
+
+        Returns:
+            ImportanceSampler: 采样器本身
+        """
+        total = sum(weights.values())
+        if total <= 0 or any(weight < 0 for weight in weights.values()):
+            raise ValueError("移动格数偏置权重错误，请检查取值")
+        self.__moveBias[name] = {num: weight / total for num, weight in weights.items()}
+        self.__moveTables.clear()
+        return self
+    def setOrderBias(self, name: str, weight: float) -> "ImportanceSampler":
+        """
+        设置角色在移动顺序中的偏置权重
+
+        移动顺序按Plackett-Luce模型抽取：权重越大越容易排在前面，未设置的角色权重为1
+
+        Args:
+            name (str): 角色名
+            weight (float): 权重，必须大于0
+
+        Returns:
+            ImportanceSampler: 采样器本身
+        """
+        if weight <= 0:
+            raise ValueError("移动顺序偏置权重必须大于0")
+        self.__orderBias[name] = weight
+        return self
+    def setChanceBias(self, key: str, probability: float) -> "ImportanceSampler":
+        """
+        设置概率条件的偏置概率
+
+        Args:
+            key (str): 概率的标识，浮点数条件为技能名
+            probability (float): 偏置后的概率，取值为0~1.0，不含两端
+
+        Returns:
+            ImportanceSampler: 采样器本身
+        """
+        if not 0 < probability < 1:
+            raise ValueError("偏置概率必须在0到1之间，不含两端")
+        self.__chanceBias[key] = probability
+        return self
+
+# 抽样
+    def __moveTable(self, role: Role) -> tuple[tuple[int, ...], list[float], list[float]] | None:
+        """
+        获取角色的(格数, 偏置概率, 似然比)表，没有偏置时返回None
+        """
+        name = role.name()
+        table = self.__moveTables.get(name)
+        if table is not None:
+            return table
+        bias = self.__moveBias.get(name)
+        distribution = role.moveDistribution()
+        probabilities = role.moveProbabilities()
+        if bias is None or distribution is None or probabilities is None:
+            return None
+        values = distribution[0]
+        # 只在角色可能的格数上归一化，否则抽样时choices会重新归一化，似然比与实际的偏置概率不符
+        total = sum(bias.get(num, 0.0) for num in values)
+        if total <= 0:
+            raise ValueError(f"{name}的移动格数偏置权重在其移动分布上全为0")
+        biased: list[float] = []
+        ratios: list[float] = []
+        for num, p in zip(values, probabilities):
+            q = bias.get(num, 0.0) / total
+            if p > 0 and q <= 0:
+                raise ValueError(f"{name}的移动格数{num}在偏置分布中概率为0，估计将有偏")
+            biased.append(q)
+            ratios.append(p / q if q > 0 else 0.0)
+        table = (values, biased, ratios)
+        self.__moveTables[name] = table
+        return table
+
+    def moveNum(self, role: Role) -> int:
+        table = self.__moveTable(role)
+        if table is None:
+            return super().moveNum(role)
+        values, biased, ratios = table
+        index = self._random.choices(range(len(values)), biased)[0]
+        self.__weight *= ratios[index]
+        return values[index]
+    def moveOrder(self, roles: list[Role]) -> list[Role]:
+        if not self.__orderBias:
+            return super().moveOrder(roles)
+        remaining = list(roles)
+        weights = [self.__orderBias.get(role.name(), 1.0) for role in remaining]
+        order: list[Role] = []
+        q = 1.0
+        while remaining:
+            total = sum(weights)
+            index = self._random.choices(range(len(remaining)), weights)[0]
+            q *= weights[index] / total
+            order.append(remaining.pop(index))
+            weights.pop(index)
+        self.__weight *= 1 / (factorial(len(order)) * q)
+        return order
+    def chance(self, probability: float, key: str = "") -> bool:
+        q = self.__chanceBias.get(key)
+        if q is None or not 0 < probability < 1:
+            return super().chance(probability, key)
+        if self._random.random() < q:
+            self.__weight *= probability / q
+            return True
+        else:
+            self.__weight *= (1 - probability) / (1 - q)
+            return False
+
+# 权重
+    def newRace(self):
+        self.__weight = 1.0
+    def weight(self) -> float:
+        return self.__weight
+
+    def __init__(self, rng: "random.Random | None" = None) -> None:
+        """
+        重要性采样器
+
+        Args:
+            rng (random.Random | None, optional): 随机数生成器，不填则新建一个独立的生成器. Defaults to None.
+        """
+        super().__init__(rng)
+        self.__moveBias: dict[str, dict[int, float]] = {}
+        self.__orderBias: dict[str, float] = {}
+        self.__chanceBias: dict[str, float] = {}
+        self.__moveTables: dict[str, tuple[tuple[int, ...], list[float], list[float]]] = {}
+        self.__weight = 1.0
+
+
+class ImportanceResult:
+    """
+    重要性采样的结果，保存权重的一阶、二阶累加和
+
+    估计值为 Σw·1[事件] / n，标准误为样本标准差 / √n
+    """
+
+    def __accumulate(self, table: dict[Any, list[float]], key: Any, weight: float):
+        sums = table.setdefault(key, [0.0, 0.0])
+        sums[0] += weight
+        sums[1] += weight * weight
+
+    def add(self, data: EventData, weight: float, event: bool | None = None):
+        """
+        加入一局的结果
+
+        Args:
+            data (EventData): 结束的本局数据
+            weight (float): 本局似然比权重
+            event (bool | None, optional): 本局是否发生了关注的事件. Defaults to None.
+        """
+        self.__times += 1
+        self.__weightSum += weight
+        self.__weightSquareSum += weight * weight
+        for name, ranking_num in data.resultToNameDict().items():
+            self.__accumulate(self.__ranking, (name, ranking_num), weight)
+        if event:
+            self.__accumulate(self.__event, None, weight)
+
+    def __estimate(self, sums: list[float] | None) -> tuple[float, float]:
+        n = self.__times
+        if sums is None or n == 0:
+            return 0.0, 0.0
+        mean = sums[0] / n
+        if n < 2:
+            return mean, 0.0
+        variance = max(sums[1] / n - mean * mean, 0.0) * n / (n - 1)
+        return mean, sqrt(variance / n)
+
+    def times(self) -> int:
+        """
+        返回模拟次数
+        """
+        return self.__times
+    def probability(self, name: str, ranking_num: int) -> tuple[float, float]:
+        """
+        角色获得某一排名的概率
+
+        Args:
+            name (str): 角色名
+            ranking_num (int): 排名
+
+        Returns:
+            tuple[float, float]: (估计值, 标准误)
+        """
+        return self.__estimate(self.__ranking.get((name, ranking_num)))
+    def eventProbability(self) -> tuple[float, float]:
+        """
+        关注事件的概率
+
+        Returns:
+            tuple[float, float]: (估计值, 标准误)
+        """
+        return self.__estimate(self.__event.get(None))
+    def effectiveSampleSize(self) -> float:
+        """
+        有效样本数 (Σw)² / Σw²，远小于模拟次数时说明偏置过强，估计不可靠
+
+        Returns:
+            float: 有效样本数
+        """
+        if self.__weightSquareSum == 0:
+            return 0.0
+        return self.__weightSum ** 2 / self.__weightSquareSum
+    def meanWeight(self) -> float:
+        """
+        平均权重，理论上应接近1，可用于检查偏置设置
+
+        Returns:
+            float: 平均权重
+        """
+        return self.__weightSum / self.__times if self.__times else 0.0
+
+    def toProbability(self) -> dict[str, dict[int, str]]:
+        """
+        转为和EventProcessor.resultsToProbability相同的格式，可直接用于exampleOutput
+
+        Returns:
+            dict[str, dict[int, str]]: 角色对应排名概率，格式为 估计值±标准误
+        """
+        final_return: dict[str, dict[int, str]] = {}
+        for name, ranking_num in sorted(self.__ranking, key=lambda key: key[1]):
+            estimate, error = self.probability(name, ranking_num)
+            final_return.setdefault(name, {})[ranking_num] = "{:.4%}±{:.4%}".format(estimate, error)
+        return final_return
+
+    def __init__(self) -> None:
+        self.__times = 0
+        self.__weightSum = 0.0
+        self.__weightSquareSum = 0.0
+        self.__ranking: dict[tuple[str, int], list[float]] = {}
+        self.__event: dict[None, list[float]] = {}
+
+
+def importanceRuns(processor: EventProcessor,
+                   times: int,
+                   sampler: ImportanceSampler,
+                   event: Callable[[EventData], bool] | None = None) -> ImportanceResult:
+    """
+    使用重要性采样多次模拟运行
+
+    运行期间临时替换processor的采样器，结束后恢复
+
+    例：估计洛可可在六人局中获得第一的概率
+        sampler = ImportanceSampler().setOrderBias("洛可可", 0.2).setMoveBias("洛可可", {1: 1, 2: 2, 3: 4})
+        result = importanceRuns(ep, 10000, sampler, lambda data: data.resultToNameDict()["洛可可"] == 1)
+        result.eventProbability()
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        times (int): 运行次数
+        sampler (ImportanceSampler): 设置好偏置的重要性采样器
+        event (Callable[[EventData], bool] | None, optional): 关注的事件，传入结束的本局数据. Defaults to None.
+
+    Returns:
+        ImportanceResult: 加权估计结果
+    """
+    result = ImportanceResult()
+    old_sampler = processor.sampler()
+    processor.setSampler(sampler)
+    try:
+        for i in range(times):
+            data = processor.run()
+            result.add(data, sampler.weight(), event(data) if event is not None else None)
+    finally:
+        processor.setSampler(old_sampler)
+    return result
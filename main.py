@@ -4,6 +4,14 @@ from module import Role, Skill, EventProcessor, EventData, EventTrigger
 
 if __name__ == "__main__":
     
+    logging.basicConfig(
+        # filename = "test.log",
+        # level = logging.DEBUG
+        # level = logging.INFO
+        level = logging.ERROR
+        )
+    sys.setrecursionlimit(100)
+    
     # times = 10
     # times = 50
     # times = 1000
@@ -0,0 +1,357 @@
+import json, os, threading, tempfile
+from bisect import bisect_left
+from globals import *
+from module import EventTrigger, EventProcessor
+from rng import BlockSampler
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from cache import ResultCache
+
+"""     运行指标
+长时间的批量模拟或预测服务运行时，可以通过本地的指标接口观察吞吐量和资源占用：
+    MetricsServer   在本机提供Prometheus文本格式的/metrics
+    StatsFile       定期把指标快照写成JSON文件
+
+指标包括：总局数和回合数、每秒局数、平均回合数、每个工作线程的利用率、
+每局耗时和各阶段（回合开始、准备移动、移动、移动结束、游戏结束）耗时的直方图、结果缓存的命中率、进程内存占用。
+
+monitoredRuns按种子区间分块在线程池中模拟并更新指标，结果与runsSeedRange相同。
+各阶段耗时通过每隔若干局用raceSteps逐步推进一局来抽样测量，其余对局不受影响
+"""
+
+
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1, 1.0)
+
+
+def _memoryBytes() -> int | None:
+    """
+    进程的最大常驻内存（字节），平台不支持时返回None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024     # Linux的单位为KB
+
+
+class Histogram:
+    """
+    固定分桶的耗时直方图（秒）
+    """
+
+    def observe(self, value: float):
+        self.__counts[bisect_left(self.__buckets, value)] += 1
+        self.__sum += value
+    def merge(self, other: "Histogram") -> "Histogram":
+        for i, count in enumerate(other.__counts):
+            self.__counts[i] += count
+        self.__sum += other.__sum
+        return self
+    def count(self) -> int:
+        return sum(self.__counts)
+    def mean(self) -> float:
+        count = self.count()
+        return self.__sum / count if count else 0.0
+    def toDict(self) -> dict:
+        """
+        转为可JSON序列化的字典，桶为累计次数，最后一个桶为+Inf
+        """
+        cumulative = 0
+        buckets: list[tuple[str, int]] = []
+        for bound, count in zip([*map(str, self.__buckets), "+Inf"], self.__counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {"buckets": buckets, "sum": self.__sum, "count": cumulative}
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.__buckets = buckets
+        self.__counts = [0] * (len(buckets) + 1)
+        self.__sum = 0.0
+
+
+class Metrics:
+    """
+    线程安全的指标集合
+
+    工作线程应先在本地累计，再按块调用record，避免每局加锁
+    """
+
+    def record(self, worker: str, races: int, rounds: int, busy: float,
+               latencies: dict[str, Histogram] | None = None):
+        """
+        计入一个工作线程完成的一块
+
+        Args:
+            worker (str): 工作线程名
+            races (int): 局数
+            rounds (int): 总回合数
+            busy (float): 模拟用时（秒）
+            latencies (dict[str, Histogram] | None, optional): 按名字的耗时直方图，如"race"和各阶段. Defaults to None.
+        """
+        with self.__lock:
+            self.__races += races
+            self.__rounds += rounds
+            self.__busy[worker] = self.__busy.get(worker, 0.0) + busy
+            self.__workerStart.setdefault(worker, time.time() - busy)
+            for name, histogram in (latencies or {}).items():
+                self.__latencies.setdefault(name, Histogram()).merge(histogram)
+    def watchCache(self, cache: "ResultCache", name: str = "result"):
+        """
+        在快照中报告结果缓存的命中率
+
+        Args:
+            cache (ResultCache): 结果缓存
+            name (str, optional): 缓存名. Defaults to "result".
+        """
+        with self.__lock:
+            self.__caches[name] = cache
+    def snapshot(self) -> dict:
+        """
+        返回当前指标的快照
+
+        Returns:
+            dict: 可JSON序列化的指标
+        """
+        now = time.time()
+        with self.__lock:
+            elapsed = now - self.__start
+            caches = {}
+            for name, cache in self.__caches.items():
+                hits, misses = cache.stats()
+                caches[name] = {"hits": hits, "misses": misses,
+                                "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+            return {
+                "time": now,
+                "uptime_seconds": elapsed,
+                "races_total": self.__races,
+                "rounds_total": self.__rounds,
+                "races_per_second": self.__races / elapsed if elapsed > 0 else 0.0,
+                "mean_rounds": self.__rounds / self.__races if self.__races else 0.0,
+                "workers": {
+                    worker: {"busy_seconds": busy,
+                             "utilization": min(1.0, busy / max(now - self.__workerStart[worker], 1e-9))}
+                    for worker, busy in self.__busy.items()
+                },
+                "latency_seconds": {name: histogram.toDict() for name, histogram in self.__latencies.items()},
+                "caches": caches,
+                "memory_bytes": _memoryBytes(),
+            }
+    def toPrometheus(self) -> str:
+        """
+        转为Prometheus文本格式
+
+        Returns:
+            str: 文本
+        """
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE dango_races_total counter",
+            f"dango_races_total {snapshot['races_total']}",
+            "# TYPE dango_rounds_total counter",
+            f"dango_rounds_total {snapshot['rounds_total']}",
+            "# TYPE dango_races_per_second gauge",
+            f"dango_races_per_second {snapshot['races_per_second']}",
+            "# TYPE dango_mean_rounds gauge",
+            f"dango_mean_rounds {snapshot['mean_rounds']}",
+            "# TYPE dango_worker_utilization gauge",
+        ]
+        for worker, values in snapshot["workers"].items():
+            lines.append(f'dango_worker_utilization{{worker="{worker}"}} {values["utilization"]}')
+        lines.append("# TYPE dango_worker_busy_seconds_total counter")
+        for worker, values in snapshot["workers"].items():
+            lines.append(f'dango_worker_busy_seconds_total{{worker="{worker}"}} {values["busy_seconds"]}')
+        lines.append("# TYPE dango_latency_seconds histogram")
+        for name, histogram in snapshot["latency_seconds"].items():
+            for bound, count in histogram["buckets"]:
+                lines.append(f'dango_latency_seconds_bucket{{phase="{name}",le="{bound}"}} {count}')
+            lines.append(f'dango_latency_seconds_sum{{phase="{name}"}} {histogram["sum"]}')
+            lines.append(f'dango_latency_seconds_count{{phase="{name}"}} {histogram["count"]}')
+        lines.append("# TYPE dango_cache_hit_rate gauge")
+        for name, values in snapshot["caches"].items():
+            lines.append(f'dango_cache_hit_rate{{cache="{name}"}} {values["hit_rate"]}')
+        if snapshot["memory_bytes"] is not None:
+            lines.append("# TYPE dango_memory_max_rss_bytes gauge")
+            lines.append(f"dango_memory_max_rss_bytes {snapshot['memory_bytes']}")
+        return "\n".join(lines) + "\n"
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__start = time.time()
+        self.__races = 0
+        self.__rounds = 0
+        self.__busy: dict[str, float] = {}
+        self.__workerStart: dict[str, float] = {}
+        self.__latencies: dict[str, Histogram] = {}
+        self.__caches: dict[str, "ResultCache"] = {}
+
+
+class MetricsServer:
+    """
+    在本机提供Prometheus文本格式指标的HTTP服务，路径为/metrics
+
+    例：
+        metrics = Metrics()
+        server = MetricsServer(metrics, 9108)
+        monitoredRuns(ep, 10 ** 7, metrics)
+        server.close()
+    """
+
+    def address(self) -> tuple[str, int]:
+        """
+        获取监听的地址
+
+        Returns:
+            tuple[str, int]: (主机, 端口)
+        """
+        return self.__server.server_address[:2]     # type: ignore
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __init__(self, metrics: Metrics, port: int = 0, host: str = "127.0.0.1") -> None:
+        """
+        启动指标服务
+
+        Args:
+            metrics (Metrics): 指标
+            port (int, optional): 端口，0为自动选择. Defaults to 0.
+            host (str, optional): 监听地址，默认只监听本机. Defaults to "127.0.0.1".
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.toPrometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                logger.debug("指标请求：" + format % args)
+
+        self.__server = ThreadingHTTPServer((host, port), Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target = self.__server.serve_forever, name = "metrics-server", daemon = True).start()
+
+
+class StatsFile:
+    """
+    定期把指标快照写成JSON文件，写入是原子的（先写临时文件再替换）
+    """
+
+    def write(self):
+        """
+        立即写入一次
+        """
+        directory = os.path.dirname(os.path.abspath(self.__path))
+        fd, temp_path = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding = "utf-8") as file:
+                json.dump(self.__metrics.snapshot(), file, ensure_ascii = False)
+            os.replace(temp_path, self.__path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    def close(self):
+        """
+        停止定期写入，并写入最后一次
+        """
+        self.__stop.set()
+        self.__thread.join()
+        self.write()
+
+    def __enter__(self) -> "StatsFile":
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+    def __loop(self):
+        while not self.__stop.wait(self.__interval):
+            try:
+                self.write()
+            except OSError as e:
+                logger.error(f"写入指标文件失败：{e}")
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = 10.0) -> None:
+        """
+        定期写入指标文件
+
+        Args:
+            metrics (Metrics): 指标
+            path (str): 文件路径
+            interval (float, optional): 写入间隔（秒）. Defaults to 10.0.
+        """
+        self.__metrics = metrics
+        self.__path = path
+        self.__interval = interval
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target = self.__loop, name = "metrics-file", daemon = True)
+        self.__thread.start()
+
+
+def _monitoredChunk(processor: EventProcessor, metrics: Metrics, start: int, stop: int,
+                    sample_every: int) -> dict[str, dict[int, int]]:
+    """
+    模拟一块并计入指标，每sample_every局用raceSteps测量一次各阶段耗时
+    """
+    clock = time.perf_counter
+    sampler = BlockSampler(size = 256)
+    final_return: dict[str, dict[int, int]] = {}
+    race_latency = Histogram()
+    phases: dict[str, Histogram] = {}
+    rounds = 0
+    chunk_start = clock()
+    for seed in range(start, stop):
+        sampler.seed(seed)
+        race_start = clock()
+        data = processor.newRaceData(sampler)
+        if sample_every > 0 and seed % sample_every == 0:
+            # 两次暂停之间的耗时属于刚处理完的时机
+            last = clock()
+            for trigger in processor.raceSteps(data):
+                now = clock()
+                if trigger is not EventTrigger.game_start:
+                    phases.setdefault(trigger.name, Histogram()).observe(now - last)
+                last = now
+        else:
+            processor.runRace(data)
+        race_latency.observe(clock() - race_start)
+        rounds += data.round()
+        processor.countResult(final_return, data)
+    phases["race"] = race_latency
+    metrics.record(threading.current_thread().name, stop - start, rounds, clock() - chunk_start, phases)
+    return final_return
+
+
+def monitoredRuns(processor: EventProcessor, times: int, metrics: Metrics, seed: int = 0,
+                  workers: int | None = 1, chunk_size: int = 1000, sample_every: int = 64) -> dict[str, dict[int, int]]:
+    """
+    按种子区间分块模拟并更新指标，第i局使用种子seed + i，结果与runsSeedRange(seed, seed + times)相同
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        times (int): 运行次数
+        metrics (Metrics): 指标，每块完成后更新
+        seed (int, optional): 起始种子. Defaults to 0.
+        workers (int | None, optional): 线程数，1为在当前线程中模拟，None为CPU数. Defaults to 1.
+        chunk_size (int, optional): 每块的局数，也是指标更新的粒度. Defaults to 1000.
+        sample_every (int, optional): 每隔多少局测量一次各阶段耗时，0为不测量. Defaults to 64.
+
+    Returns:
+        dict[str, dict[int, int]]: 运行结果
+    """
+    bounds = [(start, min(start + chunk_size, seed + times)) for start in range(seed, seed + times, chunk_size)]
+    if workers == 1:
+        results = [_monitoredChunk(processor, metrics, start, stop, sample_every) for start, stop in bounds]
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(workers or os.cpu_count() or 1, thread_name_prefix = "runs") as executor:
+            results = list(executor.map(lambda bound: _monitoredChunk(processor, metrics, *bound, sample_every), bounds))
+    return EventProcessor.mergeResults(results)
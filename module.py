@@ -2,6 +2,15 @@ from calendar import day_abbr
 from math import log
 import re
 from globals import *
+from typing import TYPE_CHECKING, Generator
+from rng import Sampler, BlockSampler
+from track import Track
+
+if TYPE_CHECKING:
+    from stats import SkillStats
+    from compiler import CompiledRace
+    from concurrent.futures import Executor
+    from endgame import EndgameTable
 
 class EventTrigger(Enum):
     """
@@ -47,6 +56,10 @@ class MoveResult(Enum):
 
 
 class Skill:
+    __slots__ = (
+        "_trigger", "_condition", "_effect", "_target", "_owner", "_holder",
+        "__name", "__describe", "__name_format", "__effect_times",
+        )
 
 # 时机
     def isTrigger(self, trigger: EventTrigger):
@@ -82,7 +95,7 @@ class Skill:
             case _ if isinstance(condition, bool):
                 return condition
             case _ if isinstance(condition, float):
-                return random.random() < condition
+                return data.chance(condition, self.__name)
             case _ if callable(condition):
                 return condition(data)
             case _:
@@ -104,7 +117,7 @@ class Skill:
             case _ if isinstance(condition, bool):
                 return lambda data: True
             case _ if isinstance(condition, float):
-                return lambda data: random.random() < condition
+                return lambda data: data.chance(condition, self.__name)
             case _ if callable(condition):
                 return condition
             case _:
@@ -132,6 +145,13 @@ class Skill:
         else:
             raise TypeError("角色目标为None")
     def setTarget(self, target : "Role"):
+        holder = self._holder
+        if holder is not None:              # 添加后再修改目标，更新新旧目标身上其他角色技能的计数
+            previous = self._target
+            if previous is not None and previous is not holder:
+                previous._targetedBy -= 1
+            if target is not holder:
+                target._targetedBy += 1
         self._target = target
 
 # 技能效果
@@ -194,6 +214,9 @@ class Skill:
         # t = [self.isTrigger(trigger), self.isTarget(data.getNowRole()), self.isCondition(data)]    # NOICE 非测试请注释掉，且这个会使满足条件就失效的技能报错
         if self.isTrigger(trigger) and self.isTarget(data.nowRole()) and self.meetCondition(data):
             self.skillEffect(data)
+            hook = data.skillHook()
+            if hook is not None:
+                hook(self, data)
             return True
         return False
     def tryUseSkill2(self, trigger: EventTrigger, data: "EventData") -> bool:
@@ -211,6 +234,9 @@ class Skill:
         """
         if self.isTrigger(trigger) and self.meetCondition(data):
             self.skillEffect(data)
+            hook = data.skillHook()
+            if hook is not None:
+                hook(self, data)
             return True
         return False
 
@@ -303,10 +329,51 @@ class Skill:
         self.__name = name
         self.__describe = describe
         self._owner : "Role | None" = None
+        self._holder : "Role | None" = None     # 技能所在的角色，由appSkill和removeSkill维护
         self.__name_format: str | None = None
         self.__effect_times: int = 0
 
+# 临时技能的效果
+# 不使用闭包：函数不会被深拷贝，对局中途复制本局数据时，闭包中的角色和计数器仍是原对局的
+class _TempEffect:
+    """
+    临时技能的效果：发动原技能后删除临时技能
+    """
+    __slots__ = ("role", "skill", "temp")
+
+    def __call__(self, data: "EventData"):
+        logger.debug("技能生效条件通过，删除临时技能")
+        self.skill.skillEffect(data)
+        self.role.removeSkill(self.temp)
+
+    def __init__(self, role: "Role", skill: Skill, temp: Skill) -> None:
+        self.role = role
+        self.skill = skill
+        self.temp = temp
+
+
+class _RoundCounter:
+    """
+    剩余回合计数器的效果：每回合自减1，达到0后为角色添加临时技能并删除计数器
+    """
+    __slots__ = ("role", "skill", "counter", "count")
+
+    def __call__(self, data: "EventData"):
+        self.count -= 1
+        if self.count <= 0:
+            logger.debug("剩余回合计数器已满足移除条件，被移除")
+            self.role.addTempSkill(self.skill)
+            self.role.removeSkill(self.counter)
+            self.count = None        # NOICE 是否需要将变量设为None，存疑
+
+    def __init__(self, role: "Role", skill: Skill, counter: Skill, count: int) -> None:
+        self.role = role
+        self.skill = skill
+        self.counter = counter
+        self.count: int | None = count
+
 class Role:
+    __slots__ = ("_name", "_skills", "_getMoveNum", "_moveDistribution", "__cell", "_head", "_bottom", "_targetedBy")
 
 # 赛道
     def resetCell(self):
@@ -343,7 +410,11 @@ class Role:
             trigger (Trigger): 当前触发时机
             data (Data): 数据
         """
-        for skill in self._skills.copy():
+        skills = self._skills
+        if len(skills) == 1:                # 只有一个技能时不需要复制列表
+            skills[0].tryUseSkill(trigger, data)
+            return
+        for skill in skills.copy():
             skill.tryUseSkill(trigger, data)
     def tryUseSkills2(self, trigger: EventTrigger, data: "EventData"):
         """
@@ -353,7 +424,11 @@ class Role:
             trigger (EventTrigger): 时机
             data (EventData): 数据
         """
-        for skill in self._skills.copy():
+        skills = self._skills
+        if len(skills) == 1:
+            skills[0].tryUseSkill2(trigger, data)
+            return
+        for skill in skills.copy():
             skill.tryUseSkill2(trigger, data)
 
     def appSkill(self, skill : Skill) -> "Role":
@@ -374,6 +449,10 @@ class Role:
             skill.setTarget(self)
         if skill.owner() is None:
             skill.setOwner(self)
+        target = skill.target()
+        if target is not self:
+            target._targetedBy += 1     # type: ignore
+        skill._holder = self
         self._skills.append(skill)
         logger.debug(f"{self}现有技能：{[skill2.name() for skill2 in self.skills()]}")
         return self
@@ -393,15 +472,8 @@ class Role:
             Role: 角色
         """
         dc_skill = skill.deepcopy()     # NOICE 请不要去掉这个，然后修改skill的生效效果。如果这样写实际效果就是：生效技能生效，这和python引用赋值有关
-        
-        def pack():
-            def newEffect(data: EventData):
-                logger.debug("技能生效条件通过，删除临时技能")
-                skill.skillEffect(data)
-                self.removeSkill(dc_skill)
-            return newEffect
-        
-        dc_skill.setEffect(pack())
+
+        dc_skill.setEffect(_TempEffect(self, skill, dc_skill))
         return self.appSkill(dc_skill)
     
     def addTempSkillOfRound(self, skill: Skill, round_num: int = 1) -> "Role":
@@ -430,20 +502,8 @@ class Role:
             "剩余回合计数器", 
             "每回合自减1，计数器达到0后为目标添加一个临时技能"
             )
-        
-        def pack():
-            count = round_num
-            def triEffect(data: EventData):
-                nonlocal count
-                count -= 1
-                if count <= 0:
-                    logger.debug("剩余回合计数器已满足移除条件，被移除")
-                    self.addTempSkill(skill)
-                    self.removeSkill(skill2)
-                    count = None        # NOICE 是否需要将变量设为None，存疑
-            return triEffect
-
-        skill2.setEffect(pack())
+
+        skill2.setEffect(_RoundCounter(self, skill, skill2, round_num))
         self.appSkill(skill2)
         return self
     def addTempSkillOfRound2(self, add_move_num: int, round_num: int = 1) -> "Role":
@@ -485,6 +545,10 @@ class Role:
         """
         logger.debug(f"删除技能{skill}")
         self._skills.remove(skill)
+        skill._holder = None
+        target = skill.target()
+        if target is not self and target is not None:
+            target._targetedBy -= 1
         logger.debug(f"剩余技能：{[skill2.name() for skill2 in self.skills()]}")
         return True
     def removeSkill2(self, Id : int) -> bool:
@@ -527,9 +591,67 @@ class Role:
         logger.debug("获取移动格数")
         return self._getMoveNum()
     def setMoveFunc(self, func : Callable[[], int]):
+        """
+        设置获取移动格数的函数
+        
+        函数对采样器不可见，因此会清除移动分布，重要性采样等功能无法对其进行偏置
+
+        Args:
+            func (Callable[[], int]): 返回移动格数的函数
+        """
         logger.debug("设置获取移动格数的函数")
         self._getMoveNum = func
+        self._moveDistribution = None
+        return self
+    def setMoveDistribution(self, values: list[int], weights: list[float] | None = None) -> "Role":
+        """
+        以声明的方式设置移动格数分布
+        
+        与setMoveFunc不同，声明的分布会由采样器进行抽取
+
+        Args:
+            values (list[int]): 可能的移动格数
+            weights (list[float] | None, optional): 各格数的权重，不填则为均匀分布. Defaults to None.
+
+        Returns:
+            Role: 角色
+        """
+        logger.debug("设置移动格数分布")
+        values_t = tuple(values)
+        if weights is None:
+            weights_t = None
+            self._getMoveNum = lambda : random.choice(values_t)
+        else:
+            if len(weights) != len(values_t) or sum(weights) <= 0:
+                raise ValueError("移动格数权重错误，请检查权重数量和取值")
+            total = sum(weights)
+            weights_t = tuple(weight / total for weight in weights)
+            self._getMoveNum = lambda : random.choices(values_t, weights_t)[0]
+        self._moveDistribution = (values_t, weights_t)
         return self
+    def moveDistribution(self) -> tuple[tuple[int, ...], tuple[float, ...] | None] | None:
+        """
+        获取声明的移动格数分布
+
+        Returns:
+            tuple[tuple[int, ...], tuple[float, ...] | None] | None: (格数, 概率)，概率为None时为均匀分布；
+                使用setMoveFunc设置的函数则返回None
+        """
+        return self._moveDistribution
+    def moveProbabilities(self) -> tuple[float, ...] | None:
+        """
+        获取声明的移动格数分布中各格数的概率
+
+        Returns:
+            tuple[float, ...] | None: 与moveDistribution的格数一一对应的概率
+        """
+        distribution = self._moveDistribution
+        if distribution is None:
+            return None
+        values, weights = distribution
+        if weights is None:
+            return tuple(1 / len(values) for _ in values)
+        return weights
 
 # 移动
     def tryHeadRoleMove(self, num : int):
@@ -539,9 +661,10 @@ class Role:
         Args:
             num (int): 移动步数
         """
-        result = self.findAllHeadRole()
-        for role in result:
+        role = self._head                  # 直接沿链表移动，不生成列表
+        while role is not None:
             role.move2(num)
+            role = role._head
     def move(self, num : int, roles: list["Role"]):
         """
         移动，会连带移动头顶的角色，会删除原本底部角色然后设置新底部角色
@@ -752,11 +875,15 @@ class Role:
         
         self._skills : list[Skill] = []
         self._getMoveNum : Callable[[], int] = lambda : random.choice([1, 2, 3])
+        self._moveDistribution : tuple[tuple[int, ...], tuple[float, ...] | None] | None = ((1, 2, 3), None)
         self.__cell = 0    
         self._head : "Role | None" = None
         self._bottom : "Role | None" = None
+        # 其他角色身上以此角色为目标的技能数，为0时此角色准备移动只需要检测自身的技能
+        self._targetedBy = 0
 
 class RoleData:
+    __slots__ = ("_roles",)
     
     def roles(self) -> list[Role]:
         """
@@ -799,6 +926,10 @@ class EventData(RoleData):
     """
     事件数据，包含对局情况和角色相关
     """
+    __slots__ = (
+        "__moveOrder", "__movedRoles", "__movedSet", "__moveNum", "__nowRole", "__length", "__track",
+        "__rankingOfRoles", "__now", "__round", "__sampler", "__skillHook",
+        )
     
 # 当前处理角色      # TODO 等待移出
     def resetNowRole(self):
@@ -908,13 +1039,19 @@ class EventData(RoleData):
         Args:
             role (Role): 进入终点的角色
         """
-        roles = [role] + role.findAllHeadRole()
-        
         rankingNum = len(self.__rankingOfRoles) + 1
-        for role in roles:
-            logger.info(f"{role._name}进入终点")
+        head: Role | None = role
+        finished: set[Role] = set()
+        while head is not None:
+            logger.info(f"{head._name}进入终点")
+            finished.add(head)
+            self.__rankingOfRoles[head] = rankingNum
+            head = head._head
+        # 一起进入终点的角色一次删除，保持剩余角色的顺序
+        if len(finished) == 1:
             self.removeRole(role)
-            self.__rankingOfRoles[role] = rankingNum
+        else:
+            self._roles[:] = [other for other in self._roles if other not in finished]
     def rankingOfRoles(self):
         return self.__rankingOfRoles
 
@@ -942,19 +1079,19 @@ class EventData(RoleData):
         Returns:
             Role | None: 下一个移动角色，或为无目标、所有角色都移动过
         """
-        # role = self.moveOrder()[len(self.movedRoles())]
-        for role in (self.moveOrder()[len(self.movedRoles()):]):
+        # 从已移动的次数开始向后找，不复制列表
+        order = self.__moveOrder
+        for i in range(len(self.__movedRoles), len(order)):
+            role = order[i]
             if not role.isInEndpoint(length):
                 return role
-        else:
-            return
+        return None
     def newMoveOrder(self):
         """
         快速生成一个随机移动顺序，存于自身
         """
-        roles = self.roles()
         self.setMoveOrder(
-            random.sample(roles, len(roles))
+            self.sampler().moveOrder(self.roles())
             )
 
 # 移动过
@@ -976,7 +1113,7 @@ class EventData(RoleData):
         Returns:
             bool: 是否移动过
         """
-        return role in self.__movedRoles
+        return role in self.__movedSet
     def addMovedRole(self, role: Role):
         """
         将一名角色设置为移动过
@@ -986,12 +1123,14 @@ class EventData(RoleData):
         """
         logger.debug(f"设置角色{role.name()}已经移动过")
         self.__movedRoles.append(role)
+        self.__movedSet.add(role)
     def clearMovedList(self):
         """
         清空移动过角色的列表
         """
         logger.debug("清空移动过的角色列表")
         self.__movedRoles.clear()
+        self.__movedSet.clear()
     def isAllMoved(self) -> bool:
         """
         返回角色是否全部移动过
@@ -999,7 +1138,7 @@ class EventData(RoleData):
         Returns:
             bool: 是否全部移动过
         """
-        return len(self.moveOrder()) == len(self.movedRoles())
+        return len(self.__moveOrder) == len(self.__movedRoles)
 
 # 移动步数
     def setMoveNum(self, num : int):
@@ -1044,12 +1183,88 @@ class EventData(RoleData):
             return length 
     def setLength(self, length: int):
         """
-        设置赛道长度
+        设置赛道长度，会替换为没有特殊格子的赛道
 
         Args:
             length (int): 长度
         """
-        self.__length = length
+        self.setTrack(Track(length))
+    def track(self) -> Track:
+        """
+        获取赛道
+
+        Returns:
+            Track: 赛道
+        """
+        track = self.__track
+        if track is None:
+            raise TypeError(f"track不应该为None")
+        return track
+    def setTrack(self, track: Track):
+        """
+        设置赛道
+
+        Args:
+            track (Track): 赛道
+        """
+        self.__track = track
+        self.__length = track.length()
+
+# 随机
+    def sampler(self) -> "Sampler":
+        """
+        获取本局使用的采样器
+
+        Returns:
+            Sampler: 采样器
+        """
+        sampler = self.__sampler
+        if sampler is None:
+            raise TypeError(f"sampler不应该为None")
+        else:
+            return sampler
+    def setSampler(self, sampler: "Sampler | None"):
+        """
+        设置本局使用的采样器
+
+        Args:
+            sampler (Sampler | None): 采样器
+        """
+        self.__sampler = sampler
+    def chance(self, probability: float, key: str = "") -> bool:
+        """
+        以probability的概率返回True
+        
+        技能条件中的概率判断请调用这个而不是random.random，这样采样器才能看到并进行偏置
+
+        Args:
+            probability (float): 概率，取值为0~1.0
+            key (str, optional): 概率的标识，一般为技能名. Defaults to "".
+
+        Returns:
+            bool: 是否通过
+        """
+        return self.sampler().chance(probability, key)
+
+# 追踪
+    def skillHook(self) -> "Callable[[Skill, EventData], None] | None":
+        """
+        获取技能发动后调用的函数
+
+        Returns:
+            Callable[[Skill, EventData], None] | None: 函数，没有则为None
+        """
+        return self.__skillHook
+    def setSkillHook(self, hook: "Callable[[Skill, EventData], None] | None"):
+        """
+        设置技能发动后调用的函数，参数为发动的技能和本局数据，只对本局生效
+
+        角色技能组中的技能发动时才会调用，临时技能内部发动的原技能不会重复调用
+
+        Args:
+            hook (Callable[[Skill, EventData], None] | None): 函数，None为取消
+        """
+        self.__skillHook = hook
 
 # 调试
     def setMoveOrderOfSeq(self, role1_seq: int, role2_seq: int):
@@ -1101,13 +1316,17 @@ class EventData(RoleData):
         """
         super().__init__()
         self.__moveOrder: list[Role] = []       # 移动顺序
-        self.__movedRoles: list[Role] = []      # 移动过的角色
+        self.__movedRoles: list[Role] = []      # 移动过的角色，按移动顺序
+        self.__movedSet: set[Role] = set()      # 移动过的角色，用于判断
         self.__moveNum: int = 0                 # 移动格数
         self.__nowRole: Role | None = None      # 当前处理角色
         self.__length: int | None = None        # 赛道长度
+        self.__track: Track | None = None       # 赛道
         self.__rankingOfRoles: dict[Role, int] = {}
         self.__now = EventTrigger.unstart       #当前时机
         self.__round = 0
+        self.__sampler: Sampler | None = None   # 采样器
+        self.__skillHook: Callable[[Skill, EventData], None] | None = None     # 技能发动后调用，用于追踪
 
 class EventProcessor:
     """
@@ -1118,7 +1337,7 @@ class EventProcessor:
     def setInitData(self, data: EventData):
         self.__init_data = data
         if data is not None:
-            self.__data.setLength(data.length())
+            self.__data.setTrack(data.track())
     def initData(self) -> EventData | None:
         """
         获取初始化数据
@@ -1140,6 +1359,46 @@ class EventProcessor:
         else:
             raise TypeError("初始化数据错误")
 
+    def sampler(self) -> Sampler:
+        """
+        获取采样器
+
+        Returns:
+            Sampler: 采样器
+        """
+        return self.__sampler
+    def setSampler(self, sampler: Sampler):
+        """
+        设置采样器，下一局开始生效
+
+        Args:
+            sampler (Sampler): 采样器
+        """
+        self.__sampler = sampler
+    def setSeed(self, seed: int | None):
+        """
+        重设本处理器采样器的种子，相同种子和相同角色配置下runs的结果相同
+
+        Args:
+            seed (int | None): 种子
+        """
+        self.__sampler.seed(seed)
+    def endgameTable(self) -> "EndgameTable | None":
+        return self.__endgame
+    def setEndgameTable(self, table: "EndgameTable | None"):
+        """
+        设置残局表，参考endgame.py
+
+        只有runs、runsWith、runsSeedRange、threadRuns和runRace在调用时填写endgame=True才会查表：每回合开始前查表，
+        进入表中的残局状态后按精确分布抽取剩余角色的名次并结束对局，不在表中的照常模拟。
+        查表改变了每局的随机抽取，结果与不查表时同分布但不逐局相同，查表后的技能发动也不会被统计；
+        其余功能（raceSteps、编译版本、敏感度分析、差量模拟、追踪、结果缓存等）调用时不查表，设置残局表不影响它们的结果
+
+        Args:
+            table (EndgameTable | None): 残局表，None为不使用
+        """
+        self.__endgame = table
+
     def data(self) -> EventData:
         """
         获取本局游戏数据
@@ -1164,8 +1423,25 @@ class EventProcessor:
         初始化游戏开始数据
         """
         logger.debug("进行数据初始化")
-        init_data = self.initData2()
-        self.__data = init_data.deepcopy()
+        self.__data = self.newRaceData()
+    def newRaceData(self, sampler: Sampler | None = None) -> EventData:
+        """
+        从初始数据复制出一局新的数据
+        
+        不会修改处理器自身，多线程同时模拟时每个线程应使用自己的采样器
+
+        Args:
+            sampler (Sampler | None, optional): 本局使用的采样器，不填则使用处理器的采样器. Defaults to None.
+
+        Returns:
+            EventData: 本局数据
+        """
+        if sampler is None:
+            sampler = self.__sampler
+        data = self.initData2().deepcopy()
+        data.setSampler(sampler)
+        sampler.newRace()
+        return data
 
 # 结果
     def resultsToProbability(self, result: dict[str, dict[int, int]], times: int) -> dict[str, dict[int, str]]:
@@ -1187,106 +1463,150 @@ class EventProcessor:
                 final_return[name][ranking_num] = "{:.2%}".format(result[name][ranking_num] / times)
         
         return final_return
+    @staticmethod
+    def mergeResults(results: list[dict[str, dict[int, int]]]) -> dict[str, dict[int, int]]:
+        """
+        合并多个runs结果
+
+        Args:
+            results (list[dict[str, dict[int, int]]]): runs结果列表
+
+        Returns:
+            dict[str, dict[int, int]]: 合并后的结果
+        """
+        final_return: dict[str, dict[int, int]] = {}
+        for result in results:
+            for name in result:
+                final_return.setdefault(name, {})
+                for ranking_num, count in result[name].items():
+                    final_return[name][ranking_num] = final_return[name].get(ranking_num, 0) + count
+        return final_return
                 
 # 检测技能
-    def checkTrigger(self):
+    def checkTrigger(self, data: EventData | None = None):
         """
         尝试使用所有角色的技能
         
-        每次时机都会检测所有角色的技能，因此相对效率会慢点
+        其他角色没有以当前角色为目标的技能时只检测当前角色的技能，结果与检测所有角色相同
+
+        Args:
+            data (EventData | None, optional): 本局数据，不填则为处理器自身的数据. Defaults to None.
         """
-        data = self.data()
+        if data is None:
+            data = self.data()
         roles = data.roles()
+        now_role = data.nowRole()
         
+        # 其他角色的技能都不以当前角色为目标时，只有当前角色的技能可能发动，其余角色的技能都不满足目标判断
+        if now_role is not None and not now_role._targetedBy:
+            now_role.tryUseSkills(data.now(), data)
+            if now_role._targetedBy:        # 技能效果为其他角色添加了以当前角色为目标的技能，补上排在后面的角色
+                for role in roles[roles.index(now_role) + 1:]:
+                    role.tryUseSkills(data.now(), data)
+            return
         for role in roles:
             role.tryUseSkills(data.now(), data)
-    def checkTrigger2(self):
+    def checkTrigger2(self, data: EventData | None = None):
         """
         同checkTrigger，但是这是专门在turnStart时，也就是没有当前处理角色时使用的函数
         
         此函数不会检查当前处理角色是否为空
 
         Args:
-            trigger (EventTrigger): 时机
+            data (EventData | None, optional): 本局数据，不填则为处理器自身的数据. Defaults to None.
         """
-        data = self.data()
+        if data is None:
+            data = self.data()
         roles = data.roles()
         
         for role in roles:
             role.tryUseSkills2(data.now(), data)
 
 # 主逻辑
-    def gameStart(self) -> EventData:
+# 以下函数的data参数不填时使用处理器自身的数据，填写时只操作传入的数据，不修改处理器，可用于多线程
+    def gameStart(self, data: EventData | None = None) -> EventData:
         """
         进行游戏开始时的操作，包括复制初始数据操作
 
+        Args:
+            data (EventData | None, optional): 由newRaceData得到的本局数据，不填则复制一份作为处理器自身的数据. Defaults to None.
+
         Returns:
             EventData: 事件数据
         """
-        data = self.data()
         logger.info("游戏开始")
-        logger.debug("初始化数据")
-        self.gameStartInit()
+        if data is None:
+            logger.debug("初始化数据")
+            self.gameStartInit()
+            data = self.data()
         data.setNow(EventTrigger.game_start)
         return data
-    def turnStart(self) -> EventData:
+    def turnStart(self, data: EventData | None = None) -> EventData:
         """
         开启一个新的回合，增加回合数，并生成一个新移动顺序，检测所有角色的触发器
 
         Returns:
             EventData: 事件数据
         """
-        data = self.data()
+        if data is None:
+            data = self.data()
         data.setNow(EventTrigger.round_start)
         data.clearMovedList()
         data.addRound()
         logger.info(f"第{data.round()}回合")
         data.newMoveOrder()
         logger.debug(f"原始移动顺序为{[role.name() for role in data.moveOrder()]}")
-        self.checkTrigger2()
+        self.checkTrigger2(data)
         return data
-    def moveBefore(self) -> MoveResult:
+    def moveBefore(self, data: EventData | None = None) -> MoveResult:
         """
         准备阶段
 
         Returns:
             MoveResult: 只会有两个返回值，all_moved和can_next_step
         """
-        self.data().setNow(EventTrigger.move_before)
-        data = self.data()
+        if data is None:
+            data = self.data()
+        data.setNow(EventTrigger.move_before)
         role = data.nextMoveRole(data.length())
         if role is None:
             return MoveResult.all_moved
         else:
             data.setNowRole(role)
-            data.setMoveNum(role.generatedMoveNum())
+            data.setMoveNum(data.sampler().moveNum(role))
             logger.debug(f"{role.name()}准备移动{data.moveNum()}格")
-            self.checkTrigger()
+            self.checkTrigger(data)
             return MoveResult.can_next_step
-    def moveBegin(self) -> MoveResult:
-        self.data().setNow(EventTrigger.move_begin)
-        data = self.data()
+    def moveBegin(self, data: EventData | None = None) -> MoveResult:
+        if data is None:
+            data = self.data()
+        data.setNow(EventTrigger.move_begin)
         role = data.nowRole2()
         role.move(data.moveNum(), data.roles())
         return MoveResult.can_next_step
-    def moveEnd(self) -> MoveResult:
-
-        data = self.data()
+    def moveEnd(self, data: EventData | None = None) -> MoveResult:
+        if data is None:
+            data = self.data()
         data.setNow(EventTrigger.move_end)
         role = data.nowRole2()
+        track = data.track()
+        if track.hasEffects():
+            effect = track.effectAt(role.cell())
+            if effect is not None:
+                effect.land(data, role)
         data.addMovedRole(role)
         logger.debug(f"{role}到达{role.cell()}格")
         
         if role.isInEndpoint(data.length()):
             data.setRoleInEndpoint(role)
-            self.data().resetNowRole()
+            data.resetNowRole()
             if data.isEnd():
                 return MoveResult.game_end
         if data.isAllMoved():
             return MoveResult.all_moved
         else:
             return MoveResult.not_all_moved
-    def move(self) -> tuple[EventData, MoveResult]:
+    def move(self, data: EventData | None = None) -> tuple[EventData, MoveResult]:
         """
         移动一个角色
 
@@ -1295,24 +1615,27 @@ class EventProcessor:
                 参数1为事件数据。
                 参数2为移动结果，有三种返回值，not_all_moved、all_moved和game_end
         """
-        match self.moveBefore():
+        if data is None:
+            data = self.data()
+        match self.moveBefore(data):
             case MoveResult.all_moved:
                 move_result = MoveResult.all_moved
             case MoveResult.can_next_step:
-                self.moveBegin()
-                move_result = self.moveEnd()
+                self.moveBegin(data)
+                move_result = self.moveEnd(data)
             case _:
                 logger.exception("未定义的结果")
                 raise ValueError("函数返回结果错误，请查看情况")
-        return self.data(), move_result
-    def gameEnd(self) -> EventData:
+        return data, move_result
+    def gameEnd(self, data: EventData | None = None) -> EventData:
         """
         结束游戏
 
         Returns:
             EventData: 事件数据
         """
-        data = self.data()
+        if data is None:
+            data = self.data()
         data.setNow(EventTrigger.game_end)
         data.resetNowRole()
         return data
@@ -1326,45 +1649,326 @@ class EventProcessor:
             EventData: 事件数据
         """
         self.gameStart()
+        return self.runRace(self.data())
+    def runRace(self, data: EventData, until: Callable[[EventData], bool] | None = None,
+                endgame: bool = False) -> EventData:
+        """
+        将传入的本局数据模拟到结束
+        
+        只操作传入的数据，不修改处理器，不同线程各自传入newRaceData得到的数据即可同时模拟
+
+        Args:
+            data (EventData): 本局数据，一般由newRaceData得到
+            until (Callable[[EventData], bool] | None, optional): 提前结束的条件，每当有角色进入终点后调用，
+                返回True时立即返回（此时本局数据停在移动结束，未进入终点的角色没有排名）. Defaults to None.
+                填写时不使用残局表
+            endgame (bool, optional): 是否使用setEndgameTable设置的残局表. Defaults to False.
+
+        Returns:
+            EventData: 事件数据
+        """
+        if data.now() is EventTrigger.unstart:
+            self.gameStart(data)
         
+        ranking = data.rankingOfRoles()
+        finished = len(ranking)
+        table = self.__endgame if endgame and until is None else None
         while(True):
-            self.turnStart()
+            if table is not None and table.resolve(data):
+                self.gameEnd(data)
+                return data
+            self.turnStart(data)
             while(True):
-                move_result = self.move()[1]
+                move_result = self.move(data)[1]
+                if until is not None and len(ranking) != finished:
+                    finished = len(ranking)
+                    if move_result is not MoveResult.game_end and until(data):
+                        return data
                 match(move_result):
                     case MoveResult.not_all_moved:
                         continue
                     case MoveResult.all_moved:
                         break
                     case MoveResult.game_end:
-                        self.gameEnd()
-                        return self.data()
+                        self.gameEnd(data)
+                        return data
                         # return self.data().rankingOfRoles()
-    def runs(self, times: int) -> dict[str, dict[int, int]]:
+    def raceSteps(self, data: EventData) -> Generator[EventTrigger, None, EventData]:
+        """
+        将传入的本局数据逐步模拟的生成器，在每个时机处理完后暂停并返回该时机
+        
+        依次产生game_start（仅当本局尚未开始）、每回合的round_start、每个角色的move_before、move_begin和move_end，最后为game_end。
+        暂停时可以读取或修改本局数据（如在move_before修改移动格数），恢复后按修改后的数据继续；
+        不修改时与runRace的调用顺序完全相同，结果也相同。
+        
+        每局的状态只保存在本局数据和生成器中，多局可以在同一线程中交替推进，参考scheduler.py
+        
+        传入停在move_end的本局数据（如在move_end暂停时复制的数据）时，从该角色移动结束后继续，先完成本回合剩余的移动
+
+        例：
+            steps = ep.raceSteps(ep.newRaceData())
+            for trigger in steps:
+                ...
+
+        Args:
+            data (EventData): 本局数据，一般由newRaceData得到
+
+        Returns:
+            EventData: 生成器结束时返回本局数据
+        """
+        if data.now() is EventTrigger.unstart:
+            self.gameStart(data)
+            yield EventTrigger.game_start
+        resume = data.now() is EventTrigger.move_end
+        if resume and data.isEnd():
+            self.gameEnd(data)
+            yield EventTrigger.game_end
+            return data
+        while(True):
+            if not resume:
+                self.turnStart(data)
+                yield EventTrigger.round_start
+            resume = False
+            while(True):
+                if self.moveBefore(data) is MoveResult.all_moved:
+                    break
+                yield EventTrigger.move_before
+                self.moveBegin(data)
+                yield EventTrigger.move_begin
+                move_result = self.moveEnd(data)
+                yield EventTrigger.move_end
+                match(move_result):
+                    case MoveResult.not_all_moved:
+                        continue
+                    case MoveResult.all_moved:
+                        break
+                    case MoveResult.game_end:
+                        self.gameEnd(data)
+                        yield EventTrigger.game_end
+                        return data
+    def runs(self, times: int, skill_stats: "SkillStats | None" = None, endgame: bool = False) -> dict[str, dict[int, int]]:
         """
         多次模拟运行
 
         Args:
             times (int): 运行次数
+            skill_stats (SkillStats | None, optional): 技能发动统计，填写时每局结束后计入，可由SkillStats.of创建. Defaults to None.
+            endgame (bool, optional): 是否使用残局表，见setEndgameTable. Defaults to False.
 
         Returns:
             dict[str, dict[int, int]]: 运行结果
         """
         startTime = time.time()
+        final_return = self.runsWith(times, self.__sampler, skill_stats, endgame)
+        endTime = time.time()
+        # logger.info(f"模拟次数：{times}\n模拟时间：{endTime - startTime}秒")
+        print(f"模拟次数：{times}\n模拟时间：{endTime - startTime}秒")
+        return final_return
+    def runsWith(self, times: int, sampler: Sampler, skill_stats: "SkillStats | None" = None,
+                 endgame: bool = False) -> dict[str, dict[int, int]]:
+        """
+        使用指定采样器多次模拟运行，不修改处理器，也不输出时间
+
+        Args:
+            times (int): 运行次数
+            sampler (Sampler): 采样器，同一时间只能被一个线程使用
+            skill_stats (SkillStats | None, optional): 技能发动统计. Defaults to None.
+            endgame (bool, optional): 是否使用残局表，见setEndgameTable. Defaults to False.
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
         final_return: dict[str, dict[int, int]] = {}
         for i in range(times):
-            new_result_dict = self.run().resultToNameDict()
+            data = self.runRace(self.newRaceData(sampler), endgame = endgame)
+            self.countResult(final_return, data)
+            if skill_stats is not None:
+                skill_stats.add(data)
+        return final_return
+    def runsSeedRange(self, start: int, stop: int, sampler: Sampler | None = None,
+                      skill_stats: "SkillStats | None" = None, endgame: bool = False) -> dict[str, dict[int, int]]:
+        """
+        按种子区间多次模拟运行，第i局使用种子i
+        
+        结果只取决于种子区间，与区间如何切分、由哪个线程或机器运行无关，可用于分布式和追加模拟
+
+        Args:
+            start (int): 起始种子（包含）
+            stop (int): 结束种子（不包含）
+            sampler (Sampler | None, optional): 采样器，每局开始前会被重设种子，不填则新建一个成块采样器. Defaults to None.
+            skill_stats (SkillStats | None, optional): 技能发动统计. Defaults to None.
+            endgame (bool, optional): 是否使用残局表，见setEndgameTable. Defaults to False.
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        if sampler is None:
+            sampler = BlockSampler(size = 256)
+        final_return: dict[str, dict[int, int]] = {}
+        for seed in range(start, stop):
+            sampler.seed(seed)
+            data = self.runRace(self.newRaceData(sampler), endgame = endgame)
+            self.countResult(final_return, data)
+            if skill_stats is not None:
+                skill_stats.add(data)
+        return final_return
+    @staticmethod
+    def countResult(final_return: dict[str, dict[int, int]], data: EventData):
+        """
+        将一局的结果计入runs结果
+
+        Args:
+            final_return (dict[str, dict[int, int]]): runs结果，会被修改
+            data (EventData): 结束的本局数据
+        """
+        new_result_dict = data.resultToNameDict()
+        
+        for name in new_result_dict:
+            final_return.setdefault(name, {})
+            ranking_num = new_result_dict[name]
             
-            for name in new_result_dict:
-                final_return.setdefault(name, {})
-                ranking_num = new_result_dict[name]
-                
-                final_return[name][ranking_num] = final_return[name].get(ranking_num, 0) + 1
+            final_return[name][ranking_num] = final_return[name].get(ranking_num, 0) + 1
+    def threadRuns(self, times: int, workers: int | None = None, seed: int | None = None,
+                   skill_stats: "SkillStats | None" = None, endgame: bool = False) -> dict[str, dict[int, int]]:
+        """
+        使用线程池多次模拟运行
+        
+        每个线程有自己的采样器和本局数据，共享只读的初始数据。
+        在自由线程（无GIL）的CPython 3.13+上可随线程数扩展，有GIL时与runs速度相近。
+        相同的seed和workers得到相同的结果
+
+        Args:
+            times (int): 运行次数
+            workers (int | None, optional): 线程数，不填则为CPU数. Defaults to None.
+            seed (int | None, optional): 种子，不填则随机. Defaults to None.
+            skill_stats (SkillStats | None, optional): 技能发动统计，每个线程各自统计后合并到这里. Defaults to None.
+            endgame (bool, optional): 是否使用残局表，见setEndgameTable. Defaults to False.
 
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        import os
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, times))
+        seeds = random.Random(seed).sample(range(1 << 62), workers)
+        counts = [times // workers + (1 if i < times % workers else 0) for i in range(workers)]
+        
+        worker_stats = [None if skill_stats is None else skill_stats.empty() for _ in range(workers)]
+        
+        startTime = time.time()
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(
+                lambda i: self.runsWith(counts[i], BlockSampler(seeds[i]), worker_stats[i], endgame),
+                range(workers)
+            ))
         endTime = time.time()
-        # logger.info(f"模拟次数：{times}\n模拟时间：{endTime - startTime}秒")
-        print(f"模拟次数：{times}\n模拟时间：{endTime - startTime}秒")
-        return final_return
+        if skill_stats is not None:
+            for stats in worker_stats:
+                skill_stats.merge(stats)
+        logger.info(f"模拟次数：{times}\n线程数：{workers}\n模拟时间：{endTime - startTime}秒")
+        return self.mergeResults(results)
+    async def asyncRuns(self, times: int | None = None, budget: float | None = None, seed: int = 0,
+                        executor: "Executor | None" = None, chunk_size: int = 200, parallel: int = 1,
+                        skill_stats: "SkillStats | None" = None) -> tuple[dict[str, dict[int, int]], int]:
+        """
+        在asyncio中多次模拟运行，达到次数或用完时间预算时返回已经得到的结果
+
+        不填executor时在事件循环中逐局模拟，每隔几毫秒让出一次控制权；
+        填写executor时按块交给执行器（一般为ThreadPoolExecutor）运行，事件循环只负责等待和合并。
+        第i局使用种子seed + i，与runsSeedRange相同，因此相同的seed得到的结果只取决于完成的局数。
+
+        任务被取消时抛出asyncio.CancelledError，执行器中未开始的块会被取消，已经开始的块运行完后丢弃
+
+        例：200毫秒内尽量多地模拟
+            result, count = await ep.asyncRuns(budget = 0.2)
+            ep.resultsToProbability(result, count)
+
+        Args:
+            times (int | None, optional): 最多运行次数，不填则只受时间限制. Defaults to None.
+            budget (float | None, optional): 时间预算（秒），不填则只受次数限制. Defaults to None.
+            seed (int, optional): 起始种子. Defaults to 0.
+            executor (Executor | None, optional): 执行器，不填则在事件循环中模拟. Defaults to None.
+            chunk_size (int, optional): 使用执行器时每块的局数. Defaults to 200.
+            parallel (int, optional): 使用执行器时同时运行的块数. Defaults to 1.
+            skill_stats (SkillStats | None, optional): 技能发动统计. Defaults to None.
+
+        Returns:
+            tuple[dict[str, dict[int, int]], int]: (运行结果, 完成的局数)
+        """
+        import asyncio
+
+        if times is None and budget is None:
+            raise ValueError("times和budget至少需要填写一个")
+        loop = asyncio.get_running_loop()
+        deadline = None if budget is None else loop.time() + budget
+        final_return: dict[str, dict[int, int]] = {}
+        done = 0
+
+        # 在事件循环中逐局模拟
+        if executor is None:
+            sampler = BlockSampler(size = 256)
+            last_yield = loop.time()
+            while times is None or done < times:
+                now = loop.time()
+                if deadline is not None and now >= deadline:
+                    break
+                if now - last_yield >= 0.005:
+                    await asyncio.sleep(0)
+                    last_yield = loop.time()
+                    continue
+                sampler.seed(seed + done)
+                data = self.runRace(self.newRaceData(sampler))
+                self.countResult(final_return, data)
+                if skill_stats is not None:
+                    skill_stats.add(data)
+                done += 1
+            return final_return, done
+
+        # 交给执行器按块模拟
+        def runChunk(start: int, stop: int):
+            chunk_stats = None if skill_stats is None else skill_stats.empty()
+            return stop - start, self.runsSeedRange(start, stop, skill_stats = chunk_stats), chunk_stats
+
+        next_seed = seed
+        stop_seed = None if times is None else seed + times
+        running: set[asyncio.Future] = set()
+        try:
+            while True:
+                while len(running) < parallel and (stop_seed is None or next_seed < stop_seed):
+                    end = next_seed + chunk_size if stop_seed is None else min(next_seed + chunk_size, stop_seed)
+                    running.add(loop.run_in_executor(executor, runChunk, next_seed, end))
+                    next_seed = end
+                if not running:
+                    break
+                timeout = None if deadline is None else max(deadline - loop.time(), 0)
+                finished, running = await asyncio.wait(running, timeout = timeout, return_when = asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    count, result, chunk_stats = future.result()
+                    final_return = self.mergeResults([final_return, result])
+                    if skill_stats is not None:
+                        skill_stats.merge(chunk_stats)
+                    done += count
+                if deadline is not None and loop.time() >= deadline:
+                    break
+        finally:
+            for future in running:
+                future.cancel()
+        return final_return, done
+
+    def compile(self) -> "CompiledRace":
+        """
+        为当前的角色配置生成专用的模拟函数，结果与run一致但更快
+        
+        之后修改角色或技能需要重新编译
+
+        Returns:
+            CompiledRace: 编译后的模拟函数，用法与run、runs相同
+        """
+        from compiler import CompiledRace
+        return CompiledRace(self)
 
 # 示例
     def addExampleTestRole1(self):
@@ -1402,13 +2006,14 @@ class EventProcessor:
         )
     
     def addZaNi(self):
+        # 由于是进行深拷贝再模拟，因此通过data获取角色，而不是直接使用role
         role = self.addRole(Role("赞妮"))
-        role.setMoveFunc(lambda: random.choice([1, 3]))
+        role.setMoveDistribution([1, 3])
         role.appSkill(
             Skill(
                 EventTrigger.move_before,
-                lambda data: role.isStack() and random.random() < 0.4,
-                lambda data: role.addTempSkillOfRound2(2),
+                lambda data: data.nowRole2().isStack() and data.chance(0.4, "赞妮的技能"),
+                lambda data: data.nowRole2().addTempSkillOfRound2(2),
                 None,
                 "赞妮的技能",
                 ""
@@ -1471,7 +2076,7 @@ class EventProcessor:
         print(table)
 
 
-    def __init__(self, length: int) -> None:
+    def __init__(self, length: int | Track) -> None:
         """
         事件类
         
@@ -1480,11 +2085,16 @@ class EventProcessor:
             runs: 进行多次运行
 
         Args:
-            length (int): 赛道长度
+            length (int | Track): 赛道长度，或带特殊格子的赛道
         """
         # self.__now: EventTrigger = EventTrigger.unStart
         self.__init_data: EventData = EventData()
-        self.__init_data.setLength(length)
+        if isinstance(length, Track):
+            self.__init_data.setTrack(length)
+        else:
+            self.__init_data.setLength(length)
         self.__data: EventData = EventData()
+        self.__sampler: Sampler = BlockSampler()
+        self.__endgame: "EndgameTable | None" = None        # 残局表
         # self.gameStartInit()
         # self.__round = 0
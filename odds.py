@@ -0,0 +1,206 @@
+from math import sqrt
+from globals import *
+from module import Role, EventTrigger, EventData, EventProcessor, _RoundCounter
+from rng import BlockSampler
+
+"""     对局赔率时间线
+赛后分析时，对一局已记录的对局计算每次移动结束后各角色的名次概率。
+
+记录：recordRace用EventProcessor.raceSteps模拟一局，保存开始时和每次移动结束时的本局数据（状态）。
+估计：从某个状态继续模拟到结束（raceSteps可以从停在move_end的数据继续），统计名次。
+
+相邻状态的未来大部分相同，因此复用继续模拟的样本：
+从状态k继续的样本，如果下一次移动后的状态与记录的状态k+1完全相同（位置、堆叠、名次、回合、移动顺序、已移动角色、技能），
+那么它之后的部分就是从状态k+1继续的一个样本，同样计入状态k+1，并继续与k+2比较，直到第一次不同。
+之后的随机数与是否相同无关，因此计入的样本与从状态k+1直接继续的样本同分布，估计无偏。
+按顺序处理各状态，每个状态只需补足复用之外的样本。
+
+多线程时，每个线程对全部状态按上述方式各自完成一份样本，最后合并，所有状态作为一批一起计算。
+"""
+
+
+def _signature(data: EventData) -> tuple:
+    """
+    状态的签名，相同的签名表示之后的对局同分布
+    """
+    return (
+        data.round(),
+        tuple(
+            (role.name(), role.cell(), None if role.headRole() is None else role.headRole().name(),      # type: ignore
+             tuple(
+                 (skill.name(), skill.effectTimes(),
+                  effect.count if isinstance(effect := skill.effect(), _RoundCounter) else None)
+                 for skill in role.skills()
+             ))
+            for role in data.roles()
+        ),
+        tuple(sorted((role.name(), ranking_num) for role, ranking_num in data.rankingOfRoles().items())),
+        tuple(role.name() for role in data.moveOrder()),
+        tuple(role.name() for role in data.movedRoles()),
+    )
+
+
+def recordRace(processor: EventProcessor, seed: int | None = None) -> list[EventData]:
+    """
+    模拟并记录一局，返回开始时和每次移动结束时的本局数据
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        seed (int | None, optional): 种子，不填则随机. Defaults to None.
+
+    Returns:
+        list[EventData]: 状态列表，第0个为开始时
+    """
+    data = processor.newRaceData(BlockSampler(seed, size = 256))
+    states: list[EventData] = []
+    for trigger in processor.raceSteps(data):
+        if trigger is EventTrigger.game_start or trigger is EventTrigger.move_end:
+            states.append(data.deepcopy())
+    return states
+
+
+class OddsTimeline:
+    """
+    各状态的名次统计
+    """
+
+    def states(self) -> int:
+        """
+        返回状态数
+        """
+        return len(self.__counts)
+    def samples(self, k: int) -> int:
+        """
+        返回状态k的样本数
+        """
+        return self.__samples[k]
+    def reused(self, k: int) -> int:
+        """
+        返回状态k的样本中从之前的状态复用的个数
+        """
+        return self.__reused[k]
+    def probability(self, k: int, name: str, ranking_num: int = 1) -> tuple[float, float]:
+        """
+        状态k时角色获得某一排名的概率
+
+        Args:
+            k (int): 状态序号
+            name (str): 角色名
+            ranking_num (int, optional): 排名. Defaults to 1.
+
+        Returns:
+            tuple[float, float]: (估计值, 标准误)
+        """
+        n = self.__samples[k]
+        if n == 0:
+            return 0.0, 0.0
+        p = self.__counts[k].get(name, {}).get(ranking_num, 0) / n
+        return p, sqrt(p * (1 - p) / n)
+    def timeline(self, name: str, ranking_num: int = 1) -> list[float]:
+        """
+        角色获得某一排名的概率随状态的变化
+
+        Args:
+            name (str): 角色名
+            ranking_num (int, optional): 排名. Defaults to 1.
+
+        Returns:
+            list[float]: 每个状态的概率
+        """
+        return [self.probability(k, name, ranking_num)[0] for k in range(self.states())]
+    def toResult(self, k: int) -> dict[str, dict[int, int]]:
+        """
+        返回状态k的名次次数，格式与runs相同
+        """
+        return self.__counts[k]
+    def merge(self, other: "OddsTimeline") -> "OddsTimeline":
+        if other.states() != self.states():
+            raise ValueError("状态数不同，无法合并")
+        for k in range(self.states()):
+            self.__counts[k] = EventProcessor.mergeResults([self.__counts[k], other.__counts[k]])
+            self.__samples[k] += other.__samples[k]
+            self.__reused[k] += other.__reused[k]
+        return self
+
+    def add(self, first: int, last: int, data: EventData):
+        """
+        将一个样本的结果计入状态first ~ last，first之后的为复用
+        """
+        for k in range(first, last + 1):
+            EventProcessor.countResult(self.__counts[k], data)
+            self.__samples[k] += 1
+            if k != first:
+                self.__reused[k] += 1
+
+    def __init__(self, states: int) -> None:
+        self.__counts: list[dict[str, dict[int, int]]] = [{} for _ in range(states)]
+        self.__samples = [0] * states
+        self.__reused = [0] * states
+
+
+def _sweep(processor: EventProcessor, states: list[EventData], signatures: list[tuple], times: int,
+           seed: int | None) -> OddsTimeline:
+    """
+    按顺序为每个状态补足times个样本
+    """
+    sampler = BlockSampler(seed, size = 256)
+    timeline = OddsTimeline(len(states))
+    last_state = len(states) - 1
+    for k, state in enumerate(states):
+        # 去掉记录时的采样器，避免每个样本都复制它
+        base = state.copy()
+        base.setSampler(None)
+        base = base.deepcopy()
+        for _ in range(times - timeline.samples(k)):
+            data = base.deepcopy()
+            data.setSampler(sampler)
+            sampler.newRace()
+            matched = k
+            checking = True
+            for trigger in processor.raceSteps(data):
+                if checking and trigger is EventTrigger.move_end:
+                    if matched < last_state and _signature(data) == signatures[matched + 1]:
+                        matched += 1
+                    else:
+                        checking = False
+            timeline.add(k, matched, data)
+    return timeline
+
+
+def oddsTimeline(processor: EventProcessor, states: list[EventData], times: int = 2000,
+                 workers: int = 1, seed: int | None = None) -> OddsTimeline:
+    """
+    计算一局已记录对局的赔率时间线
+
+    例：
+        states = recordRace(ep, 42)
+        timeline = oddsTimeline(ep, states, 5000)
+        timeline.timeline("菲比", 1)
+
+    Args:
+        processor (EventProcessor): 记录对局时的事件处理器
+        states (list[EventData]): 状态列表，一般由recordRace得到，每个状态为开始时或停在move_end的本局数据
+        times (int, optional): 每个状态至少的样本数. Defaults to 2000.
+        workers (int, optional): 线程数，每个线程完成times / workers份. Defaults to 1.
+        seed (int | None, optional): 种子，不填则随机. Defaults to None.
+
+    Returns:
+        OddsTimeline: 各状态的名次统计
+    """
+    for state in states:
+        if state.now() not in (EventTrigger.game_start, EventTrigger.move_end):
+            raise ValueError(f"状态必须停在开始时或移动结束，实际为{state.now().name}")
+    signatures = [_signature(state) for state in states]
+    if workers <= 1:
+        return _sweep(processor, states, signatures, times, seed)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    seeds = random.Random(seed).sample(range(1 << 62), workers)
+    counts = [times // workers + (1 if i < times % workers else 0) for i in range(workers)]
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(lambda i: _sweep(processor, states, signatures, counts[i], seeds[i]), range(workers)))
+    final_return = results[0]
+    for result in results[1:]:
+        final_return.merge(result)
+    return final_return
@@ -0,0 +1,211 @@
+from math import sqrt
+from globals import *
+from module import EventData, EventProcessor
+from rng import Sampler, BlockSampler
+
+"""     针对单个问题的模拟
+只关心一个是/否问题（如“菲比获得第一”“布兰特进入前二”）时，不需要把每局模拟到所有角色进入终点：
+每当有角色进入终点后检查答案是否已经确定，确定后立即结束本局。
+
+排名按进入终点的先后依次分配（第n个进入终点的一批角色获得第n名），已经分配的排名不会再改变，
+所以“已确定”只依赖已经进入终点的角色，提前结束不改变答案的分布，估计是精确的。
+"""
+
+
+class Query:
+    """
+    是/否问题，继承并重写decided和answer即可自定义
+
+    decided只会在有角色进入终点后调用，answer在decided返回True或本局结束后调用
+    """
+
+    def decided(self, data: EventData) -> bool:
+        """
+        本局的答案是否已经确定
+
+        Args:
+            data (EventData): 本局数据
+
+        Returns:
+            bool: 是否确定
+        """
+        return False
+    def answer(self, data: EventData) -> bool:
+        """
+        本局的答案
+
+        Args:
+            data (EventData): 已确定或结束的本局数据
+
+        Returns:
+            bool: 答案
+        """
+        raise NotImplementedError
+
+    def _rank(self, data: EventData, name: str) -> int | None:
+        """
+        角色的排名，还没有进入终点时返回None
+        """
+        for role, ranking_num in data.rankingOfRoles().items():
+            if role.name() == name:
+                return ranking_num
+        return None
+
+
+class RankAtMost(Query):
+    """
+    角色的排名不低于k，即进入前k名。k为1时为获得第一
+
+    角色进入终点，或已经有至少k个角色进入终点时答案确定
+    """
+
+    def decided(self, data: EventData) -> bool:
+        return len(data.rankingOfRoles()) >= self.__k or self._rank(data, self.__name) is not None
+    def answer(self, data: EventData) -> bool:
+        ranking_num = self._rank(data, self.__name)
+        return ranking_num is not None and ranking_num <= self.__k
+
+    def __init__(self, name: str, k: int = 1) -> None:
+        """
+        Args:
+            name (str): 角色名
+            k (int, optional): 名次. Defaults to 1.
+        """
+        self.__name = name
+        self.__k = k
+
+
+class RankEquals(Query):
+    """
+    角色获得第r名
+
+    角色进入终点，或已经有至少r个角色进入终点时答案确定
+    """
+
+    def decided(self, data: EventData) -> bool:
+        return len(data.rankingOfRoles()) >= self.__r or self._rank(data, self.__name) is not None
+    def answer(self, data: EventData) -> bool:
+        return self._rank(data, self.__name) == self.__r
+
+    def __init__(self, name: str, r: int) -> None:
+        """
+        Args:
+            name (str): 角色名
+            r (int): 名次
+        """
+        self.__name = name
+        self.__r = r
+
+
+class Beats(Query):
+    """
+    角色a的排名严格高于角色b（同时进入终点为并列，不算）
+
+    两者之一进入终点时答案确定
+    """
+
+    def decided(self, data: EventData) -> bool:
+        return self._rank(data, self.__a) is not None or self._rank(data, self.__b) is not None
+    def answer(self, data: EventData) -> bool:
+        rank_a = self._rank(data, self.__a)
+        rank_b = self._rank(data, self.__b)
+        return rank_a is not None and (rank_b is None or rank_a < rank_b)
+
+    def __init__(self, name_a: str, name_b: str) -> None:
+        """
+        Args:
+            name_a (str): 角色a
+            name_b (str): 角色b
+        """
+        self.__a = name_a
+        self.__b = name_b
+
+
+class QueryResult:
+    """
+    问题的模拟结果
+    """
+
+    def probability(self) -> tuple[float, float]:
+        """
+        答案为是的概率
+
+        Returns:
+            tuple[float, float]: (估计值, 标准误)
+        """
+        n = self.races
+        if n == 0:
+            return 0.0, 0.0
+        p = self.hits / n
+        return p, sqrt(p * (1 - p) / n)
+    def merge(self, other: "QueryResult") -> "QueryResult":
+        self.hits += other.hits
+        self.races += other.races
+        self.rounds += other.rounds
+        return self
+
+    def __str__(self) -> str:
+        p, error = self.probability()
+        return f"{p:.4%}±{error:.4%}（{self.races}局，平均{self.rounds / self.races if self.races else 0:.2f}回合）"
+
+    def __init__(self) -> None:
+        self.hits = 0           # 答案为是的局数
+        self.races = 0          # 模拟局数
+        self.rounds = 0         # 模拟的总回合数
+
+
+def queryRuns(processor: EventProcessor, query: Query, times: int, sampler: Sampler | None = None) -> QueryResult:
+    """
+    针对一个问题多次模拟，每局答案确定后立即结束
+
+    例：
+        queryRuns(ep, RankAtMost("菲比", 1), 100000).probability()
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        query (Query): 问题
+        times (int): 运行次数
+        sampler (Sampler | None, optional): 采样器，不填则使用处理器的采样器. Defaults to None.
+
+    Returns:
+        QueryResult: 结果
+    """
+    if sampler is None:
+        sampler = processor.sampler()
+    result = QueryResult()
+    decided = query.decided
+    for i in range(times):
+        data = processor.runRace(processor.newRaceData(sampler), decided)
+        result.races += 1
+        result.rounds += data.round()
+        if query.answer(data):
+            result.hits += 1
+    return result
+
+
+def querySeedRange(processor: EventProcessor, query: Query, start: int, stop: int) -> QueryResult:
+    """
+    按种子区间针对一个问题多次模拟，第i局使用种子i
+
+    每局的答案与EventProcessor.runsSeedRange中同一种子的完整对局相同
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        query (Query): 问题
+        start (int): 起始种子（包含）
+        stop (int): 结束种子（不包含）
+
+    Returns:
+        QueryResult: 结果
+    """
+    sampler = BlockSampler(size = 256)
+    result = QueryResult()
+    decided = query.decided
+    for seed in range(start, stop):
+        sampler.seed(seed)
+        data = processor.runRace(processor.newRaceData(sampler), decided)
+        result.races += 1
+        result.rounds += data.round()
+        if query.answer(data):
+            result.hits += 1
+    return result
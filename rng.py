@@ -0,0 +1,313 @@
+from itertools import permutations
+from typing import TYPE_CHECKING
+from globals import *
+
+if TYPE_CHECKING:
+    from module import Role
+
+"""     随机数层
+Sampler: 采样器接口，默认使用独立的random.Random
+BlockSampler: 成块预先抽取随机数，移动顺序查排列表，非均匀移动分布查别名表
+"""
+
+
+class AliasTable:
+    """
+    别名表（Vose方法），用一个[0, 1)随机数在O(1)内从离散分布中抽样
+    """
+
+    def sample(self, u: float) -> int:
+        """
+        抽取一个值
+
+        Args:
+            u (float): [0, 1)的随机数
+
+        Returns:
+            int: 抽到的值
+        """
+        u *= self.__size
+        index = int(u)
+        if u - index < self.__probability[index]:
+            return self.__values[index]
+        return self.__values[self.__alias[index]]
+
+    def values(self) -> tuple[int, ...]:
+        return self.__values
+
+    def __init__(self, values: tuple[int, ...], weights: tuple[float, ...] | None) -> None:
+        """
+        别名表
+
+        Args:
+            values (tuple[int, ...]): 可能的取值
+            weights (tuple[float, ...] | None): 各值的概率，None为均匀分布
+        """
+        size = len(values)
+        if weights is None:
+            weights = tuple(1 / size for _ in values)
+        total = sum(weights)
+        scaled = [weight * size / total for weight in weights]
+        probability = [1.0] * size
+        alias = list(range(size))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            probability[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        self.__values = values
+        self.__size = size
+        self.__probability = probability
+        self.__alias = alias
+
+
+class PermutationTable:
+    """
+    预先计算好的全排列表，用一个[0, 1)随机数抽取一个均匀随机排列
+
+    只为不超过MAX_SIZE个元素建表，更多元素请自行洗牌
+    """
+    MAX_SIZE = 8
+    __tables: dict[int, "PermutationTable"] = {}
+
+    @classmethod
+    def of(cls, size: int) -> "PermutationTable | None":
+        """
+        获取size个元素的排列表，表是全局共享且只读的
+
+        Args:
+            size (int): 元素个数
+
+        Returns:
+            PermutationTable | None: 排列表，元素过多时为None
+        """
+        if size > cls.MAX_SIZE:
+            return None
+        table = cls.__tables.get(size)
+        if table is None:
+            table = cls.__tables.setdefault(size, cls(size))
+        return table
+
+    def sample(self, u: float) -> tuple[int, ...]:
+        """
+        抽取一个排列
+
+        Args:
+            u (float): [0, 1)的随机数
+
+        Returns:
+            tuple[int, ...]: 下标排列
+        """
+        return self.__permutations[int(u * self.__count)]
+    def permutation(self, index: int) -> tuple[int, ...]:
+        return self.__permutations[index]
+    def count(self) -> int:
+        return self.__count
+
+    def __init__(self, size: int) -> None:
+        self.__permutations: list[tuple[int, ...]] = list(permutations(range(size)))
+        self.__count = len(self.__permutations)
+
+
+class BlockRandom:
+    """
+    成块抽取的随机数，一次性生成size个[0, 1)随机数，用完再生成下一块
+    """
+
+    def random(self) -> float:
+        """
+        返回下一个随机数
+
+        Returns:
+            float: [0, 1)的随机数
+        """
+        index = self.__index
+        if index >= self.__size:
+            self.refill()
+            index = 0
+        self.__index = index + 1
+        return self.__block[index]
+    def refill(self):
+        """
+        重新生成一整块随机数
+        """
+        rnd = self.__random.random
+        self.__block = [rnd() for _ in range(self.__size)]
+        self.__index = 0
+
+    def seed(self, seed: int | None):
+        """
+        重设种子，丢弃尚未使用的随机数
+
+        Args:
+            seed (int | None): 种子
+        """
+        self.__random.seed(seed)
+        self.__index = self.__size
+    def generator(self) -> "random.Random":
+        """
+        获取底层的随机数生成器
+
+        Returns:
+            random.Random: 随机数生成器
+        """
+        return self.__random
+
+    def __init__(self, seed: int | None = None, size: int = 4096) -> None:
+        """
+        成块随机数
+
+        Args:
+            seed (int | None, optional): 种子. Defaults to None.
+            size (int, optional): 每块的大小. Defaults to 4096.
+        """
+        self.__random = random.Random(seed)
+        self.__size = size
+        self.__block: list[float] = []
+        self.__index = size
+
+
+class Sampler:
+    """
+    采样器，对局中所有可控的随机都经过这里
+
+    包括：移动格数（声明了分布的角色）、移动顺序、概率条件
+
+    继承并重写对应函数即可改变抽样方式，如重要性采样
+    """
+
+    def random(self) -> float:
+        """
+        返回[0, 1)的随机数
+
+        Returns:
+            float: 随机数
+        """
+        return self._random.random()
+    def moveNum(self, role: "Role") -> int:
+        """
+        抽取角色的移动格数
+
+        没有声明分布的角色会直接调用其移动函数
+
+        Args:
+            role (Role): 角色
+
+        Returns:
+            int: 移动格数
+        """
+        distribution = role.moveDistribution()
+        if distribution is None:
+            return role.generatedMoveNum()
+        values, weights = distribution
+        if weights is None:
+            return self._random.choice(values)
+        return self._random.choices(values, weights)[0]
+    def moveOrder(self, roles: list["Role"]) -> list["Role"]:
+        """
+        抽取一个移动顺序
+
+        Args:
+            roles (list[Role]): 剩余角色列表
+
+        Returns:
+            list[Role]: 新的移动顺序
+        """
+        return self._random.sample(roles, len(roles))
+    def chance(self, probability: float, key: str = "") -> bool:
+        """
+        以probability的概率返回True
+
+        Args:
+            probability (float): 概率
+            key (str, optional): 概率的标识. Defaults to "".
+
+        Returns:
+            bool: 是否通过
+        """
+        return self._random.random() < probability
+
+    def seed(self, seed: int | None):
+        """
+        重设种子
+
+        Args:
+            seed (int | None): 种子
+        """
+        self._random = random.Random(seed)
+    def newRace(self):
+        """
+        新的一局开始时调用，用于重置每局的状态
+        """
+        pass
+    def weight(self) -> float:
+        """
+        本局的似然比权重，普通采样恒为1
+
+        Returns:
+            float: 权重
+        """
+        return 1.0
+
+    def __init__(self, rng: "random.Random | None" = None) -> None:
+        """
+        采样器
+
+        Args:
+            rng (random.Random | None, optional): 随机数生成器，不填则新建一个独立的生成器. Defaults to None.
+        """
+        self._random = random.Random() if rng is None else rng
+
+
+class BlockSampler(Sampler):
+    """
+    成块采样器
+
+    所有随机都取自预先成块生成的[0, 1)随机数：
+    移动格数查别名表，移动顺序查排列表（超过PermutationTable.MAX_SIZE个角色时洗牌），概率条件直接比较
+
+    每个抽取只消耗一个随机数（洗牌除外），相同种子得到相同结果
+    """
+
+    def random(self) -> float:
+        return self._block.random()
+    def moveNum(self, role: "Role") -> int:
+        distribution = role.moveDistribution()
+        if distribution is None:
+            return role.generatedMoveNum()
+        table = self.__aliasTables.get(id(distribution))
+        if table is None or table[0] is not distribution:
+            table = (distribution, AliasTable(*distribution))
+            self.__aliasTables[id(distribution)] = table
+        return table[1].sample(self._block.random())
+    def moveOrder(self, roles: list["Role"]) -> list["Role"]:
+        table = PermutationTable.of(len(roles))
+        if table is None:
+            order = list(roles)
+            rnd = self._block.random
+            for i in range(len(order) - 1, 0, -1):
+                j = int(rnd() * (i + 1))
+                order[i], order[j] = order[j], order[i]
+            return order
+        return [roles[i] for i in table.sample(self._block.random())]
+    def chance(self, probability: float, key: str = "") -> bool:
+        return self._block.random() < probability
+
+    def seed(self, seed: int | None):
+        self._block.seed(seed)
+
+    def __init__(self, seed: int | None = None, size: int = 4096) -> None:
+        """
+        成块采样器
+
+        Args:
+            seed (int | None, optional): 种子，不填则随机. Defaults to None.
+            size (int, optional): 每块随机数的大小. Defaults to 4096.
+        """
+        self._block = BlockRandom(seed, size)
+        super().__init__(self._block.generator())
+        self.__aliasTables: dict[int, tuple[tuple, AliasTable]] = {}
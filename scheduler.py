@@ -0,0 +1,184 @@
+from globals import *
+from module import EventTrigger, EventData, EventProcessor
+from rng import Sampler, BlockSampler
+from typing import Generator
+
+"""     多局交替调度
+每局由EventProcessor.raceSteps得到一个生成器，状态只保存在本局数据和生成器中，不需要为每局新建处理器。
+调度器在同一线程中轮流推进所有进行中的对局：每一轮（tick）把每局推进到下一个关心的时机，
+然后把这一轮停下的所有对局一起交给回调，回调可以批量读取或修改本局数据（如批量推理后修改移动格数）。
+
+关心的时机用EventTrigger的值按位或组合，例如 EventTrigger.round_start.value | EventTrigger.move_before.value。
+不关心的时机直接跳过，不会交给回调。
+
+每局使用自己的成块采样器，第i局使用种子seed + i，回调不修改数据时结果与runsSeedRange完全相同，与交替顺序和同时进行的局数无关。
+"""
+
+
+ALL_TRIGGERS = sum(trigger.value for trigger in EventTrigger)
+
+
+class ScheduledRace:
+    """
+    调度器中的一局
+    """
+
+    def key(self) -> Any:
+        """
+        返回添加时指定的标识
+        """
+        return self.__key
+    def data(self) -> EventData:
+        """
+        返回本局数据
+        """
+        return self.__data
+    def trigger(self) -> EventTrigger:
+        """
+        返回本局当前停在的时机，尚未开始时为unstart
+        """
+        return self.__trigger
+    def isDone(self) -> bool:
+        """
+        本局是否已经结束
+        """
+        return self.__done
+
+    def advance(self, triggers: int) -> bool:
+        """
+        推进到下一个关心的时机或本局结束
+
+        Args:
+            triggers (int): 关心的时机，EventTrigger的值按位或
+
+        Returns:
+            bool: 是否停在关心的时机（本局结束且不关心game_end时为False）
+        """
+        steps = self.__steps
+        for trigger in steps:
+            self.__trigger = trigger
+            if trigger is EventTrigger.game_end:
+                self.__done = True
+            if trigger.value & triggers:
+                return True
+        self.__done = True
+        return False
+
+    def __init__(self, key: Any, data: EventData, steps: Generator[EventTrigger, None, EventData]) -> None:
+        self.__key = key
+        self.__data = data
+        self.__steps = steps
+        self.__trigger = data.now()
+        self.__done = False
+
+
+class RaceScheduler:
+    """
+    在同一线程中交替推进多局
+
+    例：每一轮把所有停在准备移动的对局交给回调批量处理
+        def decide(batch: list[ScheduledRace]):
+            for race in batch:
+                race.data().setMoveNum(...)
+        scheduler = RaceScheduler(ep, EventTrigger.move_before.value, decide)
+        result = scheduler.runs(100000)
+    """
+
+    def add(self, seed: int | None = None, key: Any = None,
+            sampler: Sampler | None = None, data: EventData | None = None) -> ScheduledRace:
+        """
+        加入一局
+
+        Args:
+            seed (int | None, optional): 种子，不填sampler时用于新建本局的成块采样器，不填则随机. Defaults to None.
+            key (Any, optional): 本局的标识，不填则为seed. Defaults to None.
+            sampler (Sampler | None, optional): 本局使用的采样器，同一采样器不能同时用于多局. Defaults to None.
+            data (EventData | None, optional): 本局数据，填写时忽略seed和sampler. Defaults to None.
+
+        Returns:
+            ScheduledRace: 加入的一局
+        """
+        if data is None:
+            if sampler is None:
+                sampler = BlockSampler(seed, size = 256)
+            data = self.__processor.newRaceData(sampler)
+        race = ScheduledRace(seed if key is None else key, data, self.__processor.raceSteps(data))
+        self.__races.append(race)
+        return race
+    def live(self) -> int:
+        """
+        返回进行中的局数
+        """
+        return len(self.__races)
+    def tick(self) -> tuple[list[ScheduledRace], list[ScheduledRace]]:
+        """
+        把每局推进到下一个关心的时机，停下的对局交给回调
+
+        Returns:
+            tuple[list[ScheduledRace], list[ScheduledRace]]: (这一轮停下的对局, 这一轮结束的对局)
+        """
+        triggers = self.__triggers
+        paused: list[ScheduledRace] = []
+        running: list[ScheduledRace] = []
+        finished: list[ScheduledRace] = []
+        for race in self.__races:
+            if race.advance(triggers):
+                paused.append(race)
+            if race.isDone():
+                finished.append(race)
+            else:
+                running.append(race)
+        self.__races = running
+        if paused and self.__hook is not None:
+            self.__hook(paused)
+        return paused, finished
+    def run(self) -> list[ScheduledRace]:
+        """
+        交替推进直到所有对局结束
+
+        Returns:
+            list[ScheduledRace]: 按结束顺序排列的对局
+        """
+        final_return: list[ScheduledRace] = []
+        while self.__races:
+            final_return.extend(self.tick()[1])
+        return final_return
+    def runs(self, times: int, seed: int = 0, window: int = 1024) -> dict[str, dict[int, int]]:
+        """
+        模拟times局，同时最多进行window局，结束一局就补充一局
+
+        第i局使用种子seed + i，回调不修改数据时结果与runsSeedRange(seed, seed + times)相同
+
+        Args:
+            times (int): 运行次数
+            seed (int, optional): 起始种子. Defaults to 0.
+            window (int, optional): 同时进行的局数，即每次交给回调的最大批量. Defaults to 1024.
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        final_return: dict[str, dict[int, int]] = {}
+        next_seed = seed
+        stop = seed + times
+        while next_seed < stop or self.__races:
+            while next_seed < stop and len(self.__races) < window:
+                self.add(next_seed)
+                next_seed += 1
+            for race in self.tick()[1]:
+                EventProcessor.countResult(final_return, race.data())
+        return final_return
+
+    def __init__(self, processor: EventProcessor, triggers: int = ALL_TRIGGERS,
+                 hook: Callable[[list[ScheduledRace]], None] | None = None) -> None:
+        """
+        多局调度器
+
+        Args:
+            processor (EventProcessor): 已添加角色的事件处理器，只读取其初始数据
+            triggers (int, optional): 关心的时机，EventTrigger的值按位或，默认为全部. Defaults to ALL_TRIGGERS.
+            hook (Callable[[list[ScheduledRace]], None] | None, optional): 每一轮停下的对局的回调. Defaults to None.
+        """
+        self.__processor = processor
+        self.__triggers = triggers
+        self.__hook = hook
+        self.__races: list[ScheduledRace] = []
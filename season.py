@@ -0,0 +1,283 @@
+import os
+from globals import *
+from module import Role, EventData, EventProcessor
+from rng import Sampler, BlockSampler
+from track import Track
+from aggregators import RankingIndex, OrderHistogram
+
+"""     多场赛季
+一个赛季由若干场比赛（Stage）组成，上一场的名次决定下一场的起始状态（起点格数或堆叠顺序）。
+
+每个赛季只在场与场之间传递名次索引：
+上一场结束后编码为名次索引，由索引查出按名次排列的角色序号（有缓存），下一场据此设置起始状态。
+每场和总积分的名次都按名次索引计数（OrderHistogram），可以合并多个线程或机器的结果。
+
+每个赛季使用一个种子，赛季内各场依次从同一个采样器抽取，因此结果只取决于种子区间。
+"""
+
+
+StartRule = Callable[[EventData, list[Role]], None]
+
+
+def sameStart(data: EventData, standings: list[Role]):
+    """
+    起始状态规则：所有角色都从起点开始，不堆叠（默认）
+    """
+    pass
+
+
+def handicapStart(cells: list[int]) -> StartRule:
+    """
+    起始状态规则：上一场第k名从cells[k - 1]格开始，同一格的角色按名次从下往上堆叠
+
+    Args:
+        cells (list[int]): 按名次排列的起始格数
+
+    Returns:
+        StartRule: 规则
+    """
+    def rule(data: EventData, standings: list[Role]):
+        below: dict[int, Role] = {}
+        for role, cell in zip(standings, cells):
+            role.setCellNum(cell)
+            if cell in below:
+                role.setStack(below[cell])
+            below[cell] = role
+    return rule
+
+
+def stackStart(leader_on_top: bool = True) -> StartRule:
+    """
+    起始状态规则：所有角色在起点堆叠，按上一场名次排列
+
+    Args:
+        leader_on_top (bool, optional): 上一场第一名是否在最上面. Defaults to True.
+
+    Returns:
+        StartRule: 规则
+    """
+    def rule(data: EventData, standings: list[Role]):
+        order = list(reversed(standings)) if leader_on_top else list(standings)
+        for lower, upper in zip(order, order[1:]):
+            upper.setStack(lower)
+    return rule
+
+
+class Stage:
+    """
+    赛季中的一场比赛
+    """
+
+    def track(self) -> Track:
+        return self.__track
+    def start(self) -> StartRule:
+        return self.__start
+
+    def __init__(self, track: int | Track, start: StartRule | None = None) -> None:
+        """
+        一场比赛
+
+        Args:
+            track (int | Track): 赛道长度或赛道
+            start (StartRule | None, optional): 起始状态规则，传入本局数据和按上一场名次排列的角色（第一场为初始角色顺序），
+                可用handicapStart、stackStart或自定义函数. Defaults to None.
+        """
+        self.__track = track if isinstance(track, Track) else Track(track)
+        self.__start = sameStart if start is None else start
+
+
+class SeasonResult:
+    """
+    赛季统计：每场的名次分布和总积分名次分布
+    """
+
+    def stage(self, i: int) -> OrderHistogram:
+        """
+        返回第i场（从0开始）的名次分布
+
+        Args:
+            i (int): 场次
+
+        Returns:
+            OrderHistogram: 名次分布
+        """
+        return self.__stages[i]
+    def overall(self) -> OrderHistogram:
+        """
+        返回总积分的名次分布
+
+        Returns:
+            OrderHistogram: 名次分布
+        """
+        return self.__overall
+    def seasons(self) -> int:
+        """
+        返回模拟的赛季数
+        """
+        return self.__overall.races()
+    def merge(self, other: "SeasonResult") -> "SeasonResult":
+        """
+        将另一个统计合并到自身
+
+        Args:
+            other (SeasonResult): 另一个统计
+
+        Returns:
+            SeasonResult: 自身
+        """
+        if len(other.__stages) != len(self.__stages):
+            raise ValueError("场数不同，无法合并")
+        for mine, theirs in zip(self.__stages, other.__stages):
+            mine.merge(theirs)
+        self.__overall.merge(other.__overall)
+        return self
+    def empty(self) -> "SeasonResult":
+        return SeasonResult([stage.empty() for stage in self.__stages], self.__overall.empty())    # type: ignore
+
+    def __init__(self, stages: list[OrderHistogram], overall: OrderHistogram) -> None:
+        self.__stages = stages
+        self.__overall = overall
+
+
+class Season:
+    """
+    多场赛季
+
+    例：三场比赛，后两场按上一场名次在起点堆叠，第一名在最上面
+        season = Season(ep, [Stage(23), Stage(23, stackStart()), Stage(30, stackStart())])
+        result = season.threadRuns(100000)
+        result.overall().rankCounts()
+    """
+
+    def __overallRanks(self, points: list[int], last: tuple[int, ...]) -> tuple[int, ...]:
+        """
+        按总积分计算名次，积分相同时比较最后一场的名次，仍相同则并列
+        """
+        keys = [(-points[i], last[i]) for i in range(len(points))]
+        return tuple(1 + sum(other < key for other in keys) for key in keys)
+    def __standings(self, index: int) -> tuple[int, ...]:
+        """
+        名次索引对应的按名次排列的角色序号，并列时按初始角色顺序
+        """
+        standings = self.__standingsCache.get(index)
+        if standings is None:
+            ranks = self.__ranking.decode(index)
+            standings = self.__standingsCache[index] = tuple(sorted(range(len(ranks)), key = lambda i: (ranks[i], i)))
+        return standings
+
+    def runSeason(self, sampler: Sampler) -> list[int]:
+        """
+        模拟一个赛季
+
+        Args:
+            sampler (Sampler): 采样器
+
+        Returns:
+            list[int]: 每场的名次索引，最后一项为总积分的名次索引
+        """
+        processor = self.__processor
+        ranking = self.__ranking
+        points_table = self.__points
+        size = len(ranking.names())
+        points = [0] * size
+        indices: list[int] = []
+        standings: tuple[int, ...] = tuple(range(size))
+        ranks: tuple[int, ...] = ()
+        for stage in self.__stages:
+            data = processor.newRaceData(sampler)
+            data.setTrack(stage.track())
+            roles = data.roles()
+            stage.start()(data, [roles[i] for i in standings])
+            processor.runRace(data)
+            index = ranking.encode(data)
+            indices.append(index)
+            ranks = ranking.decode(index)
+            for i, ranking_num in enumerate(ranks):
+                points[i] += points_table[ranking_num - 1] if ranking_num <= len(points_table) else 0
+            standings = self.__standings(index)
+        indices.append(ranking.encodeRanks(self.__overallRanks(points, ranks)))
+        return indices
+
+    def newResult(self) -> SeasonResult:
+        """
+        返回空的赛季统计
+        """
+        names = self.__ranking.names()
+        return SeasonResult([OrderHistogram(names) for _ in self.__stages], OrderHistogram(names))
+    def runsSeedRange(self, start: int, stop: int, result: SeasonResult | None = None) -> SeasonResult:
+        """
+        按种子区间模拟多个赛季，第i个赛季使用种子i
+
+        Args:
+            start (int): 起始种子（包含）
+            stop (int): 结束种子（不包含）
+            result (SeasonResult | None, optional): 累加到的统计，不填则新建. Defaults to None.
+
+        Returns:
+            SeasonResult: 赛季统计
+        """
+        if result is None:
+            result = self.newResult()
+        sampler = BlockSampler(size = 256)
+        adds = [result.stage(i).add for i in range(len(self.__stages))] + [result.overall().add]
+        for seed in range(start, stop):
+            sampler.seed(seed)
+            for add, index in zip(adds, self.runSeason(sampler)):
+                add(index)
+        return result
+    def runs(self, times: int, seed: int = 0) -> SeasonResult:
+        """
+        模拟times个赛季
+
+        Args:
+            times (int): 赛季数
+            seed (int, optional): 起始种子. Defaults to 0.
+
+        Returns:
+            SeasonResult: 赛季统计
+        """
+        return self.runsSeedRange(seed, seed + times)
+    def threadRuns(self, times: int, workers: int | None = None, seed: int = 0) -> SeasonResult:
+        """
+        使用线程池模拟times个赛季，与EventProcessor.threadRuns相同，在无GIL的Python上可随线程数扩展
+
+        按种子区间切分，结果与runs(times, seed)完全相同
+
+        Args:
+            times (int): 赛季数
+            workers (int | None, optional): 线程数，不填则为CPU数. Defaults to None.
+            seed (int, optional): 起始种子. Defaults to 0.
+
+        Returns:
+            SeasonResult: 赛季统计
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, times))
+        bounds = [seed + times * i // workers for i in range(workers + 1)]
+        with ThreadPoolExecutor(workers) as executor:
+            results = list(executor.map(lambda i: self.runsSeedRange(bounds[i], bounds[i + 1]), range(workers)))
+        final_return = self.newResult()
+        for result in results:
+            final_return.merge(result)
+        return final_return
+
+    def __init__(self, processor: EventProcessor, stages: list[Stage], points: list[int] | None = None) -> None:
+        """
+        多场赛季
+
+        Args:
+            processor (EventProcessor): 已添加角色的事件处理器，其赛道会被每场的赛道替换
+            stages (list[Stage]): 各场比赛
+            points (list[int] | None, optional): 按名次的积分，不填则第1名得n分、第n名得1分. Defaults to None.
+        """
+        if not stages:
+            raise ValueError("赛季至少需要一场比赛")
+        self.__processor = processor
+        self.__stages = list(stages)
+        self.__ranking = RankingIndex.of(processor)
+        size = len(self.__ranking.names())
+        self.__points = list(range(size, 0, -1)) if points is None else list(points)
+        self.__standingsCache: dict[int, tuple[int, ...]] = {}
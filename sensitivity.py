@@ -0,0 +1,329 @@
+from array import array
+from math import sqrt
+from globals import *
+from module import Role, EventData, EventProcessor
+from rng import Sampler, BlockSampler
+
+"""     概率参数的灵敏度分析
+技能中的概率条件（浮点数条件和data.chance）每局被判断n次、通过s次，
+在概率p下这一局出现的似然为 p^s·(1-p)^(n-s)，其余随机与p无关。
+
+因此只需在概率p下模拟一次并记录每局的(n, s)，
+其它概率θ下的结果可用似然比 w = (θ/p)^s·((1-θ)/(1-p))^(n-s) 对同一批样本加权得到，
+对θ的导数用得分函数 w·(s/θ - (n-s)/(1-θ)) 加权得到。
+θ离p越远权重越分散，有效样本数 (Σw)² / Σw² 越小，估计越不可靠。
+"""
+
+
+class ChanceRecorder(Sampler):
+    """
+    记录概率条件的采样器
+
+    包装另一个采样器，所有抽样交给被包装的采样器，同时统计本局每个概率标识被判断和通过的次数。
+    只记录概率在0到1之间（不含两端）的判断
+    """
+
+    def random(self) -> float:
+        return self.__sampler.random()
+    def moveNum(self, role: Role) -> int:
+        return self.__sampler.moveNum(role)
+    def moveOrder(self, roles: list[Role]) -> list[Role]:
+        return self.__sampler.moveOrder(roles)
+    def chance(self, probability: float, key: str = "") -> bool:
+        passed = self.__sampler.chance(probability, key)
+        if 0 < probability < 1 and (self.__keys is None or key in self.__keys):
+            base = self.__probabilities.setdefault(key, probability)
+            if base != probability:
+                raise ValueError(f"概率标识{key}先后以{base}和{probability}两种概率判断，无法加权")
+            counts = self.__counts.get(key)
+            if counts is None:
+                counts = self.__counts[key] = [0, 0]
+            counts[0] += 1
+            if passed:
+                counts[1] += 1
+        return passed
+
+    def seed(self, seed: int | None):
+        self.__sampler.seed(seed)
+    def newRace(self):
+        self.__sampler.newRace()
+        self.__counts.clear()
+    def weight(self) -> float:
+        return self.__sampler.weight()
+
+    def counts(self) -> dict[str, list[int]]:
+        """
+        返回本局的判断次数
+
+        Returns:
+            dict[str, list[int]]: 概率标识: [判断次数, 通过次数]
+        """
+        return self.__counts
+    def probabilities(self) -> dict[str, float]:
+        """
+        返回记录到的概率标识及其模拟时的概率
+
+        Returns:
+            dict[str, float]: 概率标识: 概率
+        """
+        return self.__probabilities
+
+    def __init__(self, sampler: Sampler | None = None, keys: list[str] | None = None) -> None:
+        """
+        记录概率条件的采样器
+
+        Args:
+            sampler (Sampler | None, optional): 被包装的采样器，不填则新建BlockSampler. Defaults to None.
+            keys (list[str] | None, optional): 需要记录的概率标识，不填则记录全部. Defaults to None.
+        """
+        self.__sampler = BlockSampler() if sampler is None else sampler
+        super().__init__(self.__sampler._random)
+        self.__keys = None if keys is None else set(keys)
+        self.__counts: dict[str, list[int]] = {}
+        self.__probabilities: dict[str, float] = {}
+
+
+class SensitivityResult:
+    """
+    灵敏度分析的结果，保存每局的排名、基础权重和每个概率标识的(判断次数, 通过次数)
+
+    params参数为 {概率标识: 新的概率}，未给出的概率标识保持模拟时的概率
+    """
+
+    def add(self, data: EventData, counts: dict[str, list[int]], weight: float = 1.0):
+        """
+        加入一局的结果
+
+        Args:
+            data (EventData): 结束的本局数据
+            counts (dict[str, list[int]]): 本局各概率标识的 [判断次数, 通过次数]，见ChanceRecorder.counts
+            weight (float, optional): 本局的基础权重，与重要性采样一起使用时为其似然比. Defaults to 1.0.
+        """
+        result = data.resultToNameDict()
+        if not self.__names:
+            self.__names = list(result)
+        for name in self.__names:
+            self.__ranking.append(result[name])
+        for key in counts:
+            if key not in self.__evaluated:
+                self.__evaluated[key] = array("q", bytes(8 * self.__times))
+                self.__passed[key] = array("q", bytes(8 * self.__times))
+        for key, evaluated in self.__evaluated.items():
+            n, s = counts.get(key, (0, 0))
+            evaluated.append(n)
+            self.__passed[key].append(s)
+        self.__weights.append(weight)
+        self.__times += 1
+    def setProbabilities(self, probabilities: dict[str, float]):
+        """
+        设置各概率标识在模拟时的概率，见ChanceRecorder.probabilities
+
+        Args:
+            probabilities (dict[str, float]): 概率标识: 概率
+        """
+        self.__probabilities.update(probabilities)
+
+# 加权
+    def __weightsOf(self, params: dict[str, float] | None) -> list[float]:
+        """
+        计算每局在新概率下的权重
+        """
+        weights = list(self.__weights)
+        for key, theta in (params or {}).items():
+            p = self.__probabilities.get(key)
+            if p is None:
+                raise KeyError(f"没有记录到概率标识{key}")
+            if not 0 <= theta <= 1:
+                raise ValueError("概率必须在0到1之间")
+            if theta == p:
+                continue
+            up = theta / p
+            down = (1 - theta) / (1 - p)
+            for i, (n, s) in enumerate(zip(self.__evaluated[key], self.__passed[key])):
+                if n:
+                    weights[i] *= up ** s * down ** (n - s)
+        return weights
+    def __scores(self, key: str, theta: float) -> list[float]:
+        """
+        计算每局对数似然对key概率的导数
+        """
+        if not 0 < theta < 1:
+            raise ValueError("求导时概率必须在0到1之间，不含两端")
+        return [
+            s / theta - (n - s) / (1 - theta)
+            for n, s in zip(self.__evaluated[key], self.__passed[key])
+        ]
+    def __estimate(self, values: list[float]) -> tuple[float, float]:
+        n = self.__times
+        if n == 0:
+            return 0.0, 0.0
+        mean = sum(values) / n
+        if n < 2:
+            return mean, 0.0
+        variance = max(sum(value * value for value in values) / n - mean * mean, 0.0) * n / (n - 1)
+        return mean, sqrt(variance / n)
+    def __indicator(self, name: str, ranking_num: int) -> list[bool]:
+        if name not in self.__names:
+            raise KeyError(f"没有角色{name}")
+        step = len(self.__names)
+        return [value == ranking_num for value in self.__ranking[self.__names.index(name)::step]]
+    def __eventIndicator(self, event: Callable[[dict[str, int]], bool]) -> list[bool]:
+        step = len(self.__names)
+        return [
+            bool(event(dict(zip(self.__names, self.__ranking[i:i + step]))))
+            for i in range(0, len(self.__ranking), step)
+        ]
+
+# 估计
+    def times(self) -> int:
+        """
+        返回模拟次数
+        """
+        return self.__times
+    def keys(self) -> dict[str, float]:
+        """
+        返回可以调整的概率标识及其模拟时的概率
+
+        Returns:
+            dict[str, float]: 概率标识: 概率
+        """
+        return {key: self.__probabilities[key] for key in self.__evaluated if key in self.__probabilities}
+    def probability(self, name: str, ranking_num: int, params: dict[str, float] | None = None) -> tuple[float, float]:
+        """
+        新概率下角色获得某一排名的概率
+
+        Args:
+            name (str): 角色名
+            ranking_num (int): 排名
+            params (dict[str, float] | None, optional): 新的概率. Defaults to None.
+
+        Returns:
+            tuple[float, float]: (估计值, 标准误)
+        """
+        weights = self.__weightsOf(params)
+        return self.__estimate([w for w, hit in zip(weights, self.__indicator(name, ranking_num)) if hit])
+    def eventProbability(self, event: Callable[[dict[str, int]], bool], params: dict[str, float] | None = None) -> tuple[float, float]:
+        """
+        新概率下某一事件的概率
+
+        Args:
+            event (Callable[[dict[str, int]], bool]): 事件，传入本局的 角色名: 排名
+            params (dict[str, float] | None, optional): 新的概率. Defaults to None.
+
+        Returns:
+            tuple[float, float]: (估计值, 标准误)
+        """
+        weights = self.__weightsOf(params)
+        return self.__estimate([w for w, hit in zip(weights, self.__eventIndicator(event)) if hit])
+    def derivative(self, name: str, ranking_num: int, key: str, params: dict[str, float] | None = None) -> tuple[float, float]:
+        """
+        角色获得某一排名的概率对某个概率参数的导数
+
+        Args:
+            name (str): 角色名
+            ranking_num (int): 排名
+            key (str): 求导的概率标识
+            params (dict[str, float] | None, optional): 在哪组概率处求导，不填则为模拟时的概率. Defaults to None.
+
+        Returns:
+            tuple[float, float]: (估计值, 标准误)
+        """
+        if key not in self.__evaluated:
+            raise KeyError(f"没有记录到概率标识{key}")
+        theta = (params or {}).get(key, self.__probabilities[key])
+        weights = self.__weightsOf(params)
+        scores = self.__scores(key, theta)
+        return self.__estimate([
+            w * score for w, score, hit in zip(weights, scores, self.__indicator(name, ranking_num)) if hit
+        ])
+    def effectiveSampleSize(self, params: dict[str, float] | None = None) -> float:
+        """
+        新概率下的有效样本数 (Σw)² / Σw²，远小于模拟次数时说明新概率离模拟时的概率太远，估计不可靠
+
+        Args:
+            params (dict[str, float] | None, optional): 新的概率. Defaults to None.
+
+        Returns:
+            float: 有效样本数
+        """
+        weights = self.__weightsOf(params)
+        square_sum = sum(w * w for w in weights)
+        if square_sum == 0:
+            return 0.0
+        return sum(weights) ** 2 / square_sum
+    def sweep(self, name: str, ranking_num: int, key: str, values: list[float]) -> list[tuple[float, float, float, float]]:
+        """
+        扫描一个概率参数
+
+        Args:
+            name (str): 角色名
+            ranking_num (int): 排名
+            key (str): 概率标识
+            values (list[float]): 扫描的概率
+
+        Returns:
+            list[tuple[float, float, float, float]]: (概率, 估计值, 标准误, 有效样本数)列表
+        """
+        final_return: list[tuple[float, float, float, float]] = []
+        for value in values:
+            params = {key: value}
+            estimate, error = self.probability(name, ranking_num, params)
+            final_return.append((value, estimate, error, self.effectiveSampleSize(params)))
+        return final_return
+
+    def toProbability(self, params: dict[str, float] | None = None) -> dict[str, dict[int, str]]:
+        """
+        转为和EventProcessor.resultsToProbability相同的格式，可直接用于exampleOutput
+
+        Args:
+            params (dict[str, float] | None, optional): 新的概率. Defaults to None.
+
+        Returns:
+            dict[str, dict[int, str]]: 角色对应排名概率，格式为 估计值±标准误
+        """
+        final_return: dict[str, dict[int, str]] = {}
+        for name in self.__names:
+            for ranking_num in sorted(set(self.__ranking)):
+                estimate, error = self.probability(name, ranking_num, params)
+                if estimate > 0:
+                    final_return.setdefault(name, {})[ranking_num] = "{:.4%}±{:.4%}".format(estimate, error)
+        return final_return
+
+    def __init__(self) -> None:
+        self.__times = 0
+        self.__names: list[str] = []
+        self.__ranking = array("q")
+        self.__weights = array("d")
+        self.__evaluated: dict[str, array] = {}
+        self.__passed: dict[str, array] = {}
+        self.__probabilities: dict[str, float] = {}
+
+
+def sensitivityRuns(processor: EventProcessor,
+                    times: int,
+                    sampler: Sampler | None = None,
+                    keys: list[str] | None = None) -> SensitivityResult:
+    """
+    多次模拟运行并记录概率条件，用于之后在其它概率下加权估计
+
+    例：菲比的技能概率从0.5改为0.3和0.7时菲比获得第一的概率
+        result = sensitivityRuns(ep, 100000)
+        result.sweep("菲比", 1, "菲比的技能", [0.3, 0.5, 0.7])
+        result.derivative("菲比", 1, "菲比的技能")
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        times (int): 运行次数
+        sampler (Sampler | None, optional): 抽样使用的采样器，可以是重要性采样器，不填则使用处理器的采样器. Defaults to None.
+        keys (list[str] | None, optional): 需要记录的概率标识，不填则记录全部. Defaults to None.
+
+    Returns:
+        SensitivityResult: 结果
+    """
+    recorder = ChanceRecorder(processor.sampler() if sampler is None else sampler, keys)
+    result = SensitivityResult()
+    for i in range(times):
+        data = processor.runRace(processor.newRaceData(recorder))
+        result.add(data, recorder.counts(), recorder.weight())
+    result.setProbabilities(recorder.probabilities())
+    return result
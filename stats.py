@@ -0,0 +1,415 @@
+from array import array
+from math import exp, lgamma, log
+from typing import TYPE_CHECKING
+from globals import *
+
+if TYPE_CHECKING:
+    from module import EventData, EventProcessor
+
+
+def _gammaQ(a: float, x: float) -> float:
+    """
+    正则化上不完全伽马函数 Q(a, x)，用于计算卡方分布的p值
+    """
+    if x <= 0:
+        return 1.0
+    if x < a + 1:
+        # 级数展开求P，再取1 - P
+        term = total = 1 / a
+        n = a
+        for _ in range(1000):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1 - total * exp(-x + a * log(x) - lgamma(a)))
+    # 连分式求Q
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, exp(-x + a * log(x) - lgamma(a)) * h)
+
+
+def chiSquarePValue(statistic: float, dof: int) -> float:
+    """
+    卡方分布的上尾概率
+
+    Args:
+        statistic (float): 统计量
+        dof (int): 自由度
+
+    Returns:
+        float: p值
+    """
+    if dof <= 0:
+        return 1.0
+    return _gammaQ(dof / 2, statistic / 2)
+
+
+def chiSquareTest(counts_a: dict[Any, int], counts_b: dict[Any, int]) -> tuple[float, int, float]:
+    """
+    两组计数的卡方齐性检验，检验两组是否来自同一分布
+
+    Args:
+        counts_a (dict[Any, int]): 第一组 类别: 次数
+        counts_b (dict[Any, int]): 第二组 类别: 次数
+
+    Returns:
+        tuple[float, int, float]: (统计量, 自由度, p值)
+    """
+    total_a = sum(counts_a.values())
+    total_b = sum(counts_b.values())
+    total = total_a + total_b
+    if total_a == 0 or total_b == 0:
+        return 0.0, 0, 1.0
+    statistic = 0.0
+    categories = 0
+    for key in set(counts_a) | set(counts_b):
+        a = counts_a.get(key, 0)
+        b = counts_b.get(key, 0)
+        if a + b == 0:
+            continue
+        categories += 1
+        expected_a = (a + b) * total_a / total
+        expected_b = (a + b) * total_b / total
+        statistic += (a - expected_a) ** 2 / expected_a + (b - expected_b) ** 2 / expected_b
+    dof = categories - 1
+    return statistic, dof, chiSquarePValue(statistic, dof)
+
+
+def _pool(counts_a: dict[Any, int], counts_b: dict[Any, int], min_expected: float) -> list[tuple[int, int]]:
+    """
+    将两组计数按类别对齐，期望次数小于min_expected的类别合并为一类
+    """
+    total_a = sum(counts_a.values())
+    total_b = sum(counts_b.values())
+    total = total_a + total_b
+    cells: list[tuple[int, int]] = []
+    rest_a = rest_b = 0
+    for key in set(counts_a) | set(counts_b):
+        a = counts_a.get(key, 0)
+        b = counts_b.get(key, 0)
+        if (a + b) * min(total_a, total_b) / total < min_expected:
+            rest_a += a
+            rest_b += b
+        else:
+            cells.append((a, b))
+    if rest_a + rest_b > 0:
+        cells.append((rest_a, rest_b))
+    return cells
+
+
+def gTest(counts_a: dict[Any, int], counts_b: dict[Any, int], min_expected: float = 5) -> tuple[float, int, float]:
+    """
+    两组计数的G检验（似然比检验），期望次数过小的类别会被合并
+
+    Args:
+        counts_a (dict[Any, int]): 第一组 类别: 次数
+        counts_b (dict[Any, int]): 第二组 类别: 次数
+        min_expected (float, optional): 类别的最小期望次数. Defaults to 5.
+
+    Returns:
+        tuple[float, int, float]: (统计量, 自由度, p值)
+    """
+    total_a = sum(counts_a.values())
+    total_b = sum(counts_b.values())
+    total = total_a + total_b
+    if total_a == 0 or total_b == 0:
+        return 0.0, 0, 1.0
+    statistic = 0.0
+    cells = _pool(counts_a, counts_b, min_expected)
+    for a, b in cells:
+        for observed, group_total in ((a, total_a), (b, total_b)):
+            if observed > 0:
+                statistic += 2 * observed * log(observed / ((a + b) * group_total / total))
+    dof = len(cells) - 1
+    return statistic, dof, chiSquarePValue(statistic, dof)
+
+
+def pooledChiSquareTest(counts_a: dict[Any, int], counts_b: dict[Any, int], min_expected: float = 5) -> tuple[float, int, float]:
+    """
+    同chiSquareTest，但期望次数过小的类别会被合并，适合类别很多的完整名次分布
+
+    Args:
+        counts_a (dict[Any, int]): 第一组 类别: 次数
+        counts_b (dict[Any, int]): 第二组 类别: 次数
+        min_expected (float, optional): 类别的最小期望次数. Defaults to 5.
+
+    Returns:
+        tuple[float, int, float]: (统计量, 自由度, p值)
+    """
+    cells = _pool(counts_a, counts_b, min_expected)
+    return chiSquareTest(
+        {i: a for i, (a, b) in enumerate(cells)},
+        {i: b for i, (a, b) in enumerate(cells)},
+    )
+
+
+class SkillStats:
+    """
+    多局的技能发动统计
+
+    对初始数据中每个角色的每个技能（以 角色名, 技能名 区分，不含临时技能）统计：
+    发动总次数、发动过的局数、每局发动次数的分布、按每局发动次数分组的技能所有者排名分布
+
+    数据保存在array中，可通过merge合并多个线程或机器的结果，通过toDict/fromDict传输
+    """
+
+# 统计
+    def add(self, data: "EventData"):
+        """
+        计入一局结束后的数据
+
+        Args:
+            data (EventData): 结束的本局数据
+        """
+        index = self.__index
+        cap = self.__maxFires
+        width = self.__width
+        fires = self.__fires
+        fired_races = self.__firedRaces
+        histogram = self.__histogram
+        ranking = self.__ranking
+        self.__races += 1
+        for role, ranking_num in data.rankingOfRoles().items():
+            role_name = role.name()
+            for skill in role.skills():
+                i = index.get((role_name, skill.name()))
+                if i is None:
+                    continue
+                times = skill.effectTimes()
+                fires[i] += times
+                if times:
+                    fired_races[i] += 1
+                bucket = times if times < cap else cap
+                histogram[i * (cap + 1) + bucket] += 1
+                ranking[(i * (cap + 1) + bucket) * width + ranking_num] += 1
+    def merge(self, other: "SkillStats") -> "SkillStats":
+        """
+        将另一个统计合并到自身，两者的技能列表和max_fires必须相同
+
+        Args:
+            other (SkillStats): 另一个统计
+
+        Returns:
+            SkillStats: 自身
+        """
+        if other.__keys != self.__keys or other.__maxFires != self.__maxFires or other.__width != self.__width:
+            raise ValueError("技能统计的技能列表或参数不同，无法合并")
+        self.__races += other.__races
+        for mine, theirs in (
+                (self.__fires, other.__fires),
+                (self.__firedRaces, other.__firedRaces),
+                (self.__histogram, other.__histogram),
+                (self.__ranking, other.__ranking),
+                ):
+            for i, value in enumerate(theirs):
+                mine[i] += value
+        return self
+
+# 查询
+    def skills(self) -> list[tuple[str, str]]:
+        """
+        返回统计的技能列表
+
+        Returns:
+            list[tuple[str, str]]: (角色名, 技能名)列表
+        """
+        return list(self.__keys)
+    def races(self) -> int:
+        """
+        返回统计的局数
+        """
+        return self.__races
+    def __i(self, role_name: str, skill_name: str) -> int:
+        i = self.__index.get((role_name, skill_name))
+        if i is None:
+            raise KeyError(f"没有统计技能：{role_name} {skill_name}")
+        return i
+
+    def fireRate(self, role_name: str, skill_name: str) -> float:
+        """
+        技能至少发动一次的局数占比
+
+        Args:
+            role_name (str): 角色名
+            skill_name (str): 技能名
+
+        Returns:
+            float: 占比
+        """
+        if self.__races == 0:
+            return 0.0
+        return self.__firedRaces[self.__i(role_name, skill_name)] / self.__races
+    def firesPerRace(self, role_name: str, skill_name: str) -> float:
+        """
+        平均每局发动次数
+
+        Args:
+            role_name (str): 角色名
+            skill_name (str): 技能名
+
+        Returns:
+            float: 次数
+        """
+        if self.__races == 0:
+            return 0.0
+        return self.__fires[self.__i(role_name, skill_name)] / self.__races
+    def fireHistogram(self, role_name: str, skill_name: str) -> list[int]:
+        """
+        每局发动次数的分布，下标为发动次数，最后一项为发动max_fires次及以上
+
+        Args:
+            role_name (str): 角色名
+            skill_name (str): 技能名
+
+        Returns:
+            list[int]: 局数
+        """
+        cap = self.__maxFires
+        i = self.__i(role_name, skill_name)
+        return list(self.__histogram[i * (cap + 1):(i + 1) * (cap + 1)])
+    def rankingGivenFires(self, role_name: str, skill_name: str, fires: int) -> dict[int, int]:
+        """
+        技能在一局中发动fires次时，其所有者的排名次数
+
+        Args:
+            role_name (str): 角色名
+            skill_name (str): 技能名
+            fires (int): 发动次数，大于等于max_fires时为max_fires及以上
+
+        Returns:
+            dict[int, int]: 排名: 次数
+        """
+        cap = self.__maxFires
+        width = self.__width
+        start = (self.__i(role_name, skill_name) * (cap + 1) + min(fires, cap)) * width
+        row = self.__ranking[start:start + width]
+        return {ranking_num: row[ranking_num] for ranking_num in range(1, width) if row[ranking_num]}
+    def rankingProbability(self, role_name: str, skill_name: str, ranking_num: int = 1, fired: bool | None = None) -> float:
+        """
+        技能所有者获得某一排名的条件概率
+
+        例：赞妮的技能发动过时赞妮获得第一的概率
+            stats.rankingProbability("赞妮", "赞妮的技能", 1, True)
+
+        Args:
+            role_name (str): 角色名
+            skill_name (str): 技能名
+            ranking_num (int, optional): 排名. Defaults to 1.
+            fired (bool | None, optional): True为发动过的局，False为没有发动的局，None为全部. Defaults to None.
+
+        Returns:
+            float: 概率，没有满足条件的局时为0
+        """
+        cap = self.__maxFires
+        histogram = self.fireHistogram(role_name, skill_name)
+        match fired:
+            case None:
+                buckets = range(cap + 1)
+            case True:
+                buckets = range(1, cap + 1)
+            case False:
+                buckets = range(0, 1)
+        races = sum(histogram[bucket] for bucket in buckets)
+        if races == 0:
+            return 0.0
+        hits = sum(self.rankingGivenFires(role_name, skill_name, bucket).get(ranking_num, 0) for bucket in buckets)
+        return hits / races
+
+# 传输
+    def toDict(self) -> dict:
+        """
+        转为可JSON序列化的字典
+
+        Returns:
+            dict: 字典
+        """
+        return {
+            "keys": [list(key) for key in self.__keys],
+            "roles": self.__width - 1,
+            "max_fires": self.__maxFires,
+            "races": self.__races,
+            "fires": self.__fires.tolist(),
+            "fired_races": self.__firedRaces.tolist(),
+            "histogram": self.__histogram.tolist(),
+            "ranking": self.__ranking.tolist(),
+        }
+    @classmethod
+    def fromDict(cls, value: dict) -> "SkillStats":
+        """
+        从toDict的结果恢复
+
+        Args:
+            value (dict): 字典
+
+        Returns:
+            SkillStats: 统计
+        """
+        stats = cls([tuple(key) for key in value["keys"]], value["roles"], value["max_fires"])
+        stats.__races = value["races"]
+        stats.__fires = array("q", value["fires"])
+        stats.__firedRaces = array("q", value["fired_races"])
+        stats.__histogram = array("q", value["histogram"])
+        stats.__ranking = array("q", value["ranking"])
+        return stats
+    @classmethod
+    def of(cls, processor: "EventProcessor", max_fires: int = 15) -> "SkillStats":
+        """
+        为事件处理器当前的角色配置创建空的统计
+
+        Args:
+            processor (EventProcessor): 事件处理器
+            max_fires (int, optional): 发动次数分组的上限. Defaults to 15.
+
+        Returns:
+            SkillStats: 统计
+        """
+        roles = processor.initData2().roles()
+        keys = [(role.name(), skill.name()) for role in roles for skill in role.skills()]
+        return cls(keys, len(roles), max_fires)
+    def empty(self) -> "SkillStats":
+        """
+        返回技能列表和参数相同的空统计，一般用于每个线程各自统计后合并
+
+        Returns:
+            SkillStats: 空统计
+        """
+        return SkillStats(self.__keys, self.__width - 1, self.__maxFires)
+
+    def __init__(self, keys: list[tuple[str, str]], role_num: int, max_fires: int = 15) -> None:
+        """
+        技能统计，一般通过SkillStats.of创建
+
+        Args:
+            keys (list[tuple[str, str]]): (角色名, 技能名)列表
+            role_num (int): 角色数，即最大排名
+            max_fires (int, optional): 发动次数分组的上限. Defaults to 15.
+        """
+        self.__keys: list[tuple[str, str]] = list(keys)
+        self.__index: dict[tuple[str, str], int] = {}
+        for i, key in enumerate(self.__keys):
+            self.__index.setdefault(key, i)
+        self.__maxFires = max_fires
+        self.__width = role_num + 1
+        size = len(self.__keys)
+        self.__races = 0
+        self.__fires = array("q", bytes(8 * size))
+        self.__firedRaces = array("q", bytes(8 * size))
+        self.__histogram = array("q", bytes(8 * size * (max_fires + 1)))
+        self.__ranking = array("q", bytes(8 * size * (max_fires + 1) * self.__width))
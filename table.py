@@ -0,0 +1,284 @@
+import mmap, struct, os
+from math import sqrt
+from itertools import combinations
+from globals import *
+from module import EventProcessor
+
+"""     排名概率查找表
+离线为内置角色的所有阵容（角色的非空子集，按ROSTER顺序添加）和所有赛道长度预先模拟，
+保存为定长记录的二进制文件，运行时用mmap打开，按(阵容, 长度)直接计算偏移读取，查找为O(1)。
+
+文件格式（小端）：
+    文件头  MAGIC(8字节) 版本 角色数R 最小长度 最大长度 (4个uint32)
+    角色名  R个 (uint16长度 + UTF-8)
+    记录    按 (阵容位掩码 - 1)·长度数 + (长度 - 最小长度) 排列，
+            每条为 模拟局数(uint64) + R×R个排名次数(uint32，第i个角色获得第j名的次数，不在阵容中的角色为0)
+
+python table.py 文件路径 [每格局数] [进程数] 生成查找表
+"""
+
+
+ROSTER: list[tuple[str, str]] = [
+    ("菲比", "addPhoebe"),
+    ("赞妮", "addZaNi"),
+    ("布兰特", "addBrant"),
+    ("洛可可", "addRoccia"),
+]
+MAGIC = b"DANGOTBL"
+VERSION = 1
+_HEADER = struct.Struct("<8sIIII")
+
+
+def _lineupMasks(size: int) -> list[int]:
+    """
+    所有阵容的位掩码，按人数从少到多
+    """
+    return [
+        sum(1 << i for i in members)
+        for count in range(1, size + 1)
+        for members in combinations(range(size), count)
+    ]
+
+
+def _simulateCell(mask: int, length: int, times: int, roster: list[tuple[str, str]]) -> tuple[int, int, list[int]]:
+    """
+    模拟一格，使用编译后的引擎，第i局使用种子i
+
+    Returns:
+        tuple[int, int, list[int]]: (位掩码, 长度, R×R个排名次数)
+    """
+    ep = EventProcessor(length)
+    for i, (_, add_name) in enumerate(roster):
+        if mask >> i & 1:
+            getattr(ep, add_name)()
+    result = ep.compile().runsSeedRange(0, times)
+    size = len(roster)
+    counts = [0] * (size * size)
+    for i, (name, _) in enumerate(roster):
+        for ranking_num, count in result.get(name, {}).items():
+            counts[i * size + ranking_num - 1] = count
+    return mask, length, counts
+
+
+def buildTable(path: str,
+               times: int = 100000,
+               lengths: range = range(10, 41),
+               roster: list[tuple[str, str]] | None = None,
+               workers: int | None = None):
+    """
+    生成查找表
+
+    Args:
+        path (str): 文件路径
+        times (int, optional): 每格的模拟局数. Defaults to 100000.
+        lengths (range, optional): 赛道长度范围，步长必须为1. Defaults to range(10, 41).
+        roster (list[tuple[str, str]] | None, optional): (角色名, 添加函数名)列表，不填则为ROSTER. Defaults to None.
+        workers (int | None, optional): 进程数，1为在当前进程中模拟，不填则为CPU数. Defaults to None.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if roster is None:
+        roster = ROSTER
+    if lengths.step != 1 or len(lengths) == 0:
+        raise ValueError("赛道长度必须是连续的")
+    size = len(roster)
+    record = struct.Struct(f"<Q{size * size}I")
+    cells = [(mask, length) for mask in _lineupMasks(size) for length in lengths]
+    records: dict[tuple[int, int], list[int]] = {}
+
+    startTime = time.time()
+    if workers == 1:
+        for mask, length in cells:
+            records[(mask, length)] = _simulateCell(mask, length, times, roster)[2]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_simulateCell, mask, length, times, roster) for mask, length in cells]
+            for future in futures:
+                mask, length, counts = future.result()
+                records[(mask, length)] = counts
+    logger.info(f"查找表模拟完成，共{len(cells)}格，用时{time.time() - startTime}秒")
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, size, lengths.start, lengths.stop - 1))
+        for name, _ in roster:
+            encoded = name.encode("utf-8")
+            file.write(struct.pack("<H", len(encoded)) + encoded)
+        for mask in range(1, 1 << size):
+            for length in lengths:
+                counts = records.get((mask, length), [0] * (size * size))
+                file.write(record.pack(times if (mask, length) in records else 0, *counts))
+    os.replace(temp_path, path)
+
+
+class TableCell:
+    """
+    查找表中的一格
+    """
+
+    def samples(self) -> int:
+        """
+        返回模拟局数
+        """
+        return self.__samples
+    def count(self, name: str, ranking_num: int) -> int:
+        """
+        返回角色获得某一排名的次数
+
+        Args:
+            name (str): 角色名
+            ranking_num (int): 排名
+
+        Returns:
+            int: 次数
+        """
+        i = self.__index[name]
+        if not 1 <= ranking_num <= self.__size:
+            return 0
+        return self.__counts[i * self.__size + ranking_num - 1]
+    def probability(self, name: str, ranking_num: int = 1) -> tuple[float, float]:
+        """
+        返回角色获得某一排名的概率
+
+        Args:
+            name (str): 角色名
+            ranking_num (int, optional): 排名. Defaults to 1.
+
+        Returns:
+            tuple[float, float]: (概率, 标准误)
+        """
+        n = self.__samples
+        if n == 0:
+            return 0.0, 0.0
+        p = self.count(name, ranking_num) / n
+        return p, sqrt(p * (1 - p) / n)
+    def toResult(self) -> dict[str, dict[int, int]]:
+        """
+        转为与runs相同格式的结果
+
+        Returns:
+            dict[str, dict[int, int]]: 运行结果
+        """
+        final_return: dict[str, dict[int, int]] = {}
+        for name in self.__lineup:
+            counts = {ranking_num: self.count(name, ranking_num) for ranking_num in range(1, self.__size + 1)}
+            final_return[name] = {ranking_num: count for ranking_num, count in counts.items() if count}
+        return final_return
+
+    def __init__(self, lineup: list[str], index: dict[str, int], size: int, samples: int, counts: tuple[int, ...]) -> None:
+        self.__lineup = lineup
+        self.__index = index
+        self.__size = size
+        self.__samples = samples
+        self.__counts = counts
+
+
+class RankTable:
+    """
+    用mmap打开的查找表
+
+    例：
+        table = RankTable("table.bin")
+        table.probability(["菲比", "赞妮", "布兰特"], 23, "菲比", 1)
+    """
+
+    def cell(self, lineup: list[str], length: int) -> TableCell:
+        """
+        读取一格
+
+        Args:
+            lineup (list[str]): 阵容中的角色名，忽略传入的顺序：表中的结果是按建表时的角色顺序（默认为ROSTER）添加角色模拟的，
+                添加顺序会影响结果（如落地时findAndSetBottomRole取列表中第一个匹配的角色）
+            length (int): 赛道长度
+
+        Returns:
+            TableCell: 查找表中的一格
+        """
+        mask = 0
+        for name in lineup:
+            i = self.__index.get(name)
+            if i is None:
+                raise KeyError(f"查找表中没有角色{name}")
+            mask |= 1 << i
+        if mask == 0:
+            raise ValueError("阵容不能为空")
+        if not self.__minLength <= length <= self.__maxLength:
+            raise KeyError(f"查找表只包含长度{self.__minLength} ~ {self.__maxLength}")
+        offset = self.__offset + ((mask - 1) * self.__lengthCount + length - self.__minLength) * self.__record.size
+        samples, *counts = self.__record.unpack_from(self.__map, offset)
+        return TableCell([name for name in self.__names if mask >> self.__index[name] & 1],
+                         self.__index, self.__size, samples, tuple(counts))
+    def probability(self, lineup: list[str], length: int, name: str, ranking_num: int = 1) -> tuple[float, float]:
+        """
+        查询角色获得某一排名的概率
+
+        Args:
+            lineup (list[str]): 阵容中的角色名，忽略传入的顺序，见cell
+            length (int): 赛道长度
+            name (str): 角色名
+            ranking_num (int, optional): 排名. Defaults to 1.
+
+        Returns:
+            tuple[float, float]: (概率, 标准误)
+        """
+        return self.cell(lineup, length).probability(name, ranking_num)
+    def names(self) -> list[str]:
+        """
+        返回查找表中的角色名
+        """
+        return list(self.__names)
+    def lengths(self) -> range:
+        """
+        返回查找表中的赛道长度
+        """
+        return range(self.__minLength, self.__maxLength + 1)
+
+    def close(self):
+        self.__map.close()
+        self.__file.close()
+    def __enter__(self) -> "RankTable":
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+    def __init__(self, path: str) -> None:
+        """
+        打开查找表
+
+        Args:
+            path (str): 由buildTable生成的文件路径
+        """
+        self.__file = open(path, "rb")
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, size, min_length, max_length = _HEADER.unpack_from(self.__map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("查找表文件格式错误")
+        offset = _HEADER.size
+        self.__names: list[str] = []
+        for i in range(size):
+            (name_size,) = struct.unpack_from("<H", self.__map, offset)
+            self.__names.append(bytes(self.__map[offset + 2:offset + 2 + name_size]).decode("utf-8"))
+            offset += 2 + name_size
+        self.__index = {name: i for i, name in enumerate(self.__names)}
+        self.__size = size
+        self.__minLength = min_length
+        self.__maxLength = max_length
+        self.__lengthCount = max_length - min_length + 1
+        self.__record = struct.Struct(f"<Q{size * size}I")
+        self.__offset = offset
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level = logging.ERROR)
+    match sys.argv[1:]:
+        case [path]:
+            buildTable(path)
+        case [path, times]:
+            buildTable(path, int(times))
+        case [path, times, workers]:
+            buildTable(path, int(times), workers = int(workers))
+        case _:
+            print("用法：python table.py 文件路径 [每格局数] [进程数]")
+            sys.exit(1)
+    print(f"查找表已保存到{sys.argv[1]}")
@@ -0,0 +1,202 @@
+import json, queue, threading
+from globals import *
+from module import EventTrigger, EventData, EventProcessor, Skill
+from rng import BlockSampler
+
+"""     结构化追踪
+打开INFO/DEBUG日志审计技能时，每条日志都要同步格式化并写到stderr，大量模拟几乎无法进行。
+追踪模式不经过logging：用EventProcessor.raceSteps逐步推进每局，在每个时机把紧凑的记录元组放进当前批次，
+批次满了交给有界队列，由后台线程写成JSONL文件，模拟线程只做追加元组。
+
+文件第一行为文件头 {"campaign": 名称, "names": 角色名, "fields": 字段名}，之后每行一条记录（JSON数组）：
+    [局号, 回合, 时机, 角色名, 技能名, 值]
+    时机为round_start、move_before、move_end、game_end，另有"skill"表示技能发动（记录在发动的时机之前）
+    值的含义：move_before为移动格数，move_end为到达的格数，game_end为排名，skill为该技能发动后的移动格数，其余为null
+    技能发动通过本局数据的技能钩子（EventData.setSkillHook）在发动处记录，临时技能和发动后被删除的技能也会记录
+    game_start和move_begin没有额外信息，不记录
+
+写入比模拟慢时队列会满，模拟线程等待写入线程，内存占用不会无限增长
+"""
+
+
+FIELDS = ("race", "round", "trigger", "role", "skill", "value")
+
+
+class TraceWriter:
+    """
+    后台写入追踪记录的线程
+
+    例：
+        with TraceWriter("trace.jsonl", "测试") as writer:
+            tracedRuns(ep, 100000, writer)
+    """
+
+    def put(self, batch: list[tuple]):
+        """
+        提交一批记录，队列满时等待
+
+        Args:
+            batch (list[tuple]): 记录列表，提交后不应再修改
+        """
+        if self.__closed:
+            raise ValueError("追踪写入器已关闭")
+        self.__queue.put(batch)
+    def written(self) -> int:
+        """
+        返回已写入的记录数
+        """
+        return self.__written
+    def close(self):
+        """
+        写完队列中剩余的记录并关闭文件
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__queue.put(None)
+        self.__thread.join()
+        if self.__error is not None:
+            raise self.__error
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+    def __write(self):
+        # 字符串只有角色名、技能名和时机，数量很少，缓存它们的JSON编码，每条记录只需一次格式化
+        encoded: dict[str | None, str] = {None: "null"}
+        def encode(value: str | None) -> str:
+            text = encoded.get(value)
+            if text is None:
+                text = encoded[value] = json.dumps(value, ensure_ascii = False)
+            return text
+        try:
+            with open(self.__path, "w", encoding = "utf-8") as file:
+                file.write(json.dumps(self.__header, ensure_ascii = False) + "\n")
+                while(True):
+                    batch = self.__queue.get()
+                    if batch is None:
+                        break
+                    file.write("".join([
+                        f"[{race},{round_num},{encode(trigger)},{encode(role)},{encode(skill)},{'null' if value is None else value}]\n"
+                        for race, round_num, trigger, role, skill, value in batch
+                    ]))
+                    self.__written += len(batch)
+        except BaseException as e:
+            self.__error = e
+            # 继续取出队列，避免模拟线程永远等待
+            while self.__queue.get() is not None:
+                pass
+
+    def __init__(self, path: str, campaign: str = "", names: list[str] | None = None, max_batches: int = 64) -> None:
+        """
+        后台追踪写入器
+
+        Args:
+            path (str): JSONL文件路径，已存在时覆盖
+            campaign (str, optional): 本次追踪的名称，写入文件头. Defaults to "".
+            names (list[str] | None, optional): 角色名，写入文件头. Defaults to None.
+            max_batches (int, optional): 队列中最多等待的批次数. Defaults to 64.
+        """
+        self.__path = path
+        self.__header = {"campaign": campaign, "names": names or [], "fields": list(FIELDS)}
+        self.__queue: queue.Queue[list[tuple] | None] = queue.Queue(max_batches)
+        self.__written = 0
+        self.__closed = False
+        self.__error: BaseException | None = None
+        self.__thread = threading.Thread(target = self.__write, name = "trace-writer", daemon = True)
+        self.__thread.start()
+
+
+class Tracer:
+    """
+    逐步模拟一局并生成追踪记录，记录先放入本地批次，批次满后交给写入器
+    """
+
+    def traceRace(self, processor: EventProcessor, data: EventData, race_id: int) -> EventData:
+        """
+        模拟一局并记录，结果与runRace相同
+
+        Args:
+            processor (EventProcessor): 事件处理器
+            data (EventData): 本局数据
+            race_id (int): 局号
+
+        Returns:
+            EventData: 结束的本局数据
+        """
+        batch = self.__batch
+        append = batch.append
+        def skillHook(skill: Skill, data: EventData):
+            owner = skill.owner()
+            self.__batch.append((race_id, data.round(), "skill", None if owner is None else owner.name(), skill.name(), data.moveNum()))
+        data.setSkillHook(skillHook)
+        for trigger in processor.raceSteps(data):
+            match trigger:
+                case EventTrigger.round_start | EventTrigger.move_before:
+                    round_num = data.round()
+                    if trigger is EventTrigger.move_before:
+                        append((race_id, round_num, "move_before", data.nowRole2().name(), None, data.moveNum()))
+                    else:
+                        append((race_id, round_num, "round_start", None, None, None))
+                case EventTrigger.move_end:
+                    role = data.movedRoles()[-1]
+                    append((race_id, data.round(), "move_end", role.name(), None, role.cell()))
+                case EventTrigger.game_end:
+                    round_num = data.round()
+                    for role, ranking_num in data.rankingOfRoles().items():
+                        append((race_id, round_num, "game_end", role.name(), None, ranking_num))
+            if len(batch) >= self.__batchSize:
+                self.flush()
+                batch = self.__batch
+                append = batch.append
+        data.setSkillHook(None)
+        return data
+    def flush(self):
+        """
+        把当前批次交给写入器
+        """
+        if self.__batch:
+            self.__writer.put(self.__batch)
+            self.__batch = []
+
+    def __init__(self, writer: TraceWriter, batch_size: int = 8192) -> None:
+        """
+        追踪器
+
+        Args:
+            writer (TraceWriter): 写入器
+            batch_size (int, optional): 每批的记录数. Defaults to 8192.
+        """
+        self.__writer = writer
+        self.__batchSize = batch_size
+        self.__batch: list[tuple] = []
+
+
+def tracedRuns(processor: EventProcessor, times: int, writer: TraceWriter, seed: int = 0,
+               batch_size: int = 8192) -> dict[str, dict[int, int]]:
+    """
+    多次模拟运行并记录每局的完整过程，第i局使用种子seed + i，局号为种子
+
+    结果与runsSeedRange(seed, seed + times)相同，追踪时应把日志等级设为WARNING或以上
+
+    Args:
+        processor (EventProcessor): 已添加角色的事件处理器
+        times (int): 运行次数
+        writer (TraceWriter): 写入器，由调用者关闭
+        seed (int, optional): 起始种子. Defaults to 0.
+        batch_size (int, optional): 每批的记录数. Defaults to 8192.
+
+    Returns:
+        dict[str, dict[int, int]]: 运行结果
+    """
+    tracer = Tracer(writer, batch_size)
+    sampler = BlockSampler(size = 256)
+    final_return: dict[str, dict[int, int]] = {}
+    for race_seed in range(seed, seed + times):
+        sampler.seed(race_seed)
+        data = tracer.traceRace(processor, processor.newRaceData(sampler), race_seed)
+        processor.countResult(final_return, data)
+    tracer.flush()
+    return final_return
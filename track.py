@@ -0,0 +1,184 @@
+from typing import TYPE_CHECKING
+from globals import *
+
+if TYPE_CHECKING:
+    from module import Role, EventData
+
+"""     赛道
+赛道由长度和特殊格子组成，特殊格子的效果在角色移动结束、落到该格时生效（EventProcessor.moveEnd）。
+
+效果按格数保存在预先生成的数组中，查找为O(1)，没有特殊格子的赛道不做任何查找。
+效果不会连锁：被效果移动到另一个特殊格子时，不会再触发那个格子的效果。
+"""
+
+
+class CellEffect:
+    """
+    格子效果，继承并重写land即可自定义
+    """
+
+    def land(self, data: "EventData", role: "Role"):
+        """
+        角色移动结束落在该格时调用
+
+        Args:
+            data (EventData): 本局数据
+            role (Role): 落在该格的角色（移动的角色，头顶的角色随其一起）
+        """
+        raise NotImplementedError
+    def name(self) -> str:
+        return type(self).__name__
+
+    def __deepcopy__(self, memo):
+        return self                         # 效果只读，各局共享
+
+
+class Boost(CellEffect):
+    """
+    加速格：额外前进num格，头顶的角色一起前进
+    """
+
+    def land(self, data: "EventData", role: "Role"):
+        logger.info(f"{role.name()}触发加速格，前进{self.__num}格")
+        role.move(self.__num, data.roles())
+    def name(self) -> str:
+        return f"前进{self.__num}格"
+
+    def __init__(self, num: int) -> None:
+        if num <= 0:
+            raise ValueError("前进格数必须大于0")
+        self.__num = num
+
+
+class Setback(CellEffect):
+    """
+    减速格：后退num格（最多退回起点），头顶的角色一起后退
+    """
+
+    def land(self, data: "EventData", role: "Role"):
+        num = min(self.__num, role.cell())
+        logger.info(f"{role.name()}触发减速格，后退{num}格")
+        role.move(-num, data.roles())
+    def name(self) -> str:
+        return f"后退{self.__num}格"
+
+    def __init__(self, num: int) -> None:
+        if num <= 0:
+            raise ValueError("后退格数必须大于0")
+        self.__num = num
+
+
+class StackShuffle(CellEffect):
+    """
+    乱序格：落在该格的角色所在的整个堆叠随机重新排列，排列由采样器的moveOrder抽取
+    """
+
+    def land(self, data: "EventData", role: "Role"):
+        bottom = role
+        while bottom.bottomRole() is not None:
+            bottom = bottom.bottomRole()        # type: ignore
+        stack = [bottom] + bottom.findAllHeadRole()
+        if len(stack) < 2:
+            return
+        order = data.sampler().moveOrder(stack)
+        logger.info(f"堆叠乱序为{[member.name() for member in order]}")
+        for member in stack:
+            member.removeHeadRole()
+            member.removeBottomRole()
+        for lower, upper in zip(order, order[1:]):
+            upper.setBottomRole(lower)
+    def name(self) -> str:
+        return "堆叠乱序"
+
+
+class Track:
+    """
+    赛道
+
+    起点为0格，格数大于等于长度即到达终点，特殊格子只能在1 ~ 长度-1格
+    """
+
+    def length(self) -> int:
+        """
+        获取赛道长度
+
+        Returns:
+            int: 长度
+        """
+        return self.__length
+    def effectAt(self, cell: int) -> CellEffect | None:
+        """
+        获取格子的效果
+
+        Args:
+            cell (int): 格数
+
+        Returns:
+            CellEffect | None: 效果，普通格子和终点为None
+        """
+        cells = self.__cells
+        if 0 <= cell < len(cells):
+            return cells[cell]
+        return None
+    def hasEffects(self) -> bool:
+        """
+        是否有特殊格子
+
+        Returns:
+            bool: 是否有
+        """
+        return self.__hasEffects
+    def effects(self) -> dict[int, CellEffect]:
+        """
+        获取所有特殊格子
+
+        Returns:
+            dict[int, CellEffect]: 格数: 效果
+        """
+        return {cell: effect for cell, effect in enumerate(self.__cells) if effect is not None}
+    def setEffect(self, cell: int, effect: CellEffect | None) -> "Track":
+        """
+        设置格子的效果，应在模拟开始前设置
+
+        Args:
+            cell (int): 格数，1 ~ 长度-1
+            effect (CellEffect | None): 效果，None为清除
+
+        Returns:
+            Track: 赛道本身
+        """
+        if not 0 < cell < self.__length:
+            raise ValueError(f"特殊格子只能在1 ~ {self.__length - 1}格")
+        self.__cells[cell] = effect
+        self.__hasEffects = any(effect is not None for effect in self.__cells)
+        return self
+    def cells(self) -> list[CellEffect | None]:
+        """
+        获取按格数索引的效果数组，长度为赛道长度，编译等需要直接查表时使用
+
+        Returns:
+            list[CellEffect | None]: 效果数组
+        """
+        return self.__cells
+
+    def __deepcopy__(self, memo):
+        return self                         # 赛道在对局中只读，各局共享
+
+    def __init__(self, length: int, effects: dict[int, CellEffect] | None = None) -> None:
+        """
+        赛道
+
+        例：
+            Track(23, {5: Boost(2), 12: Setback(1), 17: StackShuffle()})
+
+        Args:
+            length (int): 赛道长度
+            effects (dict[int, CellEffect] | None, optional): 格数: 效果. Defaults to None.
+        """
+        if length <= 0:
+            raise ValueError("赛道长度必须大于0")
+        self.__length = length
+        self.__cells: list[CellEffect | None] = [None] * length
+        self.__hasEffects = False
+        for cell, effect in (effects or {}).items():
+            self.setEffect(cell, effect)